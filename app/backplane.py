@@ -0,0 +1,254 @@
+"""
+Шина рассылки между процессами (backplane)
+
+Рассылка идет через шину: процесс публикует кадр, а все подписанные
+процессы (включая отправителя) получают его и раздают своим клиентам.
+Так несколько воркеров uvicorn на разных ядрах и машинах обслуживают
+общие комнаты.
+"""
+import os
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import asyncpg
+
+from .database import ASYNCPG_DSN
+
+logger = logging.getLogger("backplane")
+
+# memory - рассылка только внутри процесса (один воркер)
+# postgres - LISTEN/NOTIFY через ту же PostgreSQL, что хранит сообщения
+BACKPLANE = os.getenv("BACKPLANE", "memory").lower()
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "chat_broadcast")
+
+# Ограничение PostgreSQL на размер payload у NOTIFY
+NOTIFY_PAYLOAD_LIMIT = 7999
+
+# Префикс payload: кадр сообщения чата (попадает в историю) или служебный.
+# Для сообщения чата за префиксом идут его id и комната: "m123 general {...}".
+# Пакет сообщений: комната, пары id:длина кадра и кадры подряд без разделителей:
+# "bgeneral 123:97,124:101 {...}{...}"
+# Статистика воркера (не кадр для клиентов): шард и JSON: "shost:123 {...}"
+KIND_MESSAGE = "m"
+KIND_BATCH = "b"
+KIND_FRAME = "f"
+KIND_STATS = "s"
+
+# Сообщение пакета: (id, JSON-кадр сообщения)
+Entry = Tuple[int, str]
+
+Handler = Callable[[str, Optional[int], Optional[str]], None]
+BatchHandler = Callable[[str, List[Entry]], None]
+# (шард, JSON статистики)
+StatsHandler = Callable[[str, str], None]
+
+
+class Backplane:
+    """
+    Базовый интерфейс шины.
+
+    Подписчик регистрируется через subscribe() и вызывается как
+    handler(frame, message_id, room) для каждого опубликованного кадра
+    в порядке, общем для всех процессов. message_id и room заданы
+    только для сообщений чата; кадр без комнаты получают все клиенты.
+    Пакеты сообщений одной комнаты передаются как batch_handler(room, entries),
+    статистика воркеров - как stats_handler(shard, stats).
+    """
+    name = "base"
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+        self._batch_handler: Optional[BatchHandler] = None
+        self._stats_handler: Optional[StatsHandler] = None
+
+    def subscribe(
+        self,
+        handler: Handler,
+        batch_handler: Optional[BatchHandler] = None,
+        stats_handler: Optional[StatsHandler] = None,
+    ) -> None:
+        self._handler = handler
+        self._batch_handler = batch_handler
+        self._stats_handler = stats_handler
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, frame: str, message_id: Optional[int] = None, room: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    async def publish_batch(self, room: str, entries: List[Entry]) -> None:
+        raise NotImplementedError
+
+    async def publish_stats(self, shard: str, stats: str) -> None:
+        raise NotImplementedError
+
+    def _deliver(self, frame: str, message_id: Optional[int], room: Optional[str]) -> None:
+        if self._handler is not None:
+            self._handler(frame, message_id, room)
+
+    def _deliver_batch(self, room: str, entries: List[Entry]) -> None:
+        if self._batch_handler is not None:
+            self._batch_handler(room, entries)
+
+    def _deliver_stats(self, shard: str, stats: str) -> None:
+        if self._stats_handler is not None:
+            self._stats_handler(shard, stats)
+
+
+class InProcessBackplane(Backplane):
+    """Шина внутри одного процесса: кадр сразу отдается подписчику."""
+    name = "memory"
+
+    async def publish(self, frame: str, message_id: Optional[int] = None, room: Optional[str] = None) -> None:
+        self._deliver(frame, message_id, room)
+
+    async def publish_batch(self, room: str, entries: List[Entry]) -> None:
+        self._deliver_batch(room, entries)
+
+    async def publish_stats(self, shard: str, stats: str) -> None:
+        self._deliver_stats(shard, stats)
+
+
+class PostgresBackplane(Backplane):
+    """
+    Шина на PostgreSQL LISTEN/NOTIFY.
+
+    Использует два отдельных соединения asyncpg вне пула SQLAlchemy:
+    одно слушает канал, второе публикует. PostgreSQL доставляет
+    уведомления всем слушателям в порядке фиксации транзакций, поэтому
+    все процессы видят сообщения в одинаковом порядке.
+    """
+    name = "postgres"
+
+    def __init__(self, dsn: Optional[str] = None, channel: str = BACKPLANE_CHANNEL):
+        super().__init__()
+        self.dsn = dsn or ASYNCPG_DSN
+        self.channel = channel
+        self._listen_conn: Optional[asyncpg.Connection] = None
+        self._publish_conn: Optional[asyncpg.Connection] = None
+        self._publish_lock = asyncio.Lock()
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self) -> None:
+        self._closing = False
+        await self._listen()
+        self._publish_conn = await asyncpg.connect(self.dsn)
+        logger.info(f"Backplane PostgreSQL слушает канал {self.channel}")
+
+    async def stop(self) -> None:
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        self._listen_conn = self._publish_conn = None
+
+    async def publish(self, frame: str, message_id: Optional[int] = None, room: Optional[str] = None) -> None:
+        if message_id is None:
+            payload = KIND_FRAME + frame
+        else:
+            payload = f"{KIND_MESSAGE}{message_id} {room} {frame}"
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            # Такой кадр нельзя передать через NOTIFY, раздаем только своим клиентам
+            logger.error(f"Кадр {len(payload)} байт не помещается в NOTIFY, разослан локально")
+            self._deliver(frame, message_id, room)
+            return
+
+        await self._notify(payload)
+
+    async def publish_batch(self, room: str, entries: List[Entry]) -> None:
+        """
+        Публикует пакет. Если он не помещается в один NOTIFY, делится
+        на несколько пакетов по порядку.
+        """
+        chunk: List[Entry] = []
+        size = len(room) + 3
+        for entry in entries:
+            entry_size = len(str(entry[0])) + len(str(len(entry[1]))) + 2 + len(entry[1].encode())
+            if chunk and size + entry_size > NOTIFY_PAYLOAD_LIMIT:
+                await self._publish_chunk(room, chunk)
+                chunk, size = [], len(room) + 3
+            chunk.append(entry)
+            size += entry_size
+        if chunk:
+            await self._publish_chunk(room, chunk)
+
+    async def _publish_chunk(self, room: str, entries: List[Entry]) -> None:
+        index = ",".join(f"{message_id}:{len(frame)}" for message_id, frame in entries)
+        payload = f"{KIND_BATCH}{room} {index} " + "".join(frame for _, frame in entries)
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            logger.error(f"Кадр {len(payload)} байт не помещается в NOTIFY, разослан локально")
+            self._deliver_batch(room, entries)
+            return
+        await self._notify(payload)
+
+    async def publish_stats(self, shard: str, stats: str) -> None:
+        payload = f"{KIND_STATS}{shard} {stats}"
+        if len(payload.encode()) > NOTIFY_PAYLOAD_LIMIT:
+            logger.error(f"Статистика {len(payload)} байт не помещается в NOTIFY")
+            return
+        await self._notify(payload)
+
+    async def _notify(self, payload: str) -> None:
+        async with self._publish_lock:
+            if self._publish_conn is None or self._publish_conn.is_closed():
+                self._publish_conn = await asyncpg.connect(self.dsn)
+            await self._publish_conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    async def _listen(self) -> None:
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._listen_conn.add_termination_listener(self._on_terminated)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        if payload[0] == KIND_MESSAGE:
+            message_id, room, frame = payload[1:].split(" ", 2)
+            self._deliver(frame, int(message_id), room)
+        elif payload[0] == KIND_BATCH:
+            room, index, frames = payload[1:].split(" ", 2)
+            entries = []
+            offset = 0
+            for item in index.split(","):
+                message_id, length = item.split(":")
+                end = offset + int(length)
+                entries.append((int(message_id), frames[offset:end]))
+                offset = end
+            self._deliver_batch(room, entries)
+        elif payload[0] == KIND_STATS:
+            shard, stats = payload[1:].split(" ", 1)
+            self._deliver_stats(shard, stats)
+        else:
+            self._deliver(payload[1:], None, None)
+
+    def _on_terminated(self, conn) -> None:
+        if not self._closing:
+            logger.error("Соединение backplane потеряно, переподключение...")
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 0.5
+        while not self._closing:
+            try:
+                await self._listen()
+                logger.info("Backplane переподключен")
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Не удалось переподключить backplane: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+
+def create_backplane(kind: str = BACKPLANE) -> Backplane:
+    """Создает шину по имени из настроек."""
+    if kind == "memory":
+        return InProcessBackplane()
+    if kind == "postgres":
+        return PostgresBackplane()
+    raise ValueError(f"Неизвестный backplane: {kind}")
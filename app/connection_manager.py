@@ -1,27 +1,178 @@
 """
 Менеджер WebSocket соединений с поддержкой БД
 """
+import os
+import html
+import time
+import socket
+import random
+import heapq
+import asyncio
+import itertools
 import logging
+from collections import deque
 from uuid import UUID
-from typing import Dict, List
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import insert, select, func, text
+from sqlalchemy.engine import Row
 from sqlalchemy.exc import SQLAlchemyError
 
 from fastapi import WebSocket
-from .models import Message, generate_connection_id
-from .schemas import MessageResponse
+from .backplane import Backplane, InProcessBackplane
+from .metrics import DB_QUERY_SECONDS, FANOUT_SECONDS
+from .models import DEFAULT_ROOM, SEARCH_CONFIG, Message, generate_connection_id
+from .persistence import MessageWriter
+from .rate_limit import (
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_GLOBAL,
+    RATE_LIMIT_GLOBAL_BURST,
+    RATE_LIMIT_PER_CONNECTION,
+    TokenBucket,
+    create_bucket,
+)
+from .schemas import BATCH_MAX_MESSAGES
+from .serialization import MSGPACK_SUBPROTOCOL, dumps, encode_message, loads, pack_frame, select_subprotocol
 
-import json
-from datetime import datetime
+logger = logging.getLogger("connection_manager")
 
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
+# Настройки рассылки
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "256"))
+SLOW_CLIENT_POLICY = os.getenv("SLOW_CLIENT_POLICY", "disconnect").lower()
+
+# Размер истории, отправляемой при подключении, и горячего буфера комнаты в памяти
+# (буфер комнаты по умолчанию вмещает еще и RESUME_MAX_MESSAGES)
+HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "50"))
+
+# Сколько комнат одновременно может слушать одно соединение
+MAX_ROOMS_PER_CONNECTION = int(os.getenv("MAX_ROOMS_PER_CONNECTION", "50"))
+
+# Колонки кадра сообщения. История читается строками, а не ORM-объектами:
+# без identity map и отслеживания изменений строка сразу уходит в encode_message
+MESSAGE_FRAME_COLUMNS = (
+    Message.id,
+    Message.room,
+    Message.text,
+    Message.connection_id,
+    Message.user_message_number,
+    Message.created_at,
+)
+
+# Сколько пропущенных сообщений досылается при возобновлении соединения
+# (из горячего буфера). Если пропущено больше, клиент получает полный init.
+RESUME_MAX_MESSAGES = int(os.getenv("RESUME_MAX_MESSAGES", "200"))
+
+# Поиск ранжирует не больше SEARCH_MAX_CANDIDATES самых свежих совпадений:
+# так стоимость запроса ограничена и для слов, встречающихся в миллионах сообщений
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+
+# Параметры фрагментов ts_headline. Совпадения выделяются управляющими
+# символами STX/ETX: после экранирования HTML только они заменяются на <mark>,
+# а "<mark>" или "&lt;mark&gt;" из текста сообщения остаются текстом.
+# Сами символы вырезаются из текста до ts_headline
+SEARCH_MARK_START = "\x02"
+SEARCH_MARK_STOP = "\x03"
+SEARCH_HEADLINE_OPTIONS = (
+    f'StartSel="{SEARCH_MARK_START}", StopSel="{SEARCH_MARK_STOP}", '
+    'MaxWords=24, MinWords=8, MaxFragments=2, FragmentDelimiter=" … "'
+)
+
+# Запрашивать номер сообщения из БД, если счетчика соединения нет в памяти
+NUMBERING_DB_FALLBACK = os.getenv("NUMBERING_DB_FALLBACK", "true").lower() == "true"
+
+# disconnect - медленный клиент отключается при переполнении очереди
+# drop - лишние кадры отбрасываются, клиент помечается как медленный
+SLOW_CLIENT_POLICIES = ("disconnect", "drop")
+
+# Код закрытия для клиентов, не успевающих читать (Try Again Later)
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+# Heartbeat: если клиент молчит HEARTBEAT_INTERVAL секунд, ему отправляется
+# кадр ping; не ответившие за HEARTBEAT_TIMEOUT секунд отключаются.
+# IDLE_TIMEOUT отключает клиентов без собственных сообщений и запросов
+# (pong не считается), 0 - не отключать. HEARTBEAT_INTERVAL=0 выключает heartbeat.
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "25"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "10"))
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", "0"))
+
+# Код закрытия для не ответивших на ping и простаивающих клиентов
+HEARTBEAT_CLOSE_CODE = 4408
+
+# Drain перед остановкой: клиенты получают кадр reconnect с задержкой,
+# равномерно распределенной в [0, DRAIN_RECONNECT_WINDOW] секунд, и
+# переподключаются не все сразу. DRAIN_TIMEOUT - сколько ждать, пока
+# очереди отправки будут досланы, прежде чем закрыть сокеты принудительно.
+DRAIN_RECONNECT_WINDOW = float(os.getenv("DRAIN_RECONNECT_WINDOW", "10"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "10"))
+
+# Код закрытия при drain (Service Restart)
+DRAIN_CLOSE_CODE = 1012
+
+# Шард - процесс-воркер со своими соединениями. Воркеры раз в
+# SHARD_STATS_INTERVAL секунд публикуют статистику в шину, из нее /health и
+# /ws-info собирают сводку по всем воркерам. 0 - не публиковать
+SHARD_ID = f"{socket.gethostname()}:{os.getpid()}"
+SHARD_STATS_INTERVAL = float(os.getenv("SHARD_STATS_INTERVAL", "5"))
+
+# Счетчики, которые в сводке по воркерам складываются
+SHARD_TOTAL_KEYS = (
+    "active_connections", "queued_frames", "slow_clients", "dropped_messages",
+    "slow_disconnects", "send_failures", "throttled_messages",
+    "heartbeat_timeouts", "idle_disconnects", "drained_connections",
+)
+
+
+def _escape_snippet(snippet: str) -> str:
+    """Экранирует фрагмент ts_headline как HTML и размечает совпадения тегом <mark>."""
+    return (
+        html.escape(snippet, quote=False)
+        .replace(SEARCH_MARK_START, "<mark>")
+        .replace(SEARCH_MARK_STOP, "</mark>")
+    )
+
+
+class Connection:
+    """
+    Активное WebSocket соединение с собственной очередью отправки.
+    
+    Кадры кладутся в ограниченную очередь, а отдельная задача-писатель
+    отправляет их в сокет, поэтому медленный клиент не задерживает остальных.
+    Здесь же хранится счетчик сообщений: connection_id новый при каждом
+    подключении, поэтому нумерация всегда начинается с нуля.
+    rooms - комнаты, на которые подписано соединение.
+    binary - клиент выбрал подпротокол MessagePack и получает бинарные кадры.
+    last_seen / last_active - время последнего входящего кадра и последнего
+    кадра, не являющегося pong; ping_sent - время неотвеченного ping.
+    """
+    __slots__ = (
+        "connection_id", "websocket", "queue", "writer", "slow", "dropped",
+        "sent", "message_counter", "connected_at", "rate_limiter", "rooms",
+        "binary", "last_seen", "last_active", "ping_sent",
+    )
+    
+    def __init__(
+        self,
+        connection_id: UUID,
+        websocket: WebSocket,
+        queue_size: int,
+        rate_limiter: Optional[TokenBucket] = None,
+    ):
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.slow = False
+        self.dropped = 0
+        self.sent = 0
+        self.message_counter = 0
+        self.connected_at = time.monotonic()
+        self.rate_limiter = rate_limiter
+        self.rooms: Set[str] = set()
+        self.binary = False
+        self.last_seen = self.connected_at
+        self.last_active = self.connected_at
+        self.ping_sent: Optional[float] = None
 
-logger = logging.getLogger("connection_manager")
 
 class ConnectionManager:
     """
@@ -30,24 +181,150 @@ class ConnectionManager:
     Отвечает за:
     - Хранение активных соединений
     - Нумерацию сообщений для каждого connection_id
+    - Подписки соединений на комнаты
     - Сохранение и загрузку сообщений из БД
+    - Рассылку сообщений через очереди отправки каждого клиента
+    - Статистику своего шарда (воркера) и сводку по всем воркерам
     """
     
-    def __init__(self):
-        self.active_connections: Dict[UUID, WebSocket] = {}
-        logger.info("ConnectionManager инициализирован")
+    def __init__(
+        self,
+        queue_size: int = SEND_QUEUE_SIZE,
+        slow_client_policy: str = SLOW_CLIENT_POLICY,
+        numbering_db_fallback: bool = NUMBERING_DB_FALLBACK,
+        message_writer: Optional[MessageWriter] = None,
+        history_limit: int = HISTORY_LIMIT,
+        backplane: Optional[Backplane] = None,
+        resume_max_messages: int = RESUME_MAX_MESSAGES,
+        rate_limit: float = RATE_LIMIT_PER_CONNECTION,
+        rate_limit_burst: float = RATE_LIMIT_BURST,
+        batch_max_messages: int = BATCH_MAX_MESSAGES,
+        global_rate_limit: float = RATE_LIMIT_GLOBAL,
+        global_rate_limit_burst: float = RATE_LIMIT_GLOBAL_BURST,
+        max_rooms_per_connection: int = MAX_ROOMS_PER_CONNECTION,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        heartbeat_timeout: float = HEARTBEAT_TIMEOUT,
+        idle_timeout: float = IDLE_TIMEOUT,
+        search_max_candidates: int = SEARCH_MAX_CANDIDATES,
+        drain_reconnect_window: float = DRAIN_RECONNECT_WINDOW,
+        drain_timeout: float = DRAIN_TIMEOUT,
+        shard_id: str = SHARD_ID,
+        shard_stats_interval: float = SHARD_STATS_INTERVAL,
+    ):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Неизвестная политика для медленных клиентов: {slow_client_policy}")
+        
+        # Реестр соединений с доступом за O(1) по обоим ключам.
+        # WebSocket в Starlette нехешируемый (это Mapping), поэтому
+        # обратный индекс строится по id() объекта сокета.
+        self.active_connections: Dict[UUID, Connection] = {}
+        self._by_socket: Dict[int, Connection] = {}
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.numbering_db_fallback = numbering_db_fallback
+        
+        # Индекс комната -> подписчики этого процесса: сообщение комнаты
+        # ставится в очереди только ее подписчиков, а не всех соединений
+        self.rooms: Dict[str, Set[Connection]] = {}
+        self.max_rooms_per_connection = max_rooms_per_connection
+        
+        # Если задан, сообщения пишутся в БД пакетами в фоне
+        self.message_writer = message_writer
+        
+        # Кольцевые буферы последних сообщений комнат: (id, уже сериализованный JSON)
+        # в порядке рассылки. Буфер есть только у комнат с локальными подписчиками
+        # (и у комнаты по умолчанию), пока идет загрузка из БД он лежит в _warming.
+        # Буфер комнаты по умолчанию хранит еще и окно возобновления.
+        self.history_limit = history_limit
+        self.history: Dict[str, Deque[Tuple[int, str]]] = {}
+        self._warming: Dict[str, Deque[Tuple[int, str]]] = {}
+        self.resume_max_messages = resume_max_messages
+        self.search_max_candidates = search_max_candidates
+        self._history_lock = asyncio.Lock()
+        
+        # Рассылка идет через шину, чтобы дойти до клиентов всех процессов
+        self.backplane = backplane or InProcessBackplane()
+        self.backplane.subscribe(self._on_backplane_frame, self._on_backplane_batch, self._on_backplane_stats)
+        
+        # Метрики рассылки
+        self.dropped_messages = 0
+        self.slow_disconnects = 0
+        self.send_failures = 0
+        
+        # Ограничение частоты: корзина на каждое соединение и общая
+        self.rate_limit = rate_limit
+        self.rate_limit_burst = rate_limit_burst
+        self.batch_max_messages = batch_max_messages
+        self.global_rate_limiter = create_bucket(global_rate_limit, global_rate_limit_burst)
+        self.throttled_messages = 0
+        
+        # Heartbeat: куча сроков проверки (deadline, seq, соединение).
+        # У каждого соединения в куче одна запись; входящий кадр только
+        # обновляет last_seen, а запись переносится, когда до нее доходит
+        # очередь. Поэтому проверка стоит O(log n) на соединение, которому
+        # пора, а не перебор всех соединений.
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.idle_timeout = idle_timeout
+        self._deadlines: List[Tuple[float, int, Connection]] = []
+        self._deadline_seq = itertools.count()
+        self._reaper: Optional[asyncio.Task] = None
+        self._ping_frame = dumps({"type": "ping", "interval": heartbeat_interval})
+        self.heartbeat_timeouts = 0
+        self.idle_disconnects = 0
+        
+        # Drain: после начала остановки новые соединения не принимаются
+        self.drain_reconnect_window = drain_reconnect_window
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self.drained_connections = 0
+        
+        # Шард: последние снимки статистики остальных воркеров
+        # shard -> (время получения, статистика)
+        self.shard_id = shard_id
+        self.shard_stats_interval = shard_stats_interval
+        self.shards: Dict[str, Tuple[float, dict]] = {}
+        self._stats_task: Optional[asyncio.Task] = None
+        
+        # Ссылки на фоновые задачи, чтобы их не собрал GC
+        self._background_tasks: Set[asyncio.Task] = set()
+        logger.info(f"ConnectionManager инициализирован, шард {shard_id}")
     
-    async def connect(self, websocket: WebSocket) -> UUID:
+    async def connect(self, websocket: WebSocket, subscribe: bool = True) -> UUID:
         """
         Принимает новое WebSocket соединение и генерирует для него connection_id.
         
+        Если клиент предложил подпротокол chat.msgpack и он включен,
+        соединение переключается на бинарные кадры MessagePack.
+        
+        subscribe=False - не подписывать на комнату по умолчанию сразу:
+        подписку выполнит get_init_frame или get_resume_frame в момент
+        снимка истории, чтобы кадр и рассылки не пересекались.
+        
         Returns:
             UUID: Уникальный идентификатор соединения
         """
-        await websocket.accept()
+        subprotocol = select_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
         connection_id = generate_connection_id()
         
-        self.active_connections[connection_id] = websocket
+        connection = Connection(
+            connection_id,
+            websocket,
+            self.queue_size,
+            create_bucket(self.rate_limit, self.rate_limit_burst),
+        )
+        connection.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.active_connections[connection_id] = connection
+        self._by_socket[id(websocket)] = connection
+        if subscribe:
+            self._join(connection, DEFAULT_ROOM)
+        
+        if self.heartbeat_interval > 0:
+            self._schedule(connection, self._next_check(connection, connection.connected_at))
+            if self._reaper is None:
+                self._reaper = asyncio.create_task(self._reap())
         logger.info(f"Новое подключение: {connection_id}. Всего: {len(self.active_connections)}")
         
         return connection_id
@@ -56,39 +333,381 @@ class ConnectionManager:
         """
         Удаляет соединение из активных.
         """
-        # Ищем connection_id по websocket объекту
-        connection_id = None
-        for cid, ws in self.active_connections.items():
-            if ws == websocket:
-                connection_id = cid
-                break
+        connection = self._by_socket.get(id(websocket))
+        if connection is not None:
+            self._remove(connection.connection_id)
+            logger.info(f"Отключение: {connection.connection_id}. Осталось: {len(self.active_connections)}")
+    
+    def get_connection(self, websocket: WebSocket) -> Optional[Connection]:
+        """Возвращает запись соединения по объекту сокета."""
+        return self._by_socket.get(id(websocket))
+    
+    def _remove(self, connection_id: UUID) -> None:
+        """Убирает соединение из реестра и останавливает его писателя."""
+        connection = self.active_connections.pop(connection_id, None)
+        if connection is None:
+            return
         
-        if connection_id:
-            del self.active_connections[connection_id]
-            logger.info(f"Отключение: {connection_id}. Осталось: {len(self.active_connections)}")
+        del self._by_socket[id(connection.websocket)]
+        for room in list(connection.rooms):
+            self._leave(connection, room)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+    
+    def _join(self, connection: Connection, room: str) -> None:
+        connection.rooms.add(room)
+        members = self.rooms.get(room)
+        if members is None:
+            members = self.rooms[room] = set()
+        members.add(connection)
+    
+    def _leave(self, connection: Connection, room: str) -> None:
+        connection.rooms.discard(room)
+        members = self.rooms.get(room)
+        if members is None:
+            return
+        members.discard(connection)
+        if not members:
+            del self.rooms[room]
+            # Без подписчиков буфер перестал бы обновляться,
+            # при следующей подписке он загрузится заново
+            if room != DEFAULT_ROOM:
+                self.history.pop(room, None)
+    
+    async def subscribe(self, db: AsyncSession, connection_id: UUID, room: str) -> str:
+        """
+        Подписывает соединение на комнату.
+        
+        Returns:
+            str: JSON кадра SubscribedResponse с последними сообщениями комнаты
+        
+        Raises:
+            ValueError: Превышено число комнат на соединение
+        """
+        connection = self.active_connections.get(connection_id)
+        if connection is None:
+            raise LookupError(f"Соединение {connection_id} уже закрыто")
+        
+        if room not in connection.rooms and len(connection.rooms) >= self.max_rooms_per_connection:
+            raise ValueError(f"Нельзя слушать больше {self.max_rooms_per_connection} комнат")
+        
+        history = await self._get_room_history(db, room)
+        if connection_id not in self.active_connections:
+            # Соединение закрылось, пока грузилась история
+            if room not in self.rooms and room != DEFAULT_ROOM:
+                self.history.pop(room, None)
+            raise LookupError(f"Соединение {connection_id} уже закрыто")
+        
+        # Между снимком буфера и подпиской нет await, поэтому клиент
+        # не получит одно сообщение дважды и не пропустит ни одного
+        self._join(connection, room)
+        return '{"type":"subscribed","room":"%s","history":[%s]}' % (
+            room,
+            self._recent(history),
+        )
+    
+    def unsubscribe(self, connection_id: UUID, room: str) -> None:
+        """Отписывает соединение от комнаты."""
+        connection = self.active_connections.get(connection_id)
+        if connection is not None:
+            self._leave(connection, room)
+    
+    def is_subscribed(self, connection_id: UUID, room: str) -> bool:
+        connection = self.active_connections.get(connection_id)
+        return connection is not None and room in connection.rooms
+    
+    async def _writer(self, connection: Connection) -> None:
+        """Отправляет кадры из очереди соединения в сокет по одному."""
+        queue = connection.queue
+        websocket = connection.websocket
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    # Метка drain: все кадры перед ней отправлены
+                    await self._close(websocket, DRAIN_CLOSE_CODE)
+                    return
+                if connection.binary:
+                    await websocket.send_bytes(frame)
+                else:
+                    await websocket.send_text(frame)
+                connection.sent += 1
+                
+                if connection.slow and queue.empty():
+                    connection.slow = False
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.send_failures += 1
+            logger.warning(f"Ошибка отправки для {connection.connection_id}: {e}")
+            self._remove(connection.connection_id)
     
-    async def get_next_message_number(self, db: AsyncSession, connection_id: UUID) -> int:
+    def _enqueue(self, connection: Connection, frame: Union[str, bytes]) -> None:
+        """
+        Ставит кадр в очередь соединения без ожидания.
+        
+        При переполнении очереди применяется политика для медленных клиентов.
+        """
+        try:
+            connection.queue.put_nowait(frame)
+            return
+        except asyncio.QueueFull:
+            pass
+        
+        self.dropped_messages += 1
+        connection.dropped += 1
+        
+        if self.slow_client_policy == "disconnect":
+            self.slow_disconnects += 1
+            logger.warning(f"Очередь {connection.connection_id} переполнена, клиент отключен")
+            self._remove(connection.connection_id)
+            self._spawn(self._close(connection.websocket, SLOW_CLIENT_CLOSE_CODE))
+        elif not connection.slow:
+            connection.slow = True
+            logger.warning(f"Очередь {connection.connection_id} переполнена, кадры отбрасываются")
+    
+    async def _close(self, websocket: WebSocket, code: int) -> None:
+        try:
+            await websocket.close(code=code)
+        except Exception as e:
+            logger.debug(f"Не удалось закрыть соединение: {e}")
+    
+    def touch(self, connection_id: UUID, active: bool = True) -> None:
+        """
+        Отмечает входящий кадр от клиента. active=False для pong:
+        он подтверждает, что клиент жив, но не продлевает IDLE_TIMEOUT.
+        """
+        connection = self.active_connections.get(connection_id)
+        if connection is None:
+            return
+        now = time.monotonic()
+        connection.last_seen = now
+        if active:
+            connection.last_active = now
+    
+    def _schedule(self, connection: Connection, deadline: float) -> None:
+        heapq.heappush(self._deadlines, (deadline, next(self._deadline_seq), connection))
+    
+    def _next_check(self, connection: Connection, now: float) -> float:
+        if connection.ping_sent is not None:
+            deadline = connection.ping_sent + self.heartbeat_timeout
+        else:
+            deadline = connection.last_seen + self.heartbeat_interval
+        if self.idle_timeout > 0:
+            deadline = min(deadline, connection.last_active + self.idle_timeout)
+        return max(deadline, now)
+    
+    async def _reap(self) -> None:
+        """Фоновая задача: спит до ближайшего срока в куче и проверяет соединения."""
+        while True:
+            delay = self.heartbeat_interval
+            if self._deadlines:
+                delay = min(delay, self._deadlines[0][0] - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.check_heartbeats(time.monotonic())
+    
+    def check_heartbeats(self, now: float) -> int:
+        """
+        Обрабатывает соединения, чей срок проверки наступил: отправляет
+        ping замолчавшим, отключает не ответивших и простаивающих.
+        
+        Returns:
+            int: Сколько соединений отключено
+        """
+        evicted = 0
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _, _, connection = heapq.heappop(deadlines)
+            if self.active_connections.get(connection.connection_id) is not connection:
+                continue  # Соединение уже закрыто
+            
+            if connection.ping_sent is not None:
+                if connection.last_seen >= connection.ping_sent:
+                    connection.ping_sent = None
+                elif now >= connection.ping_sent + self.heartbeat_timeout:
+                    self.heartbeat_timeouts += 1
+                    logger.info(f"Клиент {connection.connection_id} не ответил на ping, отключен")
+                    self._evict(connection)
+                    evicted += 1
+                    continue
+            
+            if self.idle_timeout > 0 and now - connection.last_active >= self.idle_timeout:
+                self.idle_disconnects += 1
+                logger.info(f"Клиент {connection.connection_id} простаивал {self.idle_timeout:.0f} с, отключен")
+                self._evict(connection)
+                evicted += 1
+                continue
+            
+            if connection.ping_sent is None and now >= connection.last_seen + self.heartbeat_interval:
+                connection.ping_sent = now
+                self.send_frame(self._ping_frame, connection.connection_id)
+            
+            if self.active_connections.get(connection.connection_id) is connection:
+                self._schedule(connection, self._next_check(connection, now))
+        return evicted
+    
+    def _evict(self, connection: Connection) -> None:
+        self._remove(connection.connection_id)
+        self._spawn(self._close(connection.websocket, HEARTBEAT_CLOSE_CODE))
+    
+    async def start(self) -> None:
+        """Запускает публикацию статистики шарда в шину."""
+        if self.shard_stats_interval > 0 and self._stats_task is None:
+            self._stats_task = asyncio.create_task(self._publish_stats())
+    
+    async def stop(self) -> None:
+        """Останавливает фоновую проверку heartbeat и публикацию статистики."""
+        for task in (self._reaper, self._stats_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._reaper = self._stats_task = None
+    
+    async def drain(self, window: Optional[float] = None, timeout: Optional[float] = None) -> int:
+        """
+        Переводит менеджер в режим drain перед остановкой процесса.
+        
+        Каждому клиенту ставится в очередь кадр reconnect со своей случайной
+        задержкой из [0, window] и метка закрытия: писатель досылает все
+        кадры перед ней и закрывает сокет кодом 1012. Клиенты, не успевшие
+        дочитать очередь за timeout, отключаются принудительно.
+        
+        Returns:
+            int: Сколько соединений закрыто после отправки всей очереди
+        """
+        window = self.drain_reconnect_window if window is None else window
+        timeout = self.drain_timeout if timeout is None else timeout
+        self.draining = True
+        
+        connections = list(self.active_connections.values())
+        logger.info(f"Drain: {len(connections)} соединений, переподключение в течение {window} с")
+        for connection in connections:
+            after = round(random.uniform(0, window), 3)
+            self.send_frame(dumps({"type": "reconnect", "after": after}), connection.connection_id)
+            if connection.connection_id not in self.active_connections:
+                continue  # Очередь переполнена, клиент уже отключен
+            try:
+                connection.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self._remove(connection.connection_id)
+                self._spawn(self._close(connection.websocket, DRAIN_CLOSE_CODE))
+        
+        writers = [c.writer for c in connections if c.connection_id in self.active_connections]
+        if not writers:
+            return 0
+        done, pending = await asyncio.wait(writers, timeout=timeout)
+        drained = sum(1 for task in done if not task.cancelled())
+        self.drained_connections += drained
+        
+        if pending:
+            logger.warning(f"Drain: {len(pending)} соединений не дочитали очередь за {timeout} с")
+            for connection in connections:
+                if connection.writer in pending:
+                    self._remove(connection.connection_id)
+                    await self._close(connection.websocket, DRAIN_CLOSE_CODE)
+        return drained
+    
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    def max_rate_cost(self, connection_id: UUID) -> Optional[float]:
+        """
+        Наибольшая стоимость запроса, которую лимиты могут пропустить:
+        корзина не накапливает больше burst токенов, поэтому пакет
+        дороже burst не пройдет никогда. None - лимиты отключены.
+        """
+        connection = self.active_connections.get(connection_id)
+        buckets = [
+            bucket for bucket in (
+                connection.rate_limiter if connection is not None else None,
+                self.global_rate_limiter,
+            )
+            if bucket is not None
+        ]
+        return min((bucket.burst for bucket in buckets), default=None)
+    
+    def check_rate_limit(self, connection_id: UUID, cost: int = 1) -> float:
+        """
+        Проверяет лимиты соединения и общий лимит и списывает токены.
+        
+        Токены списываются только если проходят оба лимита, поэтому
+        отклоненное сообщение не расходует общий бюджет.
+        
+        Returns:
+            float: 0, если сообщение можно обработать, иначе через сколько
+            секунд стоит повторить
+        """
+        now = time.monotonic()
+        connection = self.active_connections.get(connection_id)
+        limiter = connection.rate_limiter if connection is not None else None
+        
+        wait = 0.0
+        if limiter is not None:
+            wait = limiter.delay(cost, now)
+        if not wait and self.global_rate_limiter is not None:
+            wait = self.global_rate_limiter.delay(cost, now)
+        
+        if wait:
+            self.throttled_messages += cost
+            return wait
+        
+        if limiter is not None:
+            limiter.consume(cost)
+        if self.global_rate_limiter is not None:
+            self.global_rate_limiter.consume(cost)
+        return 0.0
+    
+    async def get_next_message_number(self, db: AsyncSession, connection_id: UUID, count: int = 1) -> int:
         """
         Получает следующий порядковый номер сообщения для указанного connection_id.
         
+        При count > 1 резервирует count номеров подряд (для пакета)
+        и возвращает первый из них.
+        
+        Номер берется из счетчика в памяти без обращения к БД. Между
+        проверкой и инкрементом нет await, поэтому нумерация атомарна
+        в рамках цикла событий. Если соединения нет в реестре (например,
+        оно уже удалено), номер восстанавливается запросом max() к БД.
+        
         Args:
             db: Сессия базы данных
             connection_id: UUID соединения
+            count: Сколько номеров зарезервировать
             
         Returns:
             int: Следующий номер (начинается с 1)
         """
+        connection = self.active_connections.get(connection_id)
+        if connection is not None:
+            connection.message_counter += count
+            return connection.message_counter - count + 1
+        
+        if not self.numbering_db_fallback:
+            raise LookupError(f"Нет счетчика сообщений для {connection_id}")
+        
+        return await self._get_next_message_number_from_db(db, connection_id)
+    
+    async def _get_next_message_number_from_db(self, db: AsyncSession, connection_id: UUID) -> int:
+        """Вычисляет следующий номер по максимальному номеру в БД."""
         try:
             # Ищем максимальный номер для этого connection_id
-            result = await db.execute(
-                select(func.max(Message.user_message_number))
-                .where(Message.connection_id == connection_id)
-            )
+            with DB_QUERY_SECONDS.labels("get_next_message_number").time():
+                result = await db.execute(
+                    select(func.max(Message.user_message_number))
+                    .where(Message.connection_id == connection_id)
+                )
             max_number = result.scalar()
             
             # Если сообщений еще не было, начинаем с 1
             next_number = 1 if max_number is None else max_number + 1
-            logger.debug(f"Следующий номер для {connection_id}: {next_number}")
+            logger.debug("Следующий номер для %s: %s", connection_id, next_number)
             
             return next_number
             
@@ -101,32 +720,42 @@ class ConnectionManager:
         db: AsyncSession, 
         text: str, 
         connection_id: UUID, 
-        message_number: int
+        message_number: int,
+        room: str = DEFAULT_ROOM,
     ) -> Message:
         """
         Сохраняет сообщение в базу данных.
         
+        В режиме write-behind сообщение только ставится в очередь фоновой
+        записи и возвращается с уже назначенными id и created_at.
+        
         Args:
             db: Сессия базы данных
             text: Текст сообщения
             connection_id: UUID соединения
             message_number: Порядковый номер сообщения
+            room: Комната
             
         Returns:
             Message: Созданный объект сообщения
         """
+        if self.message_writer is not None:
+            return await self.message_writer.submit(text, connection_id, message_number, room)
+        
         try:
             message = Message(
                 text=text,
+                room=room,
                 connection_id=connection_id,
                 user_message_number=message_number
             )
             
-            db.add(message)
-            await db.commit()
-            await db.refresh(message)
+            with DB_QUERY_SECONDS.labels("save_message").time():
+                db.add(message)
+                await db.commit()
+                await db.refresh(message)
             
-            logger.debug(f"Сообщение сохранено: {message}")
+            logger.debug("Сообщение сохранено: %s", message)
             return message
             
         except SQLAlchemyError as e:
@@ -134,58 +763,552 @@ class ConnectionManager:
             logger.error(f"Ошибка сохранения сообщения: {e}")
             raise
     
+    async def save_messages(
+        self,
+        db: AsyncSession,
+        texts: List[str],
+        connection_id: UUID,
+        first_number: int,
+        room: str = DEFAULT_ROOM,
+    ) -> List[Message]:
+        """
+        Сохраняет пакет сообщений одним многострочным INSERT ... RETURNING.
+        
+        Args:
+            db: Сессия базы данных
+            texts: Тексты сообщений по порядку
+            connection_id: UUID соединения
+            first_number: Номер первого сообщения, остальные идут подряд
+            room: Комната
+            
+        Returns:
+            List[Message]: Созданные сообщения в порядке texts
+        """
+        if self.message_writer is not None:
+            return await self.message_writer.submit_many(texts, connection_id, first_number, room)
+        
+        rows = [
+            {
+                "text": text,
+                "room": room,
+                "connection_id": connection_id,
+                "user_message_number": first_number + offset,
+            }
+            for offset, text in enumerate(texts)
+        ]
+        try:
+            with DB_QUERY_SECONDS.labels("save_messages").time():
+                result = await db.scalars(
+                    insert(Message).returning(Message, sort_by_parameter_order=True),
+                    rows,
+                )
+                messages = list(result.all())
+                await db.commit()
+            
+            logger.debug("Сохранен пакет из %d сообщений", len(messages))
+            return messages
+            
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Ошибка сохранения пакета сообщений: {e}")
+            raise
+    
     async def get_message_history(
         self, 
         db: AsyncSession, 
-        limit: int = 50
-    ) -> List[Message]:
+        limit: int = 50,
+        before: Optional[int] = None,
+        room: Optional[str] = DEFAULT_ROOM,
+    ) -> List[Row]:
         """
         Получает историю сообщений из базы данных.
         
+        Использует keyset-пагинацию: страница старше before читается
+        по индексу (room, id) без OFFSET, поэтому стоимость запроса
+        не зависит от глубины прокрутки.
+        
+        Сообщения возвращаются строками с колонками MESSAGE_FRAME_COLUMNS
+        (атрибуты те же, что у Message), а не ORM-объектами.
+        
         Args:
             db: Сессия базы данных
             limit: Максимальное количество сообщений
+            before: Вернуть только сообщения с id меньше указанного
+            room: Комната, None - сообщения всех комнат
             
         Returns:
-            List[Message]: Список сообщений отсортированных по времени
+            List[Row]: Список сообщений отсортированных по времени
         """
         try:
-            result = await db.execute(
-                select(Message)
-                .order_by(Message.created_at.desc())
-                .limit(limit)
-            )
-            messages = result.scalars().all()
+            query = select(*MESSAGE_FRAME_COLUMNS).order_by(Message.id.desc()).limit(limit)
+            if room is not None:
+                query = query.where(Message.room == room)
+            if before is not None:
+                query = query.where(Message.id < before)
+            
+            with DB_QUERY_SECONDS.labels("get_message_history").time():
+                result = await db.execute(query)
+            messages = result.all()
             
             # Возвращаем в хронологическом порядке (старые -> новые)
             messages.reverse()
             
-            logger.debug(f"Загружено {len(messages)} сообщений из истории")
+            logger.debug("Загружено %d сообщений из истории %s", len(messages), room)
             return messages
             
         except SQLAlchemyError as e:
             logger.error(f"Ошибка загрузки истории: {e}")
             raise
     
-    async def send_personal_message(self, message: dict, websocket: WebSocket):
+    async def warm_history(self, db: AsyncSession, room: str = DEFAULT_ROOM) -> Deque[Tuple[int, str]]:
+        """
+        Заполняет горячий буфер истории комнаты из БД.
+        Для комнаты по умолчанию вызывается при старте приложения,
+        для остальных - при первой подписке в этом процессе.
+        """
+        async with self._history_lock:
+            buffer = self.history.get(room)
+            if buffer is not None:
+                return buffer
+            
+            # Сообщения, разосланные во время загрузки, копятся в _warming
+            size = self._buffer_size(room)
+            buffer = self._warming[room] = deque(maxlen=size)
+            try:
+                messages = await self.get_message_history(db, limit=size, room=room)
+            finally:
+                del self._warming[room]
+            
+            recent = list(buffer)
+            known = {message_id for message_id, _ in recent}
+            buffer.clear()
+            buffer.extend((msg.id, encode_message(msg)) for msg in messages if msg.id not in known)
+            buffer.extend(recent)
+            self.history[room] = buffer
+            logger.info(f"Горячая история {room} загружена: {len(buffer)} сообщений")
+            return buffer
+    
+    def _buffer_size(self, room: str) -> int:
+        if room == DEFAULT_ROOM:
+            # Окно возобновления: last_id и все, что разослано после него
+            return max(self.history_limit, self.resume_max_messages + 1)
+        return self.history_limit
+    
+    def _recent(self, history: Deque[Tuple[int, str]]) -> str:
+        """Последние history_limit кадров буфера через запятую."""
+        skip = max(len(history) - self.history_limit, 0)
+        return ",".join(frame for _, frame in itertools.islice(history, skip, None))
+    
+    async def _get_room_history(self, db: AsyncSession, room: str) -> Deque[Tuple[int, str]]:
+        buffer = self.history.get(room)
+        if buffer is None:
+            buffer = await self.warm_history(db, room)
+        return buffer
+    
+    async def get_init_frame(self, db: AsyncSession, connection_id: UUID) -> str:
+        """
+        Собирает кадр инициализации с историей комнаты по умолчанию
+        из горячего буфера без запроса к БД и подписывает соединение
+        на эту комнату.
+        
+        Returns:
+            str: JSON кадра InitResponse
+        """
+        history = await self._get_room_history(db, DEFAULT_ROOM)
+        # Между снимком буфера и подпиской нет await: сообщения, пришедшие
+        # пока грузилась история, попадут в кадр, а не придут еще раз
+        self._join_default_room(connection_id)
+        
+        return '{"type":"init","connection_id":"%s","limits":%s,"history":[%s]}' % (
+            connection_id,
+            self._limits(connection_id),
+            self._recent(history),
+        )
+    
+    async def get_resume_frame(
+        self,
+        db: AsyncSession,
+        connection_id: UUID,
+        last_id: int,
+    ) -> Optional[str]:
+        """
+        Собирает кадр ResumeResponse с сообщениями комнаты по умолчанию,
+        разосланными после last_id. Подписки на остальные комнаты клиент восстанавливает
+        сам, получая их историю в кадрах subscribed.
+        
+        Пропущенное - все, что стоит в горячем буфере после last_id, а не
+        сообщения с большим id: id назначаются при вставке, а рассылаются
+        после коммита на разных воркерах ingest и в разных процессах, так
+        что порядок рассылки может расходиться с порядком id. Порядок
+        буфера - порядок рассылки, общий для всех процессов (шина доставляет
+        кадры всем в одном порядке); только сообщения, загруженные при
+        прогреве буфера из БД, упорядочены по id. Соединение подписывается
+        на комнату в момент снимка, поэтому сообщения из кадра не приходят
+        повторно рассылкой.
+        
+        Returns:
+            Optional[str]: JSON кадра или None, если last_id нет в буфере
+            (пропущено больше resume_max_messages) и нужно отправить полный init
+        """
+        history = await self._get_room_history(db, DEFAULT_ROOM)
+        
+        # Поиск с конца: обычно клиент отстал на несколько сообщений
+        missed = []
+        for message_id, frame in reversed(history):
+            if message_id == last_id:
+                break
+            missed.append(frame)
+        else:
+            return None
+        missed.reverse()
+        
+        self._join_default_room(connection_id)
+        return '{"type":"resume","connection_id":"%s","limits":%s,"messages":[%s]}' % (
+            connection_id,
+            self._limits(connection_id),
+            ",".join(missed),
+        )
+    
+    def _limits(self, connection_id: UUID) -> str:
+        """
+        Лимиты для клиента (LimitsResponse): по ним он режет исходящие
+        пакеты и выдерживает частоту, а не подбирает их по отказам.
+        """
+        batch_max_messages = self.batch_max_messages
+        max_cost = self.max_rate_cost(connection_id)
+        if max_cost is not None:
+            batch_max_messages = min(batch_max_messages, max(int(max_cost), 1))
+        per_connection = self.rate_limit > 0
+        return dumps({
+            "batch_max_messages": batch_max_messages,
+            "rate": self.rate_limit if per_connection else 0,
+            "burst": self.rate_limit_burst if per_connection else 0,
+        })
+    
+    def _join_default_room(self, connection_id: UUID) -> None:
+        connection = self.active_connections.get(connection_id)
+        if connection is not None:
+            self._join(connection, DEFAULT_ROOM)
+    
+    async def get_history_page(
+        self,
+        db: AsyncSession,
+        before: Optional[int] = None,
+        limit: int = 50,
+        room: str = DEFAULT_ROOM,
+    ) -> str:
+        """
+        Собирает кадр HistoryResponse со страницей истории комнаты старше before.
+        
+        Returns:
+            str: JSON кадра, next_before равен null на последней странице
+        """
+        messages = await self.get_message_history(db, limit=limit, before=before, room=room)
+        next_before = messages[0].id if len(messages) == limit else None
+        
+        return '{"type":"history","room":"%s","messages":[%s],"next_before":%s}' % (
+            room,
+            ",".join(encode_message(msg) for msg in messages),
+            "null" if next_before is None else next_before,
+        )
+    
+    async def search_messages(
+        self,
+        db: AsyncSession,
+        q: str,
+        room: Optional[str] = None,
+        limit: int = 20,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> list:
+        """
+        Полнотекстовый поиск по GIN индексу search_vector.
+        
+        Кандидаты - не больше search_max_candidates самых свежих совпадений;
+        они сортируются по ts_rank, а страницы листаются keyset по (rank, id).
+        Фрагменты ts_headline считаются только для строк страницы: это
+        самая дорогая часть запроса.
+        
+        Args:
+            db: Сессия базы данных
+            q: Запрос в синтаксисе websearch_to_tsquery ("фраза", or, -слово)
+            room: Комната, None - все комнаты
+            limit: Размер страницы
+            after: (rank, id) последнего результата предыдущей страницы
+            
+        Returns:
+            list: Строки с полями сообщения, rank и snippet по убыванию релевантности
+        """
+        query = f"websearch_to_tsquery('{SEARCH_CONFIG}', :q)"
+        room_filter = "AND m.room = :room" if room is not None else ""
+        cursor_filter = "WHERE (rank, id) < (CAST(:after_rank AS real), :after_id)" if after is not None else ""
+        statement = text(f"""
+            WITH candidates AS (
+                SELECT m.id, m.room, m.text, m.connection_id, m.user_message_number, m.created_at,
+                       ts_rank(m.search_vector, {query}) AS rank
+                FROM messages m
+                WHERE m.search_vector @@ {query} {room_filter}
+                ORDER BY m.id DESC
+                LIMIT :candidates
+            ), page AS (
+                SELECT * FROM candidates {cursor_filter}
+                ORDER BY rank DESC, id DESC
+                LIMIT :limit
+            )
+            SELECT page.*, ts_headline('{SEARCH_CONFIG}', translate(page.text, :marks, ''), {query}, :options) AS snippet
+            FROM page
+            ORDER BY page.rank DESC, page.id DESC
+        """)
+        params = {
+            "q": q,
+            "candidates": self.search_max_candidates,
+            "limit": limit,
+            "options": SEARCH_HEADLINE_OPTIONS,
+            "marks": SEARCH_MARK_START + SEARCH_MARK_STOP,
+        }
+        if room is not None:
+            params["room"] = room
+        if after is not None:
+            params["after_rank"], params["after_id"] = after
+        
+        try:
+            with DB_QUERY_SECONDS.labels("search_messages").time():
+                result = await db.execute(statement, params)
+            rows = list(result.mappings().all())
+            logger.debug("Поиск %r в %s: %d результатов", q, room, len(rows))
+            return rows
+            
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка поиска: {e}")
+            raise
+    
+    async def get_search_page(
+        self,
+        db: AsyncSession,
+        q: str,
+        room: Optional[str] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> str:
+        """
+        Собирает кадр SearchResponse со страницей результатов поиска.
+        
+        Args:
+            cursor: next_cursor предыдущей страницы в виде "<rank>:<id>"
+        
+        Returns:
+            str: JSON кадра, next_cursor равен null на последней странице
+            
+        Raises:
+            ValueError: Некорректный курсор
+        """
+        after = None
+        if cursor is not None:
+            rank, _, message_id = cursor.partition(":")
+            try:
+                after = (float(rank), int(message_id))
+            except ValueError:
+                raise ValueError(f"Некорректный курсор поиска: {cursor}") from None
+        
+        rows = await self.search_messages(db, q, room=room, limit=limit, after=after)
+        # repr(float) восстанавливает значение real без потерь,
+        # поэтому сравнение (rank, id) на следующей странице точное
+        next_cursor = f"{rows[-1]['rank']!r}:{rows[-1]['id']}" if len(rows) == limit else None
+        
+        return dumps({
+            "type": "search",
+            "q": q,
+            "room": room,
+            "results": [
+                {
+                    "type": "message",
+                    "id": row["id"],
+                    "room": row["room"],
+                    "text": row["text"],
+                    "connection_id": str(row["connection_id"]),
+                    "user_message_number": row["user_message_number"],
+                    "created_at": row["created_at"],
+                    "rank": row["rank"],
+                    "snippet": _escape_snippet(row["snippet"]),
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor,
+        })
+    
+    async def send_personal_message(self, message: dict, connection_id: UUID):
+        """
+        Отправляет сообщение одному клиенту через его очередь,
+        сохраняя порядок относительно рассылок.
+        """
         try:
-            await websocket.send_text(json.dumps(message, cls=DateTimeEncoder))
+            self.send_frame(dumps(message), connection_id)
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения: {e}")
     
+    def send_frame(self, frame: str, connection_id: UUID) -> None:
+        """Ставит уже сериализованный JSON-кадр в очередь одного клиента."""
+        connection = self.active_connections.get(connection_id)
+        if connection is None:
+            logger.debug(f"Соединение {connection_id} уже закрыто, сообщение не отправлено")
+            return
+        
+        self._enqueue(connection, pack_frame(frame) if connection.binary else frame)
+    
     async def broadcast(self, message: dict):
-        disconnected = []
-        json_message = json.dumps(message, cls=DateTimeEncoder)
+        """
+        Рассылает служебное сообщение всем клиентам, независимо от комнат.
         
-        for connection_id, websocket in self.active_connections.items():
-            try:
-                await websocket.send_text(json_message)
-            except Exception:
-                disconnected.append(connection_id)
+        Сообщение сериализуется один раз и только ставится в очереди,
+        отправкой занимаются писатели соединений. Все получатели
+        разделяют одну и ту же строку кадра.
+        """
+        await self.backplane.publish(dumps(message))
+    
+    async def broadcast_message(self, message: Message):
+        """Рассылает сохраненное сообщение подписчикам его комнаты и добавляет его в горячую историю."""
+        await self.backplane.publish(encode_message(message), message_id=message.id, room=message.room)
+    
+    def _on_backplane_frame(self, frame: str, message_id: Optional[int], room: Optional[str]) -> None:
+        """Получает кадр из шины и раздает его клиентам этого процесса."""
+        if room is None:
+            self._fanout(frame, self.active_connections.values())
+            return
         
-        for connection_id in disconnected:
-            del self.active_connections[connection_id]
+        if message_id is not None:
+            buffer = self.history.get(room)
+            if buffer is None:
+                buffer = self._warming.get(room)
+            if buffer is not None:
+                buffer.append((message_id, frame))
+        
+        members = self.rooms.get(room)
+        if members:
+            self._fanout(frame, members)
+    
+    async def broadcast_batch(self, messages: List[Message]):
+        """
+        Рассылает пакет сообщений одной комнаты одним кадром BatchResponse.
+        Каждое сообщение пакета попадает в горячую историю отдельно.
+        """
+        entries = [(message.id, encode_message(message)) for message in messages]
+        await self.backplane.publish_batch(messages[0].room, entries)
+    
+    def _on_backplane_batch(self, room: str, entries: List[Tuple[int, str]]) -> None:
+        """Получает пакет из шины, добавляет его в историю и раздает одним кадром."""
+        buffer = self.history.get(room)
+        if buffer is None:
+            buffer = self._warming.get(room)
+        if buffer is not None:
+            buffer.extend(entries)
+        
+        members = self.rooms.get(room)
+        if members:
+            frame = '{"type":"batch","room":"%s","messages":[%s]}' % (
+                room,
+                ",".join(frame for _, frame in entries),
+            )
+            self._fanout(frame, members)
+    
+    def _fanout(self, frame: str, connections: Iterable[Connection]) -> None:
+        with FANOUT_SECONDS.time():
+            # MessagePack-версия кадра строится один раз на рассылку
+            packed: Optional[bytes] = None
+            # Копия: при переполнении очереди соединение удаляется из реестра и комнат
+            for connection in list(connections):
+                if connection.binary:
+                    if packed is None:
+                        packed = pack_frame(frame)
+                    self._enqueue(connection, packed)
+                else:
+                    self._enqueue(connection, frame)
     
     def get_connection_count(self) -> int:
         """Возвращает количество активных соединений."""
-        return len(self.active_connections)
\ No newline at end of file
+        return len(self.active_connections)
+    
+    def get_stats(self) -> dict:
+        """Возвращает метрики очередей отправки."""
+        depths = [connection.queue.qsize() for connection in self.active_connections.values()]
+        return {
+            "active_connections": len(depths),
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_capacity": self.queue_size,
+            "slow_clients": sum(1 for c in self.active_connections.values() if c.slow),
+            "slow_client_policy": self.slow_client_policy,
+            "dropped_messages": self.dropped_messages,
+            "slow_disconnects": self.slow_disconnects,
+            "send_failures": self.send_failures,
+            "throttled_messages": self.throttled_messages,
+            "heartbeat_timeouts": self.heartbeat_timeouts,
+            "idle_disconnects": self.idle_disconnects,
+            "draining": self.draining,
+            "drained_connections": self.drained_connections,
+            "rooms": len(self.rooms),
+            "cached_rooms": len(self.history),
+        }
+    
+    async def _publish_stats(self) -> None:
+        while True:
+            try:
+                await self.backplane.publish_stats(self.shard_id, dumps(self.get_shard_stats()))
+            except Exception as e:
+                logger.error(f"Не удалось опубликовать статистику шарда: {e}")
+            await asyncio.sleep(self.shard_stats_interval)
+    
+    def _on_backplane_stats(self, shard: str, stats: str) -> None:
+        """Запоминает снимок статистики другого воркера."""
+        if shard != self.shard_id:
+            self.shards[shard] = (time.monotonic(), loads(stats))
+    
+    def _peer_stats(self) -> List[dict]:
+        """
+        Последние снимки остальных воркеров. Снимок, не обновлявшийся
+        три интервала публикации, считается снимком остановленного воркера.
+        """
+        expired_before = time.monotonic() - self.shard_stats_interval * 3
+        for shard, (received_at, _) in list(self.shards.items()):
+            if received_at < expired_before:
+                del self.shards[shard]
+        return [stats for _, stats in self.shards.values()]
+    
+    def get_shard_stats(self) -> dict:
+        """Статистика этого воркера, которая публикуется в шину."""
+        return {"shard": self.shard_id, "pid": os.getpid(), **self.get_stats()}
+    
+    def get_cluster_connection_count(self) -> int:
+        """Соединения всех воркеров: свои точно, чужие - по последним снимкам."""
+        return len(self.active_connections) + sum(
+            stats["active_connections"] for stats in self._peer_stats()
+        )
+    
+    def get_cluster_stats(self) -> dict:
+        """
+        Сводка по всем воркерам: счетчики SHARD_TOTAL_KEYS складываются,
+        по каждому воркеру - соединения и очереди.
+        """
+        shards = [self.get_shard_stats()] + self._peer_stats()
+        totals = {key: sum(stats.get(key, 0) for stats in shards) for key in SHARD_TOTAL_KEYS}
+        totals["max_queue_depth"] = max(stats["max_queue_depth"] for stats in shards)
+        return {
+            "shard": self.shard_id,
+            "workers": len(shards),
+            "totals": totals,
+            "shards": [
+                {
+                    "shard": stats["shard"],
+                    "pid": stats["pid"],
+                    "active_connections": stats["active_connections"],
+                    "queued_frames": stats["queued_frames"],
+                    "rooms": stats["rooms"],
+                    "draining": stats["draining"],
+                }
+                for stats in sorted(shards, key=lambda stats: stats["shard"])
+            ],
+        }
+    
+    def get_persistence_stats(self) -> dict:
+        """Возвращает режим и метрики сохранения сообщений."""
+        if self.message_writer is None:
+            return {"mode": "sync"}
+        return {"mode": "write_behind", **self.message_writer.get_stats()}
\ No newline at end of file
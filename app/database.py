@@ -3,6 +3,7 @@
 """
 import os
 import logging
+from sqlalchemy import inspect
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 
@@ -17,6 +18,12 @@ DATABASE_URL = os.getenv(
 )
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
+# Настройки пула соединений. WebSocket не держит соединение,
+# поэтому пул рассчитывается на одновременные запросы, а не на клиентов.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
 # Настраиваем уровень логирования SQLAlchemy
 if DEBUG:
     logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
@@ -28,11 +35,15 @@ else:
 engine = create_async_engine(
     DATABASE_URL,
     echo=DEBUG,  # Логирование SQL запросов только в DEBUG режиме
-    pool_size=20,
-    max_overflow=10,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
     pool_pre_ping=True,
 )
 
+# DSN для прямых подключений asyncpg (LISTEN/NOTIFY, COPY, DDL) без пула SQLAlchemy
+ASYNCPG_DSN = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
 # Создаем фабрику сессий
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -57,16 +68,40 @@ async def get_db():
         finally:
             await session.close()
 
+def get_pool_stats() -> dict:
+    """Возвращает состояние пула соединений."""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+
+def create_schema(connection) -> bool:
+    """
+    Создает таблицы по моделям, если схемой еще не владеет alembic.
+    
+    После alembic upgrade схема отличается от моделей (секционирование,
+    первичный ключ (id, created_at)), и create_all не должен ее дополнять.
+    """
+    if inspect(connection).has_table("alembic_version"):
+        return False
+    Base.metadata.create_all(connection)
+    return True
+
 async def init_db():
     """
-    Инициализация базы данных - создание всех таблиц.
-    Вызывается при старте приложения.
+    Инициализация базы данных - создание всех таблиц, если БД еще не
+    ведется миграциями. Вызывается при старте приложения.
     """
     try:
         async with engine.begin() as conn:
-            # Создаем все таблицы, определенные в моделях
-            await conn.run_sync(Base.metadata.create_all)
-        logger.info("База данных инициализирована успешно")
+            created = await conn.run_sync(create_schema)
+        if created:
+            logger.info("База данных инициализирована успешно")
+        else:
+            logger.info("Схема БД ведется миграциями alembic, create_all пропущен")
         return True
     except Exception as e:
         logger.error(f"Ошибка инициализации базы данных: {e}")
@@ -0,0 +1,211 @@
+"""
+Ограниченная стадия обработки входящих запросов (ingest)
+
+Цикл приема сокета только разбирает и проверяет кадр, а работу с БД
+(сохранение сообщений, история, поиск, подписка) ставит в общий пул
+воркеров. Число принятых и еще не выполненных запросов ограничено на
+процесс: когда лимит исчерпан, запрос сразу отклоняется кадром overload,
+а не копится в ожидании пула соединений БД. Запрос, простоявший в
+очереди дольше INGEST_QUEUE_DEADLINE_MS, тоже отклоняется: его
+выполнение только продлило бы перегрузку.
+
+Воркеры берут работу из одной общей очереди соединений, а у каждого
+соединения своя цепочка запросов, из которой в работе не больше одного.
+Поэтому запросы соединения выполняются в порядке приема, а медленный
+запрос задерживает только свое соединение: остальные обслуживают
+свободные воркеры. Тем же путем отключение соединения откладывается до
+выполнения уже принятых запросов.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from .metrics import INGEST_QUEUE_WAIT
+
+logger = logging.getLogger("ingest")
+
+# Число воркеров: столько запросов к БД выполняется одновременно.
+# Имеет смысл держать не больше размера пула соединений БД
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "16"))
+# Сколько запросов может быть принято и не выполнено (в очередях и в работе)
+INGEST_MAX_IN_FLIGHT = int(os.getenv("INGEST_MAX_IN_FLIGHT", "1000"))
+# Запрос, прождавший в очереди дольше, отклоняется без выполнения. 0 - без срока
+INGEST_QUEUE_DEADLINE_MS = int(os.getenv("INGEST_QUEUE_DEADLINE_MS", "2000"))
+
+Job = Callable[[], Awaitable[None]]
+# (connection_id, причина, через сколько секунд повторить)
+OverloadHandler = Callable[[UUID, str, float], None]
+
+
+class IngestPool:
+    """
+    Пул воркеров с глобальным лимитом запросов в работе и сроком ожидания.
+
+    Запросы копятся в цепочках соединений (_chains), а в общей очереди
+    _ready стоят соединения, у которых есть запрос и ни один не выполняется.
+    Воркер выполняет один запрос соединения и, если в цепочке есть еще,
+    ставит соединение в конец очереди: соединения обслуживаются по кругу.
+    Общий размер цепочек ограничен счетчиком in_flight.
+    """
+
+    def __init__(
+        self,
+        on_overload: OverloadHandler,
+        workers: int = INGEST_WORKERS,
+        max_in_flight: int = INGEST_MAX_IN_FLIGHT,
+        queue_deadline_ms: int = INGEST_QUEUE_DEADLINE_MS,
+    ):
+        if workers < 1:
+            raise ValueError(f"Нужен хотя бы один воркер: {workers}")
+
+        self.on_overload = on_overload
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.queue_deadline = queue_deadline_ms / 1000
+
+        # Соединение есть в _chains, пока у него есть запросы в цепочке или в работе
+        self._chains: Dict[UUID, Deque[Tuple[Optional[float], Job]]] = {}
+        # Очередь и событие создаются в start(): они привязываются к event loop
+        self._ready: Optional[asyncio.Queue] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # Метрики
+        self.in_flight = 0
+        self.accepted = 0
+        self.rejected_full = 0
+        self.rejected_deadline = 0
+        self.failed = 0
+        # Сглаженное время ожидания в очереди, из него берется retry_after
+        self.wait_ewma = 0.0
+
+    async def start(self) -> None:
+        """Запускает воркеры."""
+        if not self._tasks:
+            self._ready = asyncio.Queue()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(
+                f"Ingest запущен: {self.workers} воркеров, до {self.max_in_flight} запросов, "
+                f"срок ожидания {self.queue_deadline * 1000:.0f} мс"
+            )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается выполнения принятых запросов и останавливает воркеры."""
+        if not self._tasks:
+            return
+
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Не удалось выполнить {self.in_flight} запросов за {timeout} с")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Невыполненное за timeout отбрасывается
+        self._chains.clear()
+        self.in_flight = 0
+        logger.info("Ingest остановлен")
+
+    def submit(self, connection_id: UUID, job: Job) -> bool:
+        """
+        Ставит запрос в цепочку соединения без ожидания.
+
+        Returns:
+            bool: False - лимит исчерпан, клиенту отправлен кадр overload
+        """
+        # После stop (drain) новые запросы уже некому выполнять
+        if self.in_flight >= self.max_in_flight or not self._tasks:
+            self.rejected_full += 1
+            self.on_overload(connection_id, "queue_full", self.retry_after())
+            return False
+
+        self.accepted += 1
+        self._enqueue(connection_id, time.perf_counter(), job)
+        return True
+
+    def defer(self, connection_id: UUID, job: Job) -> bool:
+        """
+        Ставит задачу после всех принятых запросов соединения, без лимита
+        и срока ожидания.
+
+        Returns:
+            bool: False - воркеры не запущены, задача не поставлена
+        """
+        if not self._tasks:
+            return False
+
+        self._enqueue(connection_id, None, job)
+        return True
+
+    def _enqueue(self, connection_id: UUID, enqueued_at: Optional[float], job: Job) -> None:
+        self.in_flight += 1
+        self._idle.clear()
+        chain = self._chains.get(connection_id)
+        if chain is None:
+            # Соединение не ждет в очереди и не выполняется: ставим его
+            chain = self._chains[connection_id] = deque()
+            self._ready.put_nowait(connection_id)
+        chain.append((enqueued_at, job))
+
+    def retry_after(self) -> float:
+        """Подсказка клиенту: текущее время ожидания, но не больше срока."""
+        upper = self.queue_deadline if self.queue_deadline > 0 else 1.0
+        return round(min(max(self.wait_ewma, 0.1), upper), 3)
+
+    async def _worker(self) -> None:
+        while True:
+            connection_id: UUID = await self._ready.get()
+            chain = self._chains[connection_id]
+            enqueued_at, job = chain.popleft()
+            try:
+                await self._execute(connection_id, enqueued_at, job)
+            finally:
+                self.in_flight -= 1
+                if chain:
+                    # Следующий запрос соединения - после уже ожидающих соединений
+                    self._ready.put_nowait(connection_id)
+                else:
+                    del self._chains[connection_id]
+                if self.in_flight == 0:
+                    self._idle.set()
+
+    async def _execute(self, connection_id: UUID, enqueued_at: Optional[float], job: Job) -> None:
+        # Задача из defer (enqueued_at is None) выполняется всегда
+        if enqueued_at is not None:
+            wait = time.perf_counter() - enqueued_at
+            INGEST_QUEUE_WAIT.observe(wait)
+            self.wait_ewma += (wait - self.wait_ewma) * 0.1
+
+            if self.queue_deadline > 0 and wait > self.queue_deadline:
+                self.rejected_deadline += 1
+                self.on_overload(connection_id, "deadline", self.retry_after())
+                return
+
+        try:
+            await job()
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка обработки запроса {connection_id}: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_in_flight": self.max_in_flight,
+            "queue_deadline_ms": int(self.queue_deadline * 1000),
+            "in_flight": self.in_flight,
+            "busy_connections": len(self._chains),
+            "max_queue_depth": max((len(chain) for chain in self._chains.values()), default=0),
+            "queue_wait_ms": round(self.wait_ewma * 1000, 2),
+            "accepted": self.accepted,
+            "rejected_full": self.rejected_full,
+            "rejected_deadline": self.rejected_deadline,
+            "failed": self.failed,
+        }
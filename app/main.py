@@ -3,25 +3,93 @@ FastAPI WebSocket chat with message numbering per connection.
 """
 import os
 import json
+import time
 import logging
 from uuid import UUID
 from contextlib import asynccontextmanager
+from functools import partial
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from typing import Optional, Union
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import get_db, init_db
-from .connection_manager import ConnectionManager
-from .schemas import MessageCreate, MessageResponse, InitResponse, ErrorResponse
+from .database import get_db, get_pool_stats, init_db, AsyncSessionLocal
+from .backplane import create_backplane
+from .connection_manager import DRAIN_CLOSE_CODE, ConnectionManager
+from .ingest import IngestPool
+from .serialization import FrameDecodeError, decode_frame, encode_model
+from . import metrics
+from .partitions import PartitionManager, PARTITION_MAINTENANCE
+from .persistence import MessageWriter, PERSISTENCE_MODE
+from .models import DEFAULT_ROOM
+from .schemas import (
+    ROOM_PATTERN,
+    MessageCreate,
+    BatchCreate,
+    HistoryRequest,
+    HistoryResponse,
+    SEARCH_CURSOR_PATTERN,
+    SearchRequest,
+    SearchResponse,
+    SubscriptionRequest,
+    UnsubscribedResponse,
+    ErrorResponse,
+    PongResponse,
+    ThrottleResponse,
+    OverloadResponse,
+)
 
 logger = logging.getLogger("websocket_chat")
 logger.setLevel(logging.DEBUG if os.getenv("DEBUG") == "true" else logging.INFO)
 
 static_path = os.path.join(os.path.dirname(__file__), "static")
 
-manager = ConnectionManager()
+message_writer = MessageWriter(AsyncSessionLocal) if PERSISTENCE_MODE == "write_behind" else None
+backplane = create_backplane()
+partition_manager = PartitionManager() if PARTITION_MAINTENANCE else None
+manager = ConnectionManager(message_writer=message_writer, backplane=backplane)
+
+def send_overload(connection_id: UUID, reason: str, retry_after: float) -> None:
+    """Tell a client that its request was rejected by the ingest stage."""
+    overload = OverloadResponse(reason=reason, retry_after=retry_after)
+    manager.send_frame(encode_model(overload), connection_id)
+
+ingest = IngestPool(send_overload)
+
+# Каждый воркер отдает свои счетчики: метка shard разделяет их ряды
+metrics.REGISTRY.const_labels["shard"] = manager.shard_id
+metrics.ACTIVE_CONNECTIONS.callback = manager.get_connection_count
+metrics.SEND_FAILURES.callback = lambda: manager.send_failures
+metrics.DROPPED_FRAMES.callback = lambda: manager.dropped_messages
+metrics.THROTTLED_MESSAGES.callback = lambda: manager.throttled_messages
+metrics.QUEUED_FRAMES.callback = lambda: manager.get_stats()["queued_frames"]
+metrics.HEARTBEAT_DISCONNECTS.callback = lambda: manager.heartbeat_timeouts + manager.idle_disconnects
+metrics.INGEST_IN_FLIGHT.callback = lambda: ingest.in_flight
+metrics.INGEST_REJECTED.callback = lambda: ingest.rejected_full + ingest.rejected_deadline
+
+async def drain() -> None:
+    """
+    Drain mode before a graceful shutdown or rolling restart.
+    
+    Must run before the server closes sockets (start_server.py calls it from
+    uvicorn's shutdown): new WebSocket connections are refused, every client
+    gets a `reconnect` frame with its own jittered delay, send queues are
+    flushed, sockets are closed with code 1012, already accepted ingest
+    requests are completed and pending write-behind messages are written
+    to the DB.
+    """
+    if manager.draining:
+        return
+    
+    logger.info("🚰 Draining WebSocket connections...")
+    drained = await manager.drain()
+    await ingest.stop()
+    if message_writer is not None:
+        await message_writer.flush()
+    logger.info(f"✅ Drained {drained} connections")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -40,9 +108,39 @@ async def lifespan(app: FastAPI):
         logger.error(f"❌ Database initialization error: {e}")
         raise
     
+    if partition_manager is not None:
+        # Секции на ближайшие периоды должны существовать до первой вставки
+        await partition_manager.start()
+    
+    if message_writer is not None:
+        await message_writer.start()
+    
+    await backplane.start()
+    await manager.start()
+    await ingest.start()
+    
+    try:
+        async with AsyncSessionLocal() as db:
+            await manager.warm_history(db)
+    except Exception as e:
+        # Буфер будет заполнен при первом подключении
+        logger.error(f"❌ Failed to warm history cache: {e}")
+    
     yield
     
     logger.info("🛑 Stopping WebSocket chat")
+    
+    await manager.stop()
+    # Принятые запросы еще пишут в БД и публикуют в шину
+    await ingest.stop()
+    await backplane.stop()
+    
+    if message_writer is not None:
+        logger.info("💾 Flushing pending messages...")
+        await message_writer.stop()
+    
+    if partition_manager is not None:
+        await partition_manager.stop()
 
 app = FastAPI(
     title="WebSocket Chat API",
@@ -80,110 +178,373 @@ async def health_check(db: AsyncSession = Depends(get_db)):
         logger.error(f"Database connection error: {e}")
         db_status = False
     
-    return JSONResponse({
-        "status": "healthy" if db_status else "degraded",
-        "service": "websocket-chat",
-        "database": db_status,
-        "connections": manager.get_connection_count()
-    })
+    if manager.draining:
+        status = "draining"
+    else:
+        status = "healthy" if db_status else "degraded"
+    
+    # 503 во время drain, чтобы балансировщик перестал направлять клиентов.
+    # connections - по всем воркерам, worker_connections - у этого воркера
+    return JSONResponse(
+        {
+            "status": status,
+            "service": "websocket-chat",
+            "database": db_status,
+            "connections": manager.get_cluster_connection_count(),
+            "worker": manager.shard_id,
+            "worker_connections": manager.get_connection_count(),
+        },
+        status_code=503 if manager.draining else 200,
+    )
 
 @app.get("/ws-info")
 async def websocket_info():
-    """WebSocket connection information."""
+    """
+    WebSocket connection information.
+    
+    `active_connections` and `cluster` cover all workers (from the stats they
+    publish to the backplane every SHARD_STATS_INTERVAL seconds); the other
+    sections describe the worker that served this request.
+    """
+    cluster = manager.get_cluster_stats()
     return {
-        "active_connections": manager.get_connection_count(),
-        "status": "running"
+        "active_connections": cluster["totals"]["active_connections"],
+        "status": "running",
+        "worker": manager.shard_id,
+        "cluster": cluster,
+        "fanout": manager.get_stats(),
+        "persistence": manager.get_persistence_stats(),
+        "ingest": ingest.get_stats(),
+        "backplane": backplane.name,
+        "db_pool": get_pool_stats(),
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus metrics."""
+    return PlainTextResponse(
+        metrics.REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@app.get("/messages", response_model=HistoryResponse)
+async def message_history(
+    before: Optional[int] = Query(None, ge=1, description="Return messages with id lower than this"),
+    limit: int = Query(50, ge=1, le=200),
+    room: str = Query(DEFAULT_ROOM, pattern=ROOM_PATTERN),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Paginated message history of a room, newest page first.
+    
+    Pass `next_before` from the previous page as `before` to scroll back.
+    """
+    frame = await manager.get_history_page(db, before=before, limit=limit, room=room)
+    return Response(content=frame, media_type="application/json")
+
+@app.get("/search", response_model=SearchResponse)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description="Search query, websearch syntax"),
+    room: Optional[str] = Query(None, pattern=ROOM_PATTERN, description="Room to search, all rooms if omitted"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, pattern=SEARCH_CURSOR_PATTERN, description="next_cursor of the previous page"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Full-text search over message history, most relevant first.
+    
+    Supports quoted phrases, `or` and `-word`. Pass `next_cursor` from the
+    previous page as `cursor` to get the next page.
+    """
+    try:
+        frame = await manager.get_search_page(db, q, room=room, limit=limit, cursor=cursor)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return Response(content=frame, media_type="application/json")
+
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """Receive a text (JSON) or binary (MessagePack) frame."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    return text if text is not None else message.get("bytes", b"")
+
+async def send_error(message: str, connection_id: UUID) -> None:
+    error = ErrorResponse(message=message)
+    await manager.send_personal_message(error.model_dump(), connection_id)
+
+# Обработчики запросов, которым нужна БД. Выполняются воркерами ingest,
+# а не циклом приема сокета, и получают уже проверенный запрос
+
+async def handle_history(connection_id: UUID, request: HistoryRequest) -> None:
+    async with AsyncSessionLocal() as db:
+        page = await manager.get_history_page(
+            db,
+            before=request.before,
+            limit=request.limit,
+            room=request.room,
+        )
+    manager.send_frame(page, connection_id)
+
+async def handle_search(connection_id: UUID, request: SearchRequest) -> None:
+    try:
+        async with AsyncSessionLocal() as db:
+            page = await manager.get_search_page(
+                db,
+                request.q,
+                room=request.room,
+                limit=request.limit,
+                cursor=request.cursor,
+            )
+    except ValueError as e:
+        await send_error(str(e), connection_id)
+        return
+    manager.send_frame(page, connection_id)
+
+async def handle_subscribe(connection_id: UUID, request: SubscriptionRequest) -> None:
+    try:
+        async with AsyncSessionLocal() as db:
+            frame = await manager.subscribe(db, connection_id, request.room)
+    except ValueError as e:
+        await send_error(str(e), connection_id)
+        return
+    except LookupError:
+        # Клиент отключился, пока запрос ждал в очереди
+        return
+    manager.send_frame(frame, connection_id)
+
+async def handle_unsubscribe(connection_id: UUID, request: SubscriptionRequest) -> None:
+    # Через ingest, чтобы не обогнать еще не выполненный subscribe
+    manager.unsubscribe(connection_id, request.room)
+    reply = UnsubscribedResponse(room=request.room)
+    await manager.send_personal_message(reply.model_dump(), connection_id)
+
+async def handle_batch(connection_id: UUID, batch: BatchCreate, received_at: float) -> None:
+    if not manager.is_subscribed(connection_id, batch.room):
+        await send_error(f"Not subscribed to room: {batch.room}", connection_id)
+        return
+    
+    texts = [item.text for item in batch.messages]
+    async with AsyncSessionLocal() as db:
+        first_number = await manager.get_next_message_number(db, connection_id, count=len(texts))
+        messages = await manager.save_messages(db, texts, connection_id, first_number, batch.room)
+    metrics.RECEIVE_TO_PERSIST.observe(time.perf_counter() - received_at)
+    
+    await manager.broadcast_batch(messages)
+    metrics.RECEIVE_TO_BROADCAST.observe(time.perf_counter() - received_at)
+    metrics.MESSAGES_TOTAL.inc(len(messages))
+    logger.debug("Batch of %d messages saved for %s", len(messages), connection_id)
+
+async def handle_message(connection_id: UUID, message_create: MessageCreate, received_at: float) -> None:
+    if not manager.is_subscribed(connection_id, message_create.room):
+        await send_error(f"Not subscribed to room: {message_create.room}", connection_id)
+        return
+    
+    async with AsyncSessionLocal() as db:
+        message_number = await manager.get_next_message_number(db, connection_id)
+        message = await manager.save_message(
+            db, 
+            message_create.text, 
+            connection_id, 
+            message_number,
+            message_create.room,
+        )
+    metrics.RECEIVE_TO_PERSIST.observe(time.perf_counter() - received_at)
+    
+    #manager.send_frame(encode_message(message), connection_id) # personal chats
+    await manager.broadcast_message(message) #public chat
+    metrics.RECEIVE_TO_BROADCAST.observe(time.perf_counter() - received_at)
+    metrics.MESSAGES_TOTAL.inc()
+    logger.debug("Message #%d saved for %s", message_number, connection_id)
+
+async def process_request(connection_id: UUID, handler, *args) -> None:
+    """Run a request handler on an ingest worker, reporting failures to the client."""
+    try:
+        await handler(connection_id, *args)
+    except Exception as e:
+        logger.error(f"Error processing request from {connection_id}: {e}")
+        await send_error("Internal server error", connection_id)
+
+def disconnect(websocket: WebSocket) -> None:
+    """
+    Remove a connection once ingest has finished the requests it accepted.
+    
+    Messages a client sent right before closing (or before a drain closed
+    the socket) are still saved and broadcast.
+    """
+    connection = manager.get_connection(websocket)
+    if connection is None:
+        return
+    
+    async def remove() -> None:
+        manager.disconnect(websocket)
+    
+    if not ingest.defer(connection.connection_id, remove):
+        manager.disconnect(websocket)
+
+# Типы запросов, которые выполняются через ingest: (схема, обработчик)
+INGEST_HANDLERS = {
+    "history": (HistoryRequest, handle_history),
+    "search": (SearchRequest, handle_search),
+    "subscribe": (SubscriptionRequest, handle_subscribe),
+    "unsubscribe": (SubscriptionRequest, handle_unsubscribe),
+    "batch": (BatchCreate, handle_batch),
+    "message": (MessageCreate, handle_message),
+}
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, db: AsyncSession = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket):
     """
     WebSocket endpoint for chat.
     
     Each connection gets unique connection_id and separate message numbering.
     Numbering resets on reconnection.
+    
+    The socket does not hold a DB session: a short-lived session is opened per
+    operation, so idle sockets never pin pool connections.
+    
+    A reconnecting client may pass `?last_id=<id>` with the last message id it
+    saw to receive a `resume` frame with only the missed messages instead of
+    the full `init` history.
+    
+    Every connection starts subscribed to the default room. Send
+    `{"type": "subscribe", "room": ...}` / `{"type": "unsubscribe", "room": ...}`
+    to join or leave other rooms; messages and history requests carry a `room`.
+    
+    `{"type": "search", "q": ..., "room": ..., "cursor": ...}` runs a
+    full-text search and replies with a `search` frame (see `GET /search`).
+    
+    `{"type": "batch", "room": ..., "messages": [{"text": ...}, ...]}` posts
+    several messages at once: they are numbered contiguously, stored with one
+    INSERT and broadcast as a single `batch` frame.
+    
+    The server sends `{"type": "ping"}` to clients that have been silent for
+    HEARTBEAT_INTERVAL seconds and closes the socket with code 4408 if no
+    `{"type": "pong"}` (or any other frame) arrives within HEARTBEAT_TIMEOUT.
+    
+    Clients offering the `chat.msgpack` subprotocol exchange the same frames
+    as binary MessagePack instead of JSON text.
+    
+    While the server drains before a restart, clients receive
+    `{"type": "reconnect", "after": <seconds>}` and the socket is closed
+    with code 1012; new connections are refused.
     """
     client_ip = websocket.client.host if websocket.client else "unknown"
-    logger.info(f"New WebSocket connection from {client_ip}")
+    
+    if manager.draining:
+        # Процесс останавливается: клиент переподключится к другому экземпляру
+        await websocket.close(code=DRAIN_CLOSE_CODE)
+        return
+    
+    # Подключение логируется менеджером; здесь только debug, чтобы волна
+    # переподключений после деплоя не упиралась в логирование
+    logger.debug("New WebSocket connection from %s", client_ip)
     
     try:
-        connection_id = await manager.connect(websocket)
-        logger.info(f"Generated connection_id: {connection_id} for {client_ip}")
+        # На комнату по умолчанию соединение подпишется при сборке кадра
+        # init/resume, иначе сообщения, разосланные пока он собирается,
+        # пришли бы и в очереди, и в кадре
+        connection_id = await manager.connect(websocket, subscribe=False)
+        logger.debug("Generated connection_id: %s for %s", connection_id, client_ip)
         
-        history_messages = await manager.get_message_history(db, limit=50)
+        last_id = websocket.query_params.get("last_id")
+        resume_frame = None
+        # Сессия не берет соединение из пула, пока нет запроса:
+        # при теплом буфере истории подключение обходится без БД
+        async with AsyncSessionLocal() as db:
+            if last_id is not None and last_id.isdigit():
+                resume_frame = await manager.get_resume_frame(db, connection_id, int(last_id))
+            if resume_frame is None:
+                init_frame = await manager.get_init_frame(db, connection_id)
         
-        init_data = InitResponse(
-            connection_id=str(connection_id),
-            history=[
-                MessageResponse(
-                    id=msg.id,
-                    text=msg.text,
-                    connection_id=str(msg.connection_id),
-                    user_message_number=msg.user_message_number,
-                    created_at=msg.created_at,
-                )
-                for msg in history_messages
-            ]
-        )
-        await manager.send_personal_message(init_data.model_dump(), websocket)
-        
-        logger.info(f"Client {client_ip} initialized with {len(history_messages)} history messages")
+        if resume_frame is not None:
+            manager.send_frame(resume_frame, connection_id)
+            logger.debug("Client %s resumed after message %s", client_ip, last_id)
+        else:
+            manager.send_frame(init_frame, connection_id)
+            logger.debug("Client %s initialized", client_ip)
         
         while True:
-            data = await websocket.receive_text()
-            logger.debug(f"Received message from {client_ip}: {data[:100]}...")
+            data = await receive_frame(websocket)
+            received_at = time.perf_counter()
+            # Любой кадр, даже некорректный, означает, что клиент жив
+            manager.touch(connection_id, active=False)
+            logger.debug("Received message from %s: %.100s", client_ip, data)
             
             try:
-                message_data = json.loads(data)
+                message_data = decode_frame(data)
                 
                 if "type" not in message_data:
                     error = ErrorResponse(message="Missing 'type' field")
-                    await manager.send_personal_message(error.model_dump(), websocket)
+                    await manager.send_personal_message(error.model_dump(), connection_id)
+                    continue
+                
+                # pong подтверждает, что клиент жив, но не считается активностью
+                if message_data["type"] == "pong":
+                    continue
+                manager.touch(connection_id)
+                if message_data["type"] == "ping":
+                    await manager.send_personal_message(PongResponse().model_dump(), connection_id)
                     continue
                 
-                if message_data["type"] != "message":
+                if message_data["type"] not in INGEST_HANDLERS:
                     error = ErrorResponse(message=f"Unknown message type: {message_data['type']}")
-                    await manager.send_personal_message(error.model_dump(), websocket)
+                    await manager.send_personal_message(error.model_dump(), connection_id)
                     continue
+                schema, handler = INGEST_HANDLERS[message_data["type"]]
+                
+                if message_data["type"] in ("message", "history", "search", "subscribe"):
+                    # Лимит проверяется до любой работы с БД
+                    retry_after = manager.check_rate_limit(connection_id)
+                    if retry_after:
+                        throttle = ThrottleResponse(retry_after=round(retry_after, 3), request=message_data["type"])
+                        await manager.send_personal_message(throttle.model_dump(), connection_id)
+                        continue
                 
                 try:
-                    message_create = MessageCreate(**message_data)
+                    request = schema(**message_data)
                 except Exception as e:
                     error = ErrorResponse(message=f"Invalid data: {e}")
-                    await manager.send_personal_message(error.model_dump(), websocket)
+                    await manager.send_personal_message(error.model_dump(), connection_id)
                     continue
                 
-                message_number = await manager.get_next_message_number(db, connection_id)
-                message = await manager.save_message(
-                    db, 
-                    message_create.text, 
-                    connection_id, 
-                    message_number
-                )
+                if message_data["type"] == "batch":
+                    # Пакет расходует лимит как отдельные сообщения. Пакет
+                    # больше всплеска не пройдет никогда, ждать бесполезно
+                    max_cost = manager.max_rate_cost(connection_id)
+                    if max_cost is not None and len(request.messages) > max_cost:
+                        error = ErrorResponse(
+                            message=f"Batch too large: {len(request.messages)} messages, at most {int(max_cost)}"
+                        )
+                        await manager.send_personal_message(error.model_dump(), connection_id)
+                        continue
+                    retry_after = manager.check_rate_limit(connection_id, cost=len(request.messages))
+                    if retry_after:
+                        throttle = ThrottleResponse(retry_after=round(retry_after, 3), request=message_data["type"])
+                        await manager.send_personal_message(throttle.model_dump(), connection_id)
+                        continue
                 
-                response = MessageResponse(
-                    id=message.id,
-                    text=message.text,
-                    connection_id=str(message.connection_id),
-                    user_message_number=message.user_message_number,
-                    created_at=message.created_at,
-                )
-                
-                #await manager.send_personal_message(response.model_dump(), websocket) # personal chats
-                await manager.broadcast(response.model_dump()) #public chat
-                logger.info(f"Message #{message_number} saved for {connection_id}")
+                # Работа с БД выполняется воркерами ingest: цикл приема не
+                # ждет пула соединений, а при перегрузке клиент сразу
+                # получает кадр overload
+                args = (request, received_at) if message_data["type"] in ("message", "batch") else (request,)
+                ingest.submit(connection_id, partial(process_request, connection_id, handler, *args))
                 
             except json.JSONDecodeError as e:
                 error = ErrorResponse(message=f"Invalid JSON: {e}")
-                await manager.send_personal_message(error.model_dump(), websocket)
+                await manager.send_personal_message(error.model_dump(), connection_id)
+            except FrameDecodeError as e:
+                error = ErrorResponse(message=f"Invalid MessagePack: {e}")
+                await manager.send_personal_message(error.model_dump(), connection_id)
             except Exception as e:
                 logger.error(f"Error processing message from {client_ip}: {e}")
                 error = ErrorResponse(message="Internal server error")
-                await manager.send_personal_message(error.model_dump(), websocket)
+                await manager.send_personal_message(error.model_dump(), connection_id)
                 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected: {client_ip}")
-        manager.disconnect(websocket)
+        disconnect(websocket)
     except Exception as e:
         logger.error(f"Unexpected error in WebSocket endpoint: {e}")
-        manager.disconnect(websocket)
\ No newline at end of file
+        disconnect(websocket)
\ No newline at end of file
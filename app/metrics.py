@@ -0,0 +1,214 @@
+"""
+Метрики в текстовом формате Prometheus
+
+Небольшая реализация счетчиков и гистограмм без внешних зависимостей.
+Запись значения - это инкремент и bisect по границам корзин, поэтому
+инструментирование можно оставлять включенным в production.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Границы корзин для задержек в секундах: от 0.1 мс до 5 с
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "", const: str = "") -> str:
+    pairs = [const] if const else []
+    pairs.extend(f'{name}="{value}"' for name, value in zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и необязательными метками."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+        if not self.labelnames:
+            self._children[()] = _HistogramChild(self.buckets)
+
+    def labels(self, *values: str) -> _HistogramChild:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = _HistogramChild(self.buckets)
+        return child
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def render(self, const: str = "") -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{bound}"', const)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values, 'le="+Inf"', const)
+            lines.append(f"{self.name}_bucket{labels} {child.count}")
+            labels = _format_labels(self.labelnames, values, const=const)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Counter:
+    """Монотонный счетчик."""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def render(self, const: str = "") -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+            f"{self.name}{_format_labels((), (), const=const)} {self.value}",
+        ]
+
+
+class CallbackMetric:
+    """Счетчик или gauge, значение которого читается при отдаче метрик."""
+
+    def __init__(self, name: str, documentation: str, kind: str, callback: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.callback = callback
+
+    def render(self, const: str = "") -> List[str]:
+        if self.callback is None:
+            return []
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name}{_format_labels((), (), const=const)} {self.callback()}",
+        ]
+
+
+class Registry:
+    """
+    Набор метрик, отдаваемых на /metrics.
+
+    const_labels добавляются к каждой строке: при нескольких воркерах
+    на одном порту метка shard отличает счетчики разных процессов.
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self.const_labels: Dict[str, str] = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        const = ",".join(f'{name}="{value}"' for name, value in self.const_labels.items())
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render(const))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ===== Путь сообщения =====
+
+RECEIVE_TO_PERSIST = REGISTRY.register(Histogram(
+    "chat_receive_to_persist_seconds",
+    "Time from receiving a message frame to having it persisted (or queued for write-behind)",
+))
+RECEIVE_TO_BROADCAST = REGISTRY.register(Histogram(
+    "chat_receive_to_broadcast_seconds",
+    "Time from receiving a message frame to publishing its broadcast",
+))
+FANOUT_SECONDS = REGISTRY.register(Histogram(
+    "chat_fanout_seconds",
+    "Time to enqueue one frame to every local connection",
+))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "chat_db_query_seconds",
+    "Database query time by operation",
+    labelnames=("query",),
+))
+INGEST_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "chat_ingest_queue_wait_seconds",
+    "Time a request waits in the ingest queue before a worker picks it up",
+))
+MESSAGES_TOTAL = REGISTRY.register(Counter(
+    "chat_messages_total",
+    "Chat messages accepted from clients",
+))
+
+# ===== Соединения и рассылка (значения берутся из ConnectionManager) =====
+
+ACTIVE_CONNECTIONS = REGISTRY.register(CallbackMetric(
+    "chat_active_connections", "Currently open WebSocket connections", "gauge",
+))
+SEND_FAILURES = REGISTRY.register(CallbackMetric(
+    "chat_send_failures_total", "Frames that failed to send to a socket", "counter",
+))
+DROPPED_FRAMES = REGISTRY.register(CallbackMetric(
+    "chat_dropped_frames_total", "Frames dropped because a client send queue was full", "counter",
+))
+THROTTLED_MESSAGES = REGISTRY.register(CallbackMetric(
+    "chat_throttled_messages_total", "Requests rejected by rate limiting", "counter",
+))
+QUEUED_FRAMES = REGISTRY.register(CallbackMetric(
+    "chat_queued_frames", "Frames waiting in client send queues", "gauge",
+))
+HEARTBEAT_DISCONNECTS = REGISTRY.register(CallbackMetric(
+    "chat_heartbeat_disconnects_total", "Connections closed for missing pongs or idling", "counter",
+))
+INGEST_IN_FLIGHT = REGISTRY.register(CallbackMetric(
+    "chat_ingest_in_flight", "Requests accepted by the ingest stage and not yet finished", "gauge",
+))
+INGEST_REJECTED = REGISTRY.register(CallbackMetric(
+    "chat_ingest_rejected_total", "Requests rejected with an overload frame (queue full or deadline)", "counter",
+))
@@ -3,14 +3,23 @@
 """
 import logging
 from datetime import datetime
-from sqlalchemy import Column, Integer, Text, DateTime, Index, func
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, Computed, Integer, String, Text, DateTime, Index, func
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID
+from sqlalchemy.orm import deferred
 import uuid
 
 from .database import Base
 
 logger = logging.getLogger("models")
 
+# Комната, в которую попадают сообщения без явно указанной комнаты
+DEFAULT_ROOM = "general"
+
+# Конфигурация полнотекстового поиска: russian стеммит кириллицу
+# русским стеммером, а латиницу - английским. Зафиксирована в
+# выражении колонки search_vector (миграция 0004)
+SEARCH_CONFIG = "russian"
+
 class Message(Base):
     """
     Модель сообщения в чате.
@@ -18,18 +27,31 @@ class Message(Base):
     Атрибуты:
         id: Уникальный идентификатор сообщения (автоинкремент)
         text: Текст сообщения
+        room: Комната (канал), в которую отправлено сообщение
         connection_id: UUID идентификатор WebSocket подключения
         user_message_number: Порядковый номер сообщения для ЭТОГО connection_id
         created_at: Время создания сообщения
+        search_vector: tsvector текста для полнотекстового поиска (генерируемая колонка)
     
     Индексы:
         idx_connection_id: Для быстрого поиска сообщений по connection_id
         idx_connection_number: Уникальная комбинация connection_id + user_message_number
+        ix_messages_created_at: Для выборок по времени создания
+        idx_room_id: История комнаты (room, id) для keyset-пагинации
+        idx_messages_search: GIN по search_vector для полнотекстового поиска
+    
+    Пагинация истории идет по первичному ключу (keyset по id),
+    история комнаты - по индексу (room, id).
+    
+    В production схема ведется миграциями alembic: после миграции 0002
+    таблица секционирована по created_at, первичный ключ в БД - (id, created_at),
+    а idx_connection_number включает created_at. Для ORM ключом остается id.
     """
     __tablename__ = "messages"
     
     id = Column(Integer, primary_key=True, index=True)
     text = Column(Text, nullable=False)
+    room = Column(String(64), nullable=False, default=DEFAULT_ROOM, server_default=DEFAULT_ROOM)
     connection_id = Column(
         UUID(as_uuid=True),  # Нативный тип UUID PostgreSQL
         nullable=False,
@@ -39,8 +61,15 @@ class Message(Base):
     created_at = Column(
         DateTime(timezone=True), 
         server_default=func.now(),
-        nullable=False
+        nullable=False,
+        index=True
     )
+    # Вычисляется PostgreSQL при вставке; deferred - чтобы история
+    # и рассылка не читали tsvector вместе с сообщением
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{SEARCH_CONFIG}', text)", persisted=True),
+    ))
     
     # Составной уникальный индекс
     __table_args__ = (
@@ -50,10 +79,12 @@ class Message(Base):
             'user_message_number', 
             unique=True
         ),
+        Index('idx_room_id', 'room', 'id'),
+        Index('idx_messages_search', 'search_vector', postgresql_using='gin'),
     )
     
     def __repr__(self):
-        return f"<Message(id={self.id}, connection={self.connection_id}, number={self.user_message_number})>"
+        return f"<Message(id={self.id}, room={self.room}, connection={self.connection_id}, number={self.user_message_number})>"
 
 # Функция для генерации connection_id
 def generate_connection_id() -> uuid.UUID:
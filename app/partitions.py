@@ -0,0 +1,210 @@
+"""
+Обслуживание секций таблицы messages и политика хранения
+
+Таблица messages секционирована по created_at (миграция 0002). Фоновая
+задача заранее создает секции на ближайшие периоды и удаляет секции старше
+срока хранения, при необходимости выгружая их в сжатые CSV-файлы.
+Удаление секции - это DROP TABLE, а не DELETE, поэтому очистка не создает
+нагрузки на вставку и чтение свежих сообщений.
+"""
+import os
+import re
+import gzip
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+import asyncpg
+
+from .database import ASYNCPG_DSN
+
+logger = logging.getLogger("partitions")
+
+PARTITION_MAINTENANCE = os.getenv("PARTITION_MAINTENANCE", "false").lower() == "true"
+# Длина периода одной секции: month или day
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month").lower()
+# Сколько будущих секций держать созданными заранее
+PARTITION_PREMAKE = int(os.getenv("PARTITION_PREMAKE", "2"))
+PARTITION_CHECK_SECONDS = int(os.getenv("PARTITION_CHECK_SECONDS", "3600"))
+
+# Срок хранения в днях, 0 - хранить все
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+# archive - выгрузить секцию в ARCHIVE_DIR перед удалением, drop - просто удалить
+RETENTION_ACTION = os.getenv("RETENTION_ACTION", "archive").lower()
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
+PARTITION_INTERVALS = ("month", "day")
+RETENTION_ACTIONS = ("archive", "drop")
+
+TABLE = "messages"
+# Ключ pg_try_advisory_lock: при нескольких воркерах или узлах обслуживание
+# выполняет только один из них, остальные пропускают проход
+ADVISORY_LOCK_KEY = 0x6d736770  # "msgp"
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+Partition = Tuple[str, datetime, datetime]
+
+
+def period_start(moment: datetime, interval: str) -> datetime:
+    """Начало периода, в который попадает moment."""
+    moment = moment.astimezone(timezone.utc)
+    if interval == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(start: datetime, interval: str) -> datetime:
+    """Начало следующего периода."""
+    if interval == "day":
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+class PartitionManager:
+    """Создает будущие секции messages и применяет политику хранения."""
+
+    def __init__(
+        self,
+        dsn: str = ASYNCPG_DSN,
+        interval: str = PARTITION_INTERVAL,
+        premake: int = PARTITION_PREMAKE,
+        retention_days: int = RETENTION_DAYS,
+        retention_action: str = RETENTION_ACTION,
+        archive_dir: str = ARCHIVE_DIR,
+        check_seconds: int = PARTITION_CHECK_SECONDS,
+    ):
+        if interval not in PARTITION_INTERVALS:
+            raise ValueError(f"Неизвестный период секций: {interval}")
+        if retention_action not in RETENTION_ACTIONS:
+            raise ValueError(f"Неизвестное действие хранения: {retention_action}")
+
+        self.dsn = dsn
+        self.interval = interval
+        self.premake = premake
+        self.retention_days = retention_days
+        self.retention_action = retention_action
+        self.archive_dir = archive_dir
+        self.check_seconds = check_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Выполняет обслуживание сразу и запускает периодическую задачу."""
+        await self._run_safely()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> None:
+        """Один проход: создать недостающие секции и удалить устаревшие."""
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            # Блокировка сессии снимается вместе с закрытием соединения
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", ADVISORY_LOCK_KEY):
+                logger.debug("Секции обслуживает другой процесс")
+                return
+            await conn.execute("SET TIME ZONE 'UTC'")
+            if not await self._is_partitioned(conn):
+                logger.warning("Таблица messages не секционирована, выполните alembic upgrade head")
+                return
+
+            partitions = await self._list_partitions(conn)
+            await self._create_future(conn, partitions)
+            if self.retention_days > 0:
+                await self._apply_retention(conn, partitions)
+        finally:
+            await conn.close()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            await self._run_safely()
+
+    async def _run_safely(self) -> None:
+        try:
+            await self.run_once()
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.error(f"Ошибка обслуживания секций: {e}")
+
+    async def _is_partitioned(self, conn: asyncpg.Connection) -> bool:
+        return await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass($1))",
+            TABLE,
+        )
+
+    async def _list_partitions(self, conn: asyncpg.Connection) -> List[Partition]:
+        """Возвращает секции с диапазонами, кроме DEFAULT, по возрастанию."""
+        rows = await conn.fetch(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass($1)",
+            TABLE,
+        )
+        partitions = []
+        for row in rows:
+            match = _BOUND_RE.search(row["bound"])
+            if match is None:
+                continue
+            lower, upper = (datetime.fromisoformat(value) for value in match.groups())
+            partitions.append((row["relname"], lower, upper))
+        return sorted(partitions, key=lambda p: p[1])
+
+    async def _create_future(self, conn: asyncpg.Connection, partitions: List[Partition]) -> None:
+        now = datetime.now(timezone.utc)
+        target = period_start(now, self.interval)
+        for _ in range(self.premake + 1):
+            target = next_period(target, self.interval)
+
+        start = partitions[-1][2] if partitions else period_start(now, self.interval)
+        while start < target:
+            end = next_period(period_start(start, self.interval), self.interval)
+            name = f"{TABLE}_p{start:%Y%m%d}"
+            try:
+                await conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF {TABLE} '
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+                logger.info(f"Создана секция {name}: {start:%Y-%m-%d} - {end:%Y-%m-%d}")
+            except asyncpg.PostgresError as e:
+                # Например, в DEFAULT уже есть строки из этого диапазона
+                logger.error(f"Не удалось создать секцию {name}: {e}")
+                return
+            start = end
+
+    async def _apply_retention(self, conn: asyncpg.Connection, partitions: List[Partition]) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        for name, _, upper in partitions:
+            if upper > cutoff:
+                break
+
+            if self.retention_action == "archive":
+                path = await self._archive(conn, name)
+                logger.info(f"Секция {name} выгружена в {path}")
+
+            await conn.execute(f'ALTER TABLE {TABLE} DETACH PARTITION "{name}"')
+            await conn.execute(f'DROP TABLE "{name}"')
+            logger.info(f"Секция {name} удалена по сроку хранения ({self.retention_days} дн.)")
+
+    async def _archive(self, conn: asyncpg.Connection, name: str) -> str:
+        """Выгружает секцию в сжатый CSV. Файл появляется только после полной записи."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        tmp_path = path + ".tmp"
+
+        with gzip.open(tmp_path, "wb") as archive:
+            async def write(chunk: bytes) -> None:
+                await asyncio.to_thread(archive.write, chunk)
+
+            await conn.copy_from_table(name, output=write, format="csv", header=True)
+
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,264 @@
+"""
+Отложенная пакетная запись сообщений в базу данных (write-behind)
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, List, Optional
+from uuid import UUID
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .models import DEFAULT_ROOM, Message
+
+logger = logging.getLogger("persistence")
+
+# sync - каждое сообщение сохраняется отдельной транзакцией до рассылки
+# write_behind - сообщение рассылается сразу, а в БД пишется пакетами
+PERSISTENCE_MODE = os.getenv("PERSISTENCE_MODE", "sync").lower()
+PERSISTENCE_MODES = ("sync", "write_behind")
+
+# Максимальный размер пакета и максимальное время ожидания сообщения в памяти.
+# WRITE_BEHIND_FLUSH_MS - граница потерь при падении процесса: теряются
+# сообщения, принятые не более чем за это время до падения (плюс пакет,
+# который пишется в этот момент). Кроме того, пакет, который не удалось
+# записать за WRITE_BEHIND_RETRIES попыток, теряется целиком, сколько бы
+# он ни ждал (счетчик failed_messages).
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+# Сколько id резервируется за один запрос к последовательности. Блоки
+# разных воркеров перемежаются, и id перестают расти в порядке рассылки,
+# поэтому при нескольких воркерах нужен блок из одного id
+WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000"))
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "3"))
+
+if PERSISTENCE_MODE not in PERSISTENCE_MODES:
+    raise ValueError(f"Неизвестный режим сохранения: {PERSISTENCE_MODE}")
+
+
+class MessageWriter:
+    """
+    Фоновая пакетная запись сообщений.
+
+    id и created_at назначаются в процессе: id резервируются блоками из
+    последовательности таблицы messages, поэтому сообщение можно разослать
+    до того, как оно попадет в БД. Фоновая задача собирает пакет, пока он не
+    наберет batch_size строк или не пройдет flush_interval_ms с первого
+    сообщения пакета, и пишет его одним многострочным INSERT.
+
+    Разосланное сообщение может не попасть в БД: при падении процесса
+    теряется еще не записанная очередь, а пакет, не записанный за retries
+    попыток (например, пока БД недоступна), отбрасывается целиком и
+    учитывается в failed_messages.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        flush_interval_ms: int = WRITE_BEHIND_FLUSH_MS,
+        queue_size: int = WRITE_BEHIND_QUEUE_SIZE,
+        id_block: int = WRITE_BEHIND_ID_BLOCK,
+        retries: int = WRITE_BEHIND_RETRIES,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.id_block = id_block
+        self.retries = retries
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._ids: Deque[int] = deque()
+        self._ids_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.flushed_messages = 0
+        self.flushed_batches = 0
+        self.failed_messages = 0
+
+    async def start(self) -> None:
+        """Запускает фоновую задачу записи."""
+        if self._task is None:
+            self._spawn()
+            logger.info(
+                f"Write-behind запущен: пакет до {self.batch_size}, "
+                f"интервал {self.flush_interval * 1000:.0f} мс"
+            )
+
+    def _spawn(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        """Перезапускает фоновую задачу, если она упала: иначе очередь
+        переполнится и submit() будет ждать вечно."""
+        if task.cancelled() or task is not self._task:
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"Фоновая запись упала, перезапуск: {error!r}")
+            self._spawn()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Дописывает накопленные сообщения и останавливает фоновую задачу.
+        Вызывается при остановке приложения.
+        """
+        if self._task is None:
+            return
+
+        await self.flush(timeout)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"Write-behind остановлен. Записано сообщений: {self.flushed_messages}")
+
+    async def flush(self, timeout: float = 10.0) -> None:
+        """Ждет, пока накопленные сообщения будут записаны в БД."""
+        if self._task is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Не удалось дописать {self._queue.qsize()} сообщений за {timeout} с")
+
+    async def submit(
+        self,
+        text: str,
+        connection_id: UUID,
+        message_number: int,
+        room: str = DEFAULT_ROOM,
+    ) -> Message:
+        """
+        Назначает сообщению id и время и ставит его в очередь на запись.
+
+        Returns:
+            Message: Объект сообщения, еще не сохраненный в БД
+        """
+        message_id = await self._next_id()
+        created_at = datetime.now(timezone.utc)
+        row = {
+            "id": message_id,
+            "text": text,
+            "room": room,
+            "connection_id": connection_id,
+            "user_message_number": message_number,
+            "created_at": created_at,
+        }
+        # При переполнении очереди ждем: это обратное давление на отправителя
+        await self._queue.put(row)
+        return Message(**row)
+
+    async def submit_many(
+        self,
+        texts: List[str],
+        connection_id: UUID,
+        first_number: int,
+        room: str = DEFAULT_ROOM,
+    ) -> List[Message]:
+        """
+        Ставит пакет сообщений в очередь подряд: фоновая задача заберет
+        их в один многострочный INSERT (если пакет не упрется в batch_size).
+
+        Returns:
+            List[Message]: Сообщения с назначенными id, еще не сохраненные в БД
+        """
+        created_at = datetime.now(timezone.utc)
+        rows = []
+        for offset, text in enumerate(texts):
+            rows.append({
+                "id": await self._next_id(),
+                "text": text,
+                "room": room,
+                "connection_id": connection_id,
+                "user_message_number": first_number + offset,
+                "created_at": created_at,
+            })
+        for row in rows:
+            await self._queue.put(row)
+        return [Message(**row) for row in rows]
+
+    def get_stats(self) -> dict:
+        """Возвращает метрики фоновой записи."""
+        return {
+            "pending_messages": self._queue.qsize(),
+            "flushed_messages": self.flushed_messages,
+            "flushed_batches": self.flushed_batches,
+            "failed_messages": self.failed_messages,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": int(self.flush_interval * 1000),
+        }
+
+    async def _next_id(self) -> int:
+        if not self._ids:
+            async with self._ids_lock:
+                if not self._ids:
+                    await self._reserve_ids()
+        return self._ids.popleft()
+
+    async def _reserve_ids(self) -> None:
+        """Резервирует блок id из последовательности таблицы messages."""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                text(
+                    "SELECT nextval(pg_get_serial_sequence('messages', 'id')) "
+                    "FROM generate_series(1, :count)"
+                ),
+                {"count": self.id_block},
+            )
+            self._ids.extend(sorted(result.scalars().all()))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                # Сначала забираем все, что уже лежит в очереди
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[dict]) -> None:
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self.session_factory() as db:
+                    await db.execute(insert(Message), batch)
+                    await db.commit()
+
+                self.flushed_messages += len(batch)
+                self.flushed_batches += 1
+                logger.debug(f"Записан пакет из {len(batch)} сообщений")
+                return
+            # Не только SQLAlchemyError: недоступная БД дает ConnectionRefusedError/OSError.
+            # CancelledError не перехватывается
+            except Exception as e:
+                logger.error(f"Ошибка записи пакета (попытка {attempt}/{self.retries}): {e}")
+                await asyncio.sleep(min(0.1 * 2 ** attempt, 2.0))
+
+        self.failed_messages += len(batch)
+        logger.error(f"Пакет из {len(batch)} сообщений потерян")
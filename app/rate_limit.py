@@ -0,0 +1,55 @@
+"""
+Ограничение частоты сообщений (token bucket)
+"""
+import os
+import time
+from typing import Optional
+
+# Лимит на одно соединение: сообщений в секунду и размер всплеска.
+# 0 отключает ограничение.
+RATE_LIMIT_PER_CONNECTION = float(os.getenv("RATE_LIMIT_PER_CONNECTION", "5"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+
+# Общий лимит на процесс, защищает пул соединений БД
+RATE_LIMIT_GLOBAL = float(os.getenv("RATE_LIMIT_GLOBAL", "500"))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "1000"))
+
+
+class TokenBucket:
+    """
+    Корзина токенов: пополняется со скоростью rate в секунду до burst.
+
+    Хранит только два числа, пополнение считается лениво при обращении,
+    поэтому на соединение нужна O(1) память и нет фоновых таймеров.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self, cost: float = 1, now: Optional[float] = None) -> float:
+        """
+        Возвращает, сколько секунд нужно подождать, чтобы хватило токенов.
+        0 - токенов достаточно прямо сейчас. Токены не списываются.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1) -> None:
+        self.tokens -= cost
+
+
+def create_bucket(rate: float, burst: float) -> Optional[TokenBucket]:
+    """Создает корзину или возвращает None, если лимит отключен."""
+    if rate <= 0:
+        return None
+    return TokenBucket(rate, max(burst, 1))
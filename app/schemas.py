@@ -7,19 +7,69 @@ from uuid import UUID
 from typing import List, Optional
 
 from pydantic import ConfigDict
+import os
 import json
 
+from .models import DEFAULT_ROOM
+from .rate_limit import RATE_LIMIT_BURST, RATE_LIMIT_PER_CONNECTION
+
+# Имя комнаты: без пробелов и кавычек, чтобы его можно было
+# вставлять в кадры и payload шины без экранирования
+ROOM_PATTERN = r"^[A-Za-z0-9_.-]{1,64}$"
+
+# Курсор поиска "<rank>:<id>" из next_cursor предыдущей страницы
+SEARCH_CURSOR_PATTERN = r"^[0-9.eE+-]{1,32}:[0-9]{1,19}$"
+
+# Максимум сообщений в одном кадре batch. Пакет расходует лимит частоты
+# как отдельные сообщения, поэтому по умолчанию не больше всплеска
+BATCH_MAX_MESSAGES = int(os.getenv(
+    "BATCH_MAX_MESSAGES",
+    str(max(int(RATE_LIMIT_BURST), 1) if RATE_LIMIT_PER_CONNECTION > 0 else 100),
+))
+
 # ===== Входящие данные (от клиента к серверу) =====
 
 class MessageCreate(BaseModel):
     """Схема для создания нового сообщения"""
     text: str = Field(..., min_length=1, max_length=1000, description="Текст сообщения")
+    room: str = Field(DEFAULT_ROOM, pattern=ROOM_PATTERN, description="Комната, в которую отправляется сообщение")
+
+
+class BatchItem(BaseModel):
+    """Одно сообщение пакета"""
+    text: str = Field(..., min_length=1, max_length=1000, description="Текст сообщения")
+
+
+class BatchCreate(BaseModel):
+    """Схема пакета сообщений в одну комнату: нумеруются подряд и сохраняются одним INSERT"""
+    room: str = Field(DEFAULT_ROOM, pattern=ROOM_PATTERN, description="Комната, в которую отправляется пакет")
+    messages: List[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_MESSAGES, description="Сообщения пакета")
+
+
+class HistoryRequest(BaseModel):
+    """Схема запроса страницы истории старше указанного сообщения"""
+    before: Optional[int] = Field(None, ge=1, description="id сообщения, старше которого нужна история")
+    limit: int = Field(50, ge=1, le=200, description="Размер страницы")
+    room: str = Field(DEFAULT_ROOM, pattern=ROOM_PATTERN, description="Комната")
+
+
+class SearchRequest(BaseModel):
+    """Схема полнотекстового поиска по сообщениям"""
+    q: str = Field(..., min_length=1, max_length=200, description="Поисковый запрос (синтаксис websearch_to_tsquery)")
+    room: Optional[str] = Field(None, pattern=ROOM_PATTERN, description="Комната, None - все комнаты")
+    limit: int = Field(20, ge=1, le=100, description="Размер страницы")
+    cursor: Optional[str] = Field(None, pattern=SEARCH_CURSOR_PATTERN, description="next_cursor предыдущей страницы")
+
 
+class SubscriptionRequest(BaseModel):
+    """Схема подписки на комнату (type=subscribe) или отписки (type=unsubscribe)"""
+    room: str = Field(..., pattern=ROOM_PATTERN, description="Комната")
 
 
 class MessageResponse(BaseModel):
     type: str = "message"
     id: int
+    room: str = DEFAULT_ROOM
     text: str
     connection_id: str
     user_message_number: int
@@ -32,17 +82,96 @@ class MessageResponse(BaseModel):
         }
     )
 
+class LimitsResponse(BaseModel):
+    """Лимиты соединения, которые клиент соблюдает сам"""
+    batch_max_messages: int  # Максимум сообщений в кадре batch
+    rate: float  # Сообщений в секунду, 0 - без ограничения
+    burst: float  # Размер всплеска
+
 class InitResponse(BaseModel):
     """Схема инициализации при подключении"""
     type: str = "init"
     connection_id: str  # UUID как строка
+    limits: LimitsResponse
+    history: List[MessageResponse]
+
+class ResumeResponse(BaseModel):
+    """Схема возобновления: только сообщения, пропущенные после last_id"""
+    type: str = "resume"
+    connection_id: str  # Новый UUID как строка
+    limits: LimitsResponse
+    messages: List[MessageResponse]
+
+class HistoryResponse(BaseModel):
+    """Схема страницы истории"""
+    type: str = "history"
+    room: str = DEFAULT_ROOM
+    messages: List[MessageResponse]
+    next_before: Optional[int] = None  # null - более старых сообщений нет
+
+class SearchResult(MessageResponse):
+    """Найденное сообщение с релевантностью и фрагментом текста"""
+    rank: float
+    snippet: str  # HTML: текст экранирован, совпадения в <mark>
+
+class SearchResponse(BaseModel):
+    """Схема страницы результатов поиска, по убыванию релевантности"""
+    type: str = "search"
+    q: str
+    room: Optional[str] = None
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None  # null - результатов больше нет
+
+class BatchResponse(BaseModel):
+    """Схема пакета сообщений, разосланного одним кадром"""
+    type: str = "batch"
+    room: str
+    messages: List[MessageResponse]
+
+class SubscribedResponse(BaseModel):
+    """Схема подтверждения подписки с последними сообщениями комнаты"""
+    type: str = "subscribed"
+    room: str
     history: List[MessageResponse]
 
+class UnsubscribedResponse(BaseModel):
+    """Схема подтверждения отписки"""
+    type: str = "unsubscribed"
+    room: str
+
+class PingResponse(BaseModel):
+    """Heartbeat от сервера: клиент должен ответить кадром {"type": "pong"}"""
+    type: str = "ping"
+    interval: float  # Период heartbeat в секундах
+
+class ReconnectResponse(BaseModel):
+    """Drain перед остановкой сервера: переподключиться через after секунд"""
+    type: str = "reconnect"
+    after: float  # Своя случайная задержка для каждого клиента
+
+class PongResponse(BaseModel):
+    """Ответ сервера на ping от клиента"""
+    type: str = "pong"
+
 class ErrorResponse(BaseModel):
     """Схема для ошибок"""
     type: str = "error"
     message: str
 
+class ThrottleResponse(BaseModel):
+    """Схема отказа из-за превышения лимита частоты сообщений"""
+    type: str = "throttle"
+    message: str = "Too many messages"
+    retry_after: float  # Через сколько секунд можно повторить
+    request: Optional[str] = None  # Тип отклоненного запроса (message, batch, ...)
+
+class OverloadResponse(BaseModel):
+    """Схема отказа из-за перегрузки сервера: запрос не выполнен"""
+    type: str = "overload"
+    message: str = "Server overloaded"
+    reason: str  # queue_full - очередь заполнена, deadline - истек срок ожидания
+    retry_after: float  # Через сколько секунд можно повторить
+
 # ===== Вспомогательные схемы =====
 
 class HealthResponse(BaseModel):
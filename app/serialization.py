@@ -0,0 +1,126 @@
+"""
+Сериализация кадров: JSON и необязательный MessagePack
+
+Кадры описываются схемами app/schemas.py и собираются в JSON. Клиент,
+выбравший подпротокол chat.msgpack, получает те же объекты в MessagePack:
+JSON-кадр перекодируется один раз на рассылку, поэтому отдельного
+описания бинарного формата нет.
+"""
+import os
+import json
+import logging
+from typing import Any, List, Optional, Union
+
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy.engine import Row
+
+from .models import Message
+
+logger = logging.getLogger("serialization")
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack - необязательная зависимость
+    msgpack = None
+
+# orjson - самый быстрый вариант, если пакет установлен;
+# pydantic - сериализатор pydantic-core, доступен всегда
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson" if orjson is not None else "pydantic").lower()
+JSON_BACKENDS = ("orjson", "pydantic")
+
+if JSON_BACKEND not in JSON_BACKENDS:
+    raise ValueError(f"Неизвестный JSON backend: {JSON_BACKEND}")
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise RuntimeError("JSON_BACKEND=orjson, но пакет orjson не установлен")
+
+# Подпротокол WebSocket для бинарных кадров MessagePack
+MSGPACK_SUBPROTOCOL = "chat.msgpack"
+# Предлагать MessagePack клиентам, если пакет msgpack установлен
+WIRE_MSGPACK = os.getenv("WIRE_MSGPACK", "true").lower() == "true" and msgpack is not None
+
+_any_adapter = TypeAdapter(Any)
+
+logger.debug(f"JSON backend: {JSON_BACKEND}")
+
+
+def dumps(obj: Any) -> str:
+    """
+    Сериализует словарь/список в JSON-строку.
+    datetime и UUID поддерживаются обоими backend'ами без своего encoder'а.
+    """
+    if JSON_BACKEND == "orjson":
+        return orjson.dumps(obj).decode()
+    return _any_adapter.dump_json(obj).decode()
+
+
+def loads(data: str) -> Any:
+    """
+    Разбирает входящий JSON-кадр.
+    Ошибка разбора в обоих случаях - json.JSONDecodeError.
+    """
+    if JSON_BACKEND == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_model(model: BaseModel) -> str:
+    """Сериализует pydantic-модель за один проход pydantic-core."""
+    return model.model_dump_json()
+
+
+def encode_message(message: Union[Message, Row]) -> str:
+    """
+    Сериализует сообщение из БД в кадр MessageResponse.
+
+    Данные из БД уже прошли валидацию при создании, поэтому модель
+    MessageResponse не строится: словарь сразу уходит в JSON. Подходит
+    и ORM-объект, и строка select() с колонками сообщения.
+    """
+    return dumps({
+        "type": "message",
+        "id": message.id,
+        "room": message.room,
+        "text": message.text,
+        "connection_id": str(message.connection_id),
+        "user_message_number": message.user_message_number,
+        "created_at": message.created_at,
+    })
+
+
+class FrameDecodeError(ValueError):
+    """Бинарный кадр не является корректным MessagePack."""
+
+
+def select_subprotocol(offered: List[str]) -> Optional[str]:
+    """Выбирает подпротокол из предложенных клиентом, None - JSON по умолчанию."""
+    if WIRE_MSGPACK and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def pack_frame(frame: str) -> bytes:
+    """Перекодирует готовый JSON-кадр в MessagePack."""
+    return msgpack.packb(loads(frame))
+
+
+def decode_frame(data: Union[str, bytes]) -> Any:
+    """
+    Разбирает входящий кадр: текст - JSON, байты - MessagePack.
+
+    Raises:
+        json.JSONDecodeError: Некорректный JSON
+        FrameDecodeError: Некорректный MessagePack или он не поддерживается
+    """
+    if isinstance(data, str):
+        return loads(data)
+    if msgpack is None:
+        raise FrameDecodeError("MessagePack не поддерживается")
+    try:
+        return msgpack.unpackb(data)
+    except (ValueError, msgpack.UnpackException) as e:
+        raise FrameDecodeError(str(e) or type(e).__name__) from e
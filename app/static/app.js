@@ -7,6 +7,57 @@ class WebSocketChat {
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
         this.reconnectDelay = 2000;
+        this.maxReconnectDelay = 30000;
+        
+        // Задержка из кадра reconnect: сервер останавливается и сам
+        // распределяет переподключения клиентов по времени
+        this.serverReconnectDelay = null;
+        
+        // Подгрузка старой истории (keyset-пагинация по id)
+        this.oldestMessageId = null;
+        this.hasMoreHistory = false;
+        this.loadingHistory = false;
+        this.historyPageSize = 50;
+        
+        // Поиск по текущей комнате: next_cursor следующей страницы
+        this.searchQuery = null;
+        this.searchCursor = null;
+        this.searchPageSize = 20;
+        
+        // id последнего полученного сообщения комнаты по умолчанию, в порядке
+        // получения, а не наибольший: сервер досылает все, что разослано после
+        // него, а порядок рассылки может не совпадать с порядком id
+        this.lastMessageId = null;
+        
+        // Heartbeat: сервер присылает ping, если клиент молчит. Если от сервера
+        // долго нет ни одного кадра, соединение считается мертвым
+        this.heartbeatInterval = null;
+        this.watchdogTimer = null;
+        
+        // Очередь исходящих сообщений {room, text} для склейки в batch
+        this.outbox = [];
+        this.outboxTimer = null;
+        this.batchWindow = 150;
+        // Последний отправленный пакет: при throttle он возвращается в очередь
+        this.lastSent = null;
+        // Лимиты сервера приходят в init/resume (limits): размер пакета и
+        // частота, которую клиент выдерживает сам по своей корзине токенов
+        this.batchMaxMessages = 1;
+        this.rateLimit = 0;
+        this.rateBurst = 0;
+        this.tokens = 0;
+        this.tokensAt = 0;
+        
+        // Комната, которая сейчас на экране. Соединение всегда подписано
+        // на комнату по умолчанию, остальные подписываются кадром subscribe
+        this.defaultRoom = 'general';
+        this.room = this.defaultRoom;
+        
+        // ?proto=msgpack - бинарные кадры MessagePack вместо JSON.
+        // Сжатие permessage-deflate браузер согласует сам
+        this.wireProtocol = new URLSearchParams(window.location.search).get('proto') === 'msgpack'
+            ? 'chat.msgpack'
+            : null;
         
         this.initializeElements();
         this.initializeEventListeners();
@@ -20,17 +71,41 @@ class WebSocketChat {
         this.statusDot = document.querySelector('.status-dot');
         this.messagesList = document.getElementById('messages-list');
         this.sendBtn = document.getElementById('send-btn');
+        this.roomForm = document.getElementById('room-form');
+        this.roomInput = document.getElementById('room-input');
+        this.roomTitle = document.getElementById('room-title');
+        this.searchForm = document.getElementById('search-form');
+        this.searchInput = document.getElementById('search-input');
+        this.searchResults = document.getElementById('search-results');
     }
     
     initializeEventListeners() {
         this.form.addEventListener('submit', (e) => this.handleSubmit(e));
+        if (this.roomForm) {
+            this.roomForm.addEventListener('submit', (e) => {
+                e.preventDefault();
+                this.switchRoom(this.roomInput.value.trim());
+            });
+        }
+        if (this.searchForm) {
+            this.searchForm.addEventListener('submit', (e) => {
+                e.preventDefault();
+                this.search(this.searchInput.value.trim());
+            });
+        }
+        this.messagesList.addEventListener('scroll', () => {
+            if (this.messagesList.scrollTop < 50) {
+                this.requestOlderHistory();
+            }
+        });
     }
     
     connectWebSocket() {
         const wsUrl = this.getWebSocketUrl();
         console.log(`Подключение к WebSocket: ${wsUrl}`);
         
-        this.ws = new WebSocket(wsUrl);
+        this.ws = new WebSocket(wsUrl, this.wireProtocol ? [this.wireProtocol] : []);
+        this.ws.binaryType = 'arraybuffer';
         this.updateStatus('connecting', 'Подключение...');
         
         this.ws.onopen = () => this.handleOpen();
@@ -42,7 +117,8 @@ class WebSocketChat {
     getWebSocketUrl() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
         const host = window.location.host;
-        return `${protocol}//${host}/ws`;
+        const query = this.lastMessageId !== null ? `?last_id=${this.lastMessageId}` : '';
+        return `${protocol}//${host}/ws${query}`;
     }
     
     handleOpen() {
@@ -54,23 +130,56 @@ class WebSocketChat {
     
     handleMessage(event) {
         console.log('Получено сообщение от сервера:', event.data);
+        this.resetWatchdog();
         
         try {
-            const data = JSON.parse(event.data);
+            const data = typeof event.data === 'string'
+                ? JSON.parse(event.data)
+                : MessagePack.decode(event.data);
             
             switch (data.type) {
                 case 'init':
                     this.handleInit(data);
                     break;
+                case 'resume':
+                    this.handleResume(data);
+                    break;
                 case 'message':
                     this.handleNewMessage(data);
                     break;
+                case 'ping':
+                    this.heartbeatInterval = data.interval;
+                    this.send({ type: 'pong' });
+                    break;
+                case 'pong':
+                    break;
+                case 'reconnect':
+                    this.handleReconnectRequest(data);
+                    break;
+                case 'batch':
+                    data.messages.forEach(msg => this.handleNewMessage(msg));
+                    break;
                 case 'history':
-                    this.handleHistory(data.messages);
+                    this.handleOlderHistory(data);
+                    break;
+                case 'search':
+                    this.handleSearchResults(data);
+                    break;
+                case 'subscribed':
+                    this.handleSubscribed(data);
+                    break;
+                case 'unsubscribed':
+                    console.log(`Отписка от комнаты ${data.room}`);
                     break;
                 case 'error':
                     this.showError(data.message);
                     break;
+                case 'throttle':
+                    this.handleThrottle(data);
+                    break;
+                case 'overload':
+                    this.showError(`Сервер перегружен, повторите через ${Math.ceil(data.retry_after)} с`);
+                    break;
                 default:
                     console.warn('Неизвестный тип сообщения:', data.type);
             }
@@ -81,16 +190,201 @@ class WebSocketChat {
     
     handleInit(data) {
         this.connectionId = data.connection_id;
+        this.applyLimits(data.limits);
         console.log(`Инициализация. Connection ID: ${this.connectionId}`);
         
         this.updateStatus('connected', 'Подключено');
         
+        (data.history || []).forEach(msg => this.trackMessageId(msg.id));
+        
+        if (this.room !== this.defaultRoom) {
+            // Подписки не переживают переподключение
+            this.subscribe(this.room);
+            this.flushOutbox();
+            return;
+        }
+        this.showRoomHistory(data.history || []);
+        // Сообщения, набранные во время переподключения
+        this.flushOutbox();
+    }
+    
+    handleSubscribed(data) {
+        if (data.room !== this.room) return;
+        console.log(`Подписка на комнату ${data.room}`);
+        if (data.room === this.defaultRoom) {
+            (data.history || []).forEach(msg => this.trackMessageId(msg.id));
+        }
+        this.showRoomHistory(data.history || []);
+    }
+    
+    showRoomHistory(history) {
         // Очищаем список сообщений перед загрузкой истории
         this.clearMessagesList();
         
         // Загружаем историю сообщений
-        if (data.history && data.history.length > 0) {
-            this.handleHistory(data.history);
+        this.oldestMessageId = null;
+        this.hasMoreHistory = false;
+        this.loadingHistory = false;
+        if (history.length > 0) {
+            this.oldestMessageId = history[0].id;
+            this.hasMoreHistory = true;
+            this.handleHistory(history);
+        } else {
+            this.messagesList.innerHTML = '<div class="empty-state">Сообщений пока нет</div>';
+        }
+    }
+    
+    switchRoom(room) {
+        if (!/^[A-Za-z0-9_.-]{1,64}$/.test(room)) {
+            this.showError('Название комнаты: латиница, цифры, _ . -');
+            return;
+        }
+        if (room === this.room) return;
+        
+        // Набранное уходит в комнату, где его набирали: комната хранится
+        // в каждой записи очереди
+        this.flushOutbox();
+        if (this.isConnected && this.connectionId && this.room !== this.defaultRoom) {
+            this.send({ type: 'unsubscribe', room: this.room });
+        }
+        this.room = room;
+        if (this.roomTitle) {
+            this.roomTitle.textContent = room;
+        }
+        if (this.searchResults) {
+            this.searchQuery = null;
+            this.searchResults.innerHTML = '';
+        }
+        this.clearMessagesList();
+        
+        if (this.isConnected && this.connectionId) {
+            this.subscribe(room);
+        }
+    }
+    
+    subscribe(room) {
+        this.send({ type: 'subscribe', room: room });
+    }
+    
+    send(payload) {
+        // Сервер мог не принять подпротокол, тогда остается JSON
+        if (this.ws.protocol === 'chat.msgpack') {
+            this.ws.send(MessagePack.encode(payload));
+        } else {
+            this.ws.send(JSON.stringify(payload));
+        }
+    }
+    
+    handleResume(data) {
+        this.connectionId = data.connection_id;
+        this.applyLimits(data.limits);
+        console.log(`Соединение возобновлено. Connection ID: ${this.connectionId}, пропущено: ${data.messages.length}`);
+        
+        this.updateStatus('connected', 'Подключено');
+        
+        if (this.room !== this.defaultRoom) {
+            data.messages.forEach(msg => this.trackMessageId(msg.id));
+            this.subscribe(this.room);
+            this.flushOutbox();
+            return;
+        }
+        
+        // Список не очищаем: досылаются только пропущенные сообщения
+        data.messages.forEach(msg => this.handleNewMessage(msg));
+        this.flushOutbox();
+    }
+    
+    requestOlderHistory() {
+        if (!this.isConnected || !this.connectionId || this.loadingHistory || !this.hasMoreHistory) {
+            return;
+        }
+        
+        this.loadingHistory = true;
+        this.send({
+            type: 'history',
+            before: this.oldestMessageId,
+            limit: this.historyPageSize,
+            room: this.room
+        });
+    }
+    
+    handleOlderHistory(data) {
+        // Ответ мог прийти уже после перехода в другую комнату
+        if (data.room !== this.room) return;
+        this.loadingHistory = false;
+        this.hasMoreHistory = data.next_before !== null;
+        
+        const messages = data.messages || [];
+        if (messages.length === 0) return;
+        console.log(`Подгружаем старую историю: ${messages.length} сообщений`);
+        
+        this.oldestMessageId = messages[0].id;
+        
+        // Вставляем над текущими сообщениями, сохраняя позицию прокрутки
+        const previousHeight = this.messagesList.scrollHeight;
+        const anchor = this.messagesList.querySelector('.message-item');
+        messages.forEach(msg => {
+            const element = this.createMessageElement({
+                text: msg.text,
+                connectionId: msg.connection_id,
+                messageNumber: msg.user_message_number,
+                isOwn: msg.connection_id === this.connectionId,
+                timestamp: msg.created_at || new Date().toISOString()
+            }, false);
+            this.messagesList.insertBefore(element, anchor);
+        });
+        this.messagesList.scrollTop += this.messagesList.scrollHeight - previousHeight;
+    }
+    
+    search(query, cursor = null) {
+        if (!query) return;
+        if (!this.isConnected || !this.connectionId) {
+            this.showError('Нет подключения к серверу');
+            return;
+        }
+        
+        this.searchQuery = query;
+        const request = { type: 'search', q: query, room: this.room, limit: this.searchPageSize };
+        if (cursor !== null) {
+            request.cursor = cursor;
+        } else if (this.searchResults) {
+            this.searchResults.innerHTML = '';
+        }
+        this.send(request);
+    }
+    
+    handleSearchResults(data) {
+        // Ответ на устаревший запрос или из другой комнаты
+        if (!this.searchResults || data.q !== this.searchQuery || data.room !== this.room) return;
+        
+        const moreButton = this.searchResults.querySelector('.search-more');
+        if (moreButton) {
+            moreButton.remove();
+        }
+        if (data.results.length === 0 && !this.searchResults.firstChild) {
+            this.searchResults.innerHTML = '<div class="empty-state">Ничего не найдено</div>';
+            return;
+        }
+        
+        data.results.forEach(result => {
+            const time = new Date(result.created_at);
+            const element = document.createElement('div');
+            element.className = 'search-result';
+            // snippet уже экранирован сервером, в нем только теги <mark>
+            element.innerHTML = `
+                <span class="message-time">${time.toLocaleString()}</span>
+                <div>${result.snippet}</div>
+            `;
+            this.searchResults.appendChild(element);
+        });
+        
+        this.searchCursor = data.next_cursor;
+        if (this.searchCursor !== null) {
+            const button = document.createElement('button');
+            button.className = 'search-more';
+            button.textContent = 'Еще';
+            button.addEventListener('click', () => this.search(this.searchQuery, this.searchCursor));
+            this.searchResults.appendChild(button);
         }
     }
     
@@ -113,6 +407,16 @@ class WebSocketChat {
     
     handleNewMessage(data) {
         console.log('Новое сообщение:', data);
+        if (data.connection_id === this.connectionId) {
+            // Свое сообщение разослано: последний пакет принят сервером
+            this.lastSent = null;
+        }
+        const room = data.room || this.defaultRoom;
+        // Досылка при переподключении работает по комнате по умолчанию
+        if (room === this.defaultRoom) {
+            this.trackMessageId(data.id);
+        }
+        if (room !== this.room) return;
         
         this.addMessageToDOM({
             text: data.text,
@@ -126,20 +430,61 @@ class WebSocketChat {
         this.updateMessageCount();
     }
     
+    trackMessageId(id) {
+        if (id !== undefined) {
+            this.lastMessageId = id;
+        }
+    }
+    
+    handleReconnectRequest(data) {
+        // Сокет закроет сервер; набранное уйдет после переподключения
+        console.log(`Сервер перезапускается, переподключение через ${data.after} с`);
+        this.serverReconnectDelay = data.after * 1000;
+        this.updateStatus('connecting', 'Сервер перезапускается...');
+    }
+    
     handleError(error) {
         console.error('WebSocket ошибка:', error);
         this.updateStatus('error', 'Ошибка подключения');
     }
     
+    resetWatchdog() {
+        if (this.watchdogTimer !== null) {
+            clearTimeout(this.watchdogTimer);
+            this.watchdogTimer = null;
+        }
+        if (!this.heartbeatInterval) return;
+        
+        // Сервер шлет ping не реже чем раз в heartbeatInterval, запас - еще один период
+        const timeout = this.heartbeatInterval * 2000 + 5000;
+        this.watchdogTimer = setTimeout(() => {
+            console.warn('Сервер не отвечает, переподключение');
+            this.ws.close();
+        }, timeout);
+    }
+    
     handleClose(event) {
         console.log('WebSocket отключен:', event.code, event.reason);
+        if (this.watchdogTimer !== null) {
+            clearTimeout(this.watchdogTimer);
+            this.watchdogTimer = null;
+        }
         this.isConnected = false;
         this.connectionId = null;
         this.updateStatus('disconnected', 'Отключено');
         
-        if (this.reconnectAttempts < this.maxReconnectAttempts) {
+        if (this.serverReconnectDelay !== null) {
+            // Плановый перезапуск: задержку выбрал сервер, попытка не считается
+            const delay = this.serverReconnectDelay;
+            this.serverReconnectDelay = null;
+            console.log(`Переподключение через ${delay}ms по запросу сервера`);
+            setTimeout(() => this.connectWebSocket(), delay);
+        } else if (this.reconnectAttempts < this.maxReconnectAttempts) {
             this.reconnectAttempts++;
-            const delay = this.reconnectDelay * this.reconnectAttempts;
+            // Экспоненциальная задержка со случайным разбросом (full jitter),
+            // чтобы клиенты, отключенные одновременно, не вернулись все разом
+            const cap = Math.min(this.maxReconnectDelay, this.reconnectDelay * 2 ** (this.reconnectAttempts - 1));
+            const delay = Math.round(Math.random() * cap);
             console.log(`Переподключение через ${delay}ms (попытка ${this.reconnectAttempts})`);
             
             setTimeout(() => {
@@ -175,13 +520,51 @@ class WebSocketChat {
     }
     
     sendMessage(text) {
-        const message = {
-            type: 'message',
-            text: text
-        };
+        // Сообщения, набранные в течение batchWindow, уходят одним кадром batch
+        this.outbox.push({ room: this.room, text: text });
+        if (this.outbox.length >= this.batchMaxMessages) {
+            this.flushOutbox();
+        } else if (this.outboxTimer === null) {
+            this.outboxTimer = setTimeout(() => this.flushOutbox(), this.batchWindow);
+        }
+    }
+    
+    flushOutbox() {
+        if (this.outboxTimer !== null) {
+            clearTimeout(this.outboxTimer);
+            this.outboxTimer = null;
+        }
+        if (this.outbox.length === 0 || !this.isConnected || !this.connectionId || this.serverReconnectDelay !== null) {
+            // Отправится после (пере)подключения
+            return;
+        }
+        
+        // Пакет - подряд идущие записи одной комнаты, не больше лимита
+        // сервера и не больше накопленных токенов
+        const room = this.outbox[0].room;
+        let count = 0;
+        while (count < this.outbox.length && count < this.batchMaxMessages && this.outbox[count].room === room) {
+            count++;
+        }
+        count = Math.min(count, this.availableTokens());
+        if (count === 0) {
+            // Ждем, пока корзина пополнится на одно сообщение
+            this.scheduleFlush((1 - this.tokens) / this.rateLimit * 1000);
+            return;
+        }
+        
+        const entries = this.outbox.splice(0, count);
+        this.spendTokens(count);
+        this.lastSent = entries;
+        if (this.outbox.length > 0) {
+            this.scheduleFlush(this.batchWindow);
+        }
+        const message = entries.length === 1
+            ? { type: 'message', text: entries[0].text, room: room }
+            : { type: 'batch', room: room, messages: entries.map(entry => ({ text: entry.text })) };
         
         try {
-            this.ws.send(JSON.stringify(message));
+            this.send(message);
             console.log('Отправлено сообщение:', message);
         } catch (error) {
             console.error('Ошибка отправки:', error);
@@ -189,6 +572,51 @@ class WebSocketChat {
         }
     }
     
+    scheduleFlush(delay) {
+        if (this.outboxTimer !== null) {
+            clearTimeout(this.outboxTimer);
+        }
+        this.outboxTimer = setTimeout(() => this.flushOutbox(), Math.max(delay, 0));
+    }
+    
+    applyLimits(limits) {
+        // Новое соединение - новая корзина на сервере
+        this.batchMaxMessages = Math.max(1, limits.batch_max_messages);
+        this.rateLimit = limits.rate;
+        this.rateBurst = limits.burst;
+        this.tokens = limits.burst;
+        this.tokensAt = performance.now();
+        this.lastSent = null;
+    }
+    
+    availableTokens() {
+        if (this.rateLimit <= 0) return Infinity;
+        const now = performance.now();
+        this.tokens = Math.min(this.rateBurst, this.tokens + (now - this.tokensAt) / 1000 * this.rateLimit);
+        this.tokensAt = now;
+        return Math.floor(this.tokens);
+    }
+    
+    spendTokens(count) {
+        if (this.rateLimit > 0) {
+            this.tokens -= count;
+        }
+    }
+    
+    handleThrottle(data) {
+        if ((data.request === 'message' || data.request === 'batch') && this.lastSent !== null) {
+            // Отклоненный пакет уходит повторно, когда сервер разрешит
+            this.outbox.unshift(...this.lastSent);
+            this.lastSent = null;
+            this.tokens = 0;
+            this.tokensAt = performance.now();
+            this.scheduleFlush(data.retry_after * 1000);
+            console.warn(`Сообщения отклонены лимитом, повтор через ${data.retry_after} с`);
+            return;
+        }
+        this.showError(`Слишком много запросов, повторите через ${Math.ceil(data.retry_after)} с`);
+    }
+    
     addMessageToDOM(messageData, animate = true) {
         // Убираем состояние "пусто" если есть
         const emptyState = this.messagesList.querySelector('.empty-state');
@@ -196,6 +624,14 @@ class WebSocketChat {
             emptyState.remove();
         }
         
+        const messageElement = this.createMessageElement(messageData, animate);
+        this.messagesList.appendChild(messageElement);
+        
+        // Прокручиваем к новому сообщению
+        messageElement.scrollIntoView({ behavior: 'smooth' });
+    }
+    
+    createMessageElement(messageData, animate = true) {
         const messageElement = document.createElement('div');
         messageElement.className = 'message-item';
         
@@ -226,10 +662,7 @@ class WebSocketChat {
             <div class="message-text">${this.escapeHtml(messageData.text)}</div>
         `;
         
-        this.messagesList.appendChild(messageElement);
-        
-        // Прокручиваем к новому сообщению
-        messageElement.scrollIntoView({ behavior: 'smooth' });
+        return messageElement;
     }
     
     getUserLabel(connectionId) {
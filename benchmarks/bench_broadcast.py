@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рассылки: p99 задержки доставки на 1k/10k имитированных сокетов
+с несколькими намеренно медленными читателями.
+
+Сравнивает новую рассылку через очереди клиентов с последовательным
+циклом send_text (как было раньше).
+
+Запуск:
+    python -m benchmarks.bench_broadcast --sockets 1000 10000 --slow 5
+"""
+import argparse
+import asyncio
+import time
+
+from app.connection_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Имитация WebSocket: запоминает время доставки каждого кадра."""
+
+    scope = {}
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.latencies = []
+        self.sent_at = 0.0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            # Настоящий сокет всегда уступает цикл событий на записи
+            await asyncio.sleep(0)
+        self.latencies.append(time.perf_counter() - self.sent_at)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+async def run_queued(sockets: int, slow: int, rounds: int, slow_delay: float, policy: str):
+    manager = ConnectionManager(slow_client_policy=policy)
+    fast = [FakeWebSocket() for _ in range(sockets - slow)]
+    lagging = [FakeWebSocket(slow_delay) for _ in range(slow)]
+    for ws in lagging + fast:
+        await manager.connect(ws)
+
+    for i in range(rounds):
+        now = time.perf_counter()
+        for ws in fast + lagging:
+            ws.sent_at = now
+        await manager.broadcast({"type": "message", "text": f"round {i}"})
+        # Ждем, пока быстрые клиенты получат кадр
+        while any(len(ws.latencies) <= i for ws in fast):
+            await asyncio.sleep(0.001)
+
+    stats = manager.get_stats()
+    for connection_id in list(manager.active_connections):
+        manager._remove(connection_id)
+    return [lat for ws in fast for lat in ws.latencies], stats
+
+
+async def run_serial(sockets: int, slow: int, rounds: int, slow_delay: float):
+    fast = [FakeWebSocket() for _ in range(sockets - slow)]
+    lagging = [FakeWebSocket(slow_delay) for _ in range(slow)]
+    # Медленные клиенты в начале списка - худший случай для цикла
+    everyone = lagging + fast
+
+    for i in range(rounds):
+        now = time.perf_counter()
+        for ws in everyone:
+            ws.sent_at = now
+        for ws in everyone:
+            await ws.send_text(f"round {i}")
+    return [lat for ws in fast for lat in ws.latencies]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--slow", type=int, default=5, help="количество медленных читателей")
+    parser.add_argument("--slow-delay", type=float, default=0.05, help="задержка медленного send_text, сек")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--policy", default="drop", choices=["drop", "disconnect"])
+    args = parser.parse_args()
+
+    print(f"{'sockets':>8} {'mode':>8} {'p50 ms':>9} {'p99 ms':>9} {'dropped':>8} {'max depth':>10}")
+    for sockets in args.sockets:
+        serial = await run_serial(sockets, args.slow, args.rounds, args.slow_delay)
+        print(f"{sockets:>8} {'serial':>8} {percentile(serial, 50) * 1000:>9.2f} "
+              f"{percentile(serial, 99) * 1000:>9.2f} {'-':>8} {'-':>10}")
+
+        queued, stats = await run_queued(sockets, args.slow, args.rounds, args.slow_delay, args.policy)
+        print(f"{sockets:>8} {'queued':>8} {percentile(queued, 50) * 1000:>9.2f} "
+              f"{percentile(queued, 99) * 1000:>9.2f} {stats['dropped_messages']:>8} "
+              f"{stats['max_queue_depth']:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Скорость подключения: сколько клиентов в секунду сервер принимает и
+отдает им init, и время до init (handshake + кадр с историей) p50/p99.
+
+Моделирует волну подключений после деплоя: --connections клиентов
+подключаются не более чем по --concurrency одновременно и остаются
+подключенными до конца прогона (--close - отключаются сразу после
+init). С --resume клиенты передают ?last_id= с последним id из истории
+и получают кадр resume, как веб-клиент после переподключения.
+
+По /metrics выводится, сколько запросов истории к БД понадобилось:
+при теплом горячем буфере подключение обходится без БД.
+
+Сервер можно запустить самим скриптом (--spawn) или указать уже
+работающий (--url). Серверу нужна PostgreSQL из DATABASE_URL.
+
+Запуск:
+    python -m benchmarks.bench_connect --spawn --connections 20000 --concurrency 500
+    python -m benchmarks.bench_connect --spawn --connections 20000 --resume
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.request
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from websockets.asyncio.client import connect
+
+from benchmarks.check_drain import db_queries
+from benchmarks.loadtest import percentile, raise_fd_limit, spawn_server
+
+
+class Stats:
+    def __init__(self):
+        self.init: List[float] = []
+        self.kinds = {}
+        self.errors = 0
+
+
+async def last_message_id(url: str) -> Optional[int]:
+    async with connect(url) as ws:
+        frame = json.loads(await ws.recv())
+    return frame["history"][-1]["id"] if frame.get("history") else None
+
+
+async def open_client(url: str, stats: Stats, semaphore: asyncio.Semaphore, close: bool, sockets: list):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            ws = await connect(url, open_timeout=30, max_queue=None)
+            frame = json.loads(await ws.recv())
+        except Exception:
+            stats.errors += 1
+            return
+        stats.init.append(time.perf_counter() - started)
+        stats.kinds[frame["type"]] = stats.kinds.get(frame["type"], 0) + 1
+        if close:
+            await ws.close()
+        else:
+            sockets.append(ws)
+
+
+async def run(args) -> dict:
+    url = args.url
+    if args.resume:
+        last_id = await last_message_id(url)
+        if last_id is not None:
+            url = f"{url}?last_id={last_id}"
+
+    metrics_port = urlparse(args.url).port
+    queries_before = db_queries(metrics_port)
+
+    stats = Stats()
+    sockets: list = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        open_client(url, stats, semaphore, args.close, sockets)
+        for _ in range(args.connections)
+    ))
+    elapsed = time.perf_counter() - started
+
+    queries_after = db_queries(metrics_port)
+    await asyncio.gather(*(ws.close() for ws in sockets), return_exceptions=True)
+
+    return {
+        "connections": len(stats.init),
+        "errors": stats.errors,
+        "frames": stats.kinds,
+        "connects_per_sec": round(len(stats.init) / elapsed, 1),
+        "init_p50_ms": round(percentile(stats.init, 50) * 1000, 2),
+        "init_p99_ms": round(percentile(stats.init, 99) * 1000, 2),
+        "db_queries": int(queries_after[0] - queries_before[0]),
+        "history_queries": int(queries_after[1] - queries_before[1]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="адрес WebSocket (по умолчанию ws://127.0.0.1:<port>/ws)")
+    parser.add_argument("--port", type=int, default=6094)
+    parser.add_argument("--spawn", action="store_true", help="запустить сервер uvicorn самостоятельно")
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=500, help="одновременных подключений")
+    parser.add_argument("--resume", action="store_true", help="подключаться с ?last_id=")
+    parser.add_argument("--close", action="store_true", help="отключаться сразу после init")
+    args = parser.parse_args()
+
+    args.url = args.url or f"ws://127.0.0.1:{args.port}/ws"
+    raise_fd_limit(args.connections)
+
+    proc = spawn_server(args.port) if args.spawn else None
+    try:
+        # Прогрев: первый запрос /health поднимает пул соединений с БД
+        urllib.request.urlopen(args.url.replace("ws://", "http://").replace("/ws", "/health"), timeout=10).close()
+        result = asyncio.run(run(args))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Массовое отключение: время удаления 50k соединений из реестра.
+
+Для сравнения приводится линейный поиск по реестру (как было раньше)
+на меньшем числе соединений - он квадратичен при массовом отключении.
+
+Запуск:
+    python -m benchmarks.bench_disconnect --connections 50000
+"""
+import argparse
+import asyncio
+import time
+
+from app.connection_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    scope = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+async def connect_all(count: int):
+    manager = ConnectionManager()
+    sockets = [FakeWebSocket() for _ in range(count)]
+    for ws in sockets:
+        await manager.connect(ws)
+    return manager, sockets
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--linear", type=int, default=5000, help="соединений для линейного поиска")
+    args = parser.parse_args()
+
+    manager, sockets = await connect_all(args.connections)
+    started = time.perf_counter()
+    for ws in sockets:
+        manager.disconnect(ws)
+    elapsed = time.perf_counter() - started
+    assert manager.get_connection_count() == 0
+    print(f"индекс:  {args.connections:>6} отключений за {elapsed * 1000:9.1f} мс "
+          f"({elapsed / args.connections * 1e6:.2f} мкс на соединение)")
+
+    manager, sockets = await connect_all(args.linear)
+    started = time.perf_counter()
+    # В обратном порядке искомое соединение всегда в конце реестра
+    for ws in reversed(sockets):
+        for cid, connection in manager.active_connections.items():
+            if connection.websocket is ws:
+                break
+        manager._remove(cid)
+    elapsed = time.perf_counter() - started
+    print(f"перебор: {args.linear:>6} отключений за {elapsed * 1000:9.1f} мс "
+          f"({elapsed / args.linear * 1e6:.2f} мкс на соединение)")
+
+    # Даем отмененным писателям завершиться
+    await asyncio.sleep(0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Стоимость проверки heartbeat на 50k соединений.
+
+Сравнивает кучу сроков из ConnectionManager с перебором всех соединений
+на каждом тике (как пришлось бы делать без нее). На каждом тике
+проверяется лишь небольшая доля соединений, которым пора.
+
+Запуск:
+    python -m benchmarks.bench_heartbeat --connections 50000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app.connection_manager import ConnectionManager
+
+
+class FakeWebSocket:
+    scope = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--interval", type=float, default=25.0)
+    parser.add_argument("--tick", type=float, default=0.1, help="шаг виртуального времени, с")
+    parser.add_argument("--ticks", type=int, default=500)
+    args = parser.parse_args()
+
+    manager = ConnectionManager(
+        queue_size=args.ticks, heartbeat_interval=args.interval, heartbeat_timeout=10
+    )
+    # Проверка вызывается вручную по виртуальному времени
+    manager._reaper = asyncio.current_task()
+    connection_ids = [await manager.connect(FakeWebSocket()) for _ in range(args.connections)]
+
+    # Клиенты подключились в разное время и отвечают на ping
+    start = time.monotonic()
+    rng = random.Random(1)
+    for connection_id in connection_ids:
+        connection = manager.active_connections[connection_id]
+        connection.last_seen = connection.last_active = start - rng.uniform(0, args.interval)
+    manager._deadlines.clear()
+    for connection in manager.active_connections.values():
+        manager._schedule(connection, manager._next_check(connection, start))
+
+    heap_seconds = 0.0
+    scan_seconds = 0.0
+    for i in range(1, args.ticks + 1):
+        now = start + i * args.tick
+        for connection in manager.active_connections.values():
+            if connection.ping_sent is not None:
+                connection.last_seen = now
+
+        started = time.perf_counter()
+        manager.check_heartbeats(now)
+        heap_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        for connection in list(manager.active_connections.values()):
+            if connection.ping_sent is not None and now >= connection.ping_sent + manager.heartbeat_timeout:
+                pass
+            elif now >= connection.last_seen + manager.heartbeat_interval:
+                pass
+        scan_seconds += time.perf_counter() - started
+
+    print(f"{args.connections} соединений, {args.ticks} тиков по {args.tick} с")
+    print(f"куча:    {heap_seconds / args.ticks * 1e3:8.3f} мс на тик")
+    print(f"перебор: {scan_seconds / args.ticks * 1e3:8.3f} мс на тик (только проверка, без отправки ping)")
+    print(f"ping отправлено: {sum(c.queue.qsize() for c in manager.active_connections.values())}, "
+          f"отключено: {manager.heartbeat_timeouts}")
+
+    manager._reaper = None
+    for connection_id in list(manager.active_connections):
+        manager._remove(connection_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
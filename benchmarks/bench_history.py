@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Латентность страницы истории на глубине прокрутки: keyset по id
+против OFFSET на таблице с миллионами строк.
+
+При необходимости дозаполняет таблицу messages синтетическими строками.
+Нужна PostgreSQL из DATABASE_URL (например, из docker compose).
+
+Запуск:
+    python -m benchmarks.bench_history --rows 3000000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import func, select, text
+
+from app.connection_manager import ConnectionManager
+from app.database import AsyncSessionLocal, engine, init_db
+from app.models import Message
+
+
+async def seed(rows: int) -> int:
+    async with AsyncSessionLocal() as db:
+        count = (await db.execute(select(func.count()).select_from(Message))).scalar()
+        if count < rows:
+            print(f"Заполнение таблицы: {count} -> {rows} строк...")
+            await db.execute(
+                text(
+                    "INSERT INTO messages (text, connection_id, user_message_number, created_at) "
+                    "SELECT 'bench message ' || g, gen_random_uuid(), g, "
+                    "now() - make_interval(secs => :rows - g) "
+                    "FROM generate_series(1, :rows) AS g"
+                ),
+                {"rows": rows - count},
+            )
+            await db.commit()
+            await db.execute(text("ANALYZE messages"))
+        return max(count, rows)
+
+
+async def timed(coro_factory, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coro_factory()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if not await init_db():
+        raise SystemExit("База данных недоступна")
+    total = await seed(args.rows)
+    manager = ConnectionManager()
+
+    async with AsyncSessionLocal() as db:
+        max_id = (await db.execute(select(func.max(Message.id)))).scalar()
+
+        print(f"{'глубина':>10} {'keyset мс':>10} {'OFFSET мс':>10}")
+        for depth in (0, 10_000, 100_000, 1_000_000, total - args.limit):
+            if depth >= total:
+                continue
+            before = max_id - depth + 1
+
+            keyset = await timed(
+                lambda: manager.get_message_history(db, limit=args.limit, before=before), args.repeat
+            )
+            offset = await timed(
+                lambda: db.execute(
+                    select(Message).order_by(Message.id.desc()).offset(depth).limit(args.limit)
+                ),
+                max(1, args.repeat // 4),
+            )
+            print(f"{depth:>10} {keyset:>10.2f} {offset:>10.2f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Перегрузка медленной БД: прием без ограничений против стадии ingest.
+
+БД моделируется пулом из --pool соединений, каждый запрос держит
+соединение --db-ms мс, то есть БД выполняет не больше pool / db-ms
+запросов в секунду. Клиенты (--clients соединений) присылают запросы с
+суммарной частотой --rate, обычно выше этой пропускной способности:
+
+    inline - как раньше: цикл приема каждого сокета сам ждет пула,
+             очередь ожидания ничем не ограничена
+    ingest - IngestPool из app.ingest: воркеров столько же, сколько
+             соединений пула, лимит запросов в работе и срок ожидания
+
+Для каждого режима выводятся задержки выполненных запросов (от приема
+до ответа), сколько запросов отклонено кадром overload, сколько не
+выполнено к концу прогона и максимум ожидающих запросов. PostgreSQL
+не нужна.
+
+Запуск:
+    python -m benchmarks.bench_ingest --rate 2000 --db-ms 20 --pool 16
+    python -m benchmarks.bench_ingest --rate 600 --duration 10
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import List
+from uuid import UUID, uuid4
+
+from app.ingest import IngestPool
+
+
+class Run:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.rejected = 0
+        self.waiting = 0
+        self.max_waiting = 0
+
+    def started(self) -> None:
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+
+async def db_query(pool: asyncio.Semaphore, db_seconds: float) -> None:
+    async with pool:
+        await asyncio.sleep(db_seconds)
+
+
+async def offer_load(args, submit) -> int:
+    """Открытая нагрузка: запросы приходят с частотой --rate независимо от ответов."""
+    connections = [uuid4() for _ in range(args.clients)]
+    interval = 1.0 / args.rate
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < args.duration:
+        due = int((time.perf_counter() - started) / interval)
+        while sent < due:
+            submit(random.choice(connections), time.perf_counter())
+            sent += 1
+        await asyncio.sleep(0.001)
+    return sent
+
+
+async def run_inline(args) -> dict:
+    pool = asyncio.Semaphore(args.pool)
+    run = Run()
+    queues = {}
+    loops = []
+
+    async def receive_loop(queue: asyncio.Queue) -> None:
+        while True:
+            received_at = await queue.get()
+            await db_query(pool, args.db_ms / 1000)
+            run.waiting -= 1
+            run.latencies.append(time.perf_counter() - received_at)
+
+    def submit(connection_id: UUID, received_at: float) -> None:
+        queue = queues.get(connection_id)
+        if queue is None:
+            queue = queues[connection_id] = asyncio.Queue()
+            loops.append(asyncio.create_task(receive_loop(queue)))
+        run.started()
+        queue.put_nowait(received_at)
+
+    sent = await offer_load(args, submit)
+    await asyncio.sleep(args.grace)
+    for task in loops:
+        task.cancel()
+    await asyncio.gather(*loops, return_exceptions=True)
+    return summarize("inline", run, sent)
+
+
+async def run_ingest(args) -> dict:
+    pool = asyncio.Semaphore(args.pool)
+    run = Run()
+
+    def on_overload(connection_id: UUID, reason: str, retry_after: float) -> None:
+        if reason == "deadline":
+            run.waiting -= 1  # Был принят и ждал в очереди
+        run.rejected += 1
+
+    ingest = IngestPool(
+        on_overload,
+        workers=args.pool,
+        max_in_flight=args.max_in_flight,
+        queue_deadline_ms=args.deadline_ms,
+    )
+    await ingest.start()
+
+    async def job(received_at: float) -> None:
+        await db_query(pool, args.db_ms / 1000)
+        run.waiting -= 1
+        run.latencies.append(time.perf_counter() - received_at)
+
+    def submit(connection_id: UUID, received_at: float) -> None:
+        if ingest.submit(connection_id, lambda: job(received_at)):
+            run.started()
+
+    sent = await offer_load(args, submit)
+    await ingest.stop(timeout=args.grace)
+    return summarize("ingest", run, sent)
+
+
+def summarize(mode: str, run: Run, sent: int) -> dict:
+    run.latencies.sort()
+    return {
+        "mode": mode,
+        "sent": sent,
+        "done": len(run.latencies),
+        "rejected": run.rejected,
+        "unfinished": sent - len(run.latencies) - run.rejected,
+        "p50_ms": round(percentile(run.latencies, 0.5), 1),
+        "p99_ms": round(percentile(run.latencies, 0.99), 1),
+        "max_ms": round(percentile(run.latencies, 1.0), 1),
+        "max_waiting": run.max_waiting,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=2000, help="запросов/с от всех клиентов")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=5.0, help="длительность нагрузки, с")
+    parser.add_argument("--grace", type=float, default=2.0, help="ожидание ответов после нагрузки, с")
+    parser.add_argument("--db-ms", type=float, default=20.0, help="время запроса к БД, мс")
+    parser.add_argument("--pool", type=int, default=16, help="соединений в пуле БД и воркеров ingest")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--deadline-ms", type=int, default=2000)
+    args = parser.parse_args()
+
+    capacity = args.pool / (args.db_ms / 1000)
+    print(f"Пропускная способность БД: {capacity:.0f} запросов/с, нагрузка: {args.rate:.0f} запросов/с")
+
+    results = [asyncio.run(run_inline(args)), asyncio.run(run_ingest(args))]
+    print(f"{'режим':>7} {'пришло':>8} {'выполнено':>10} {'отказ':>7} {'не выполн.':>11} "
+          f"{'p50 мс':>8} {'p99 мс':>8} {'max мс':>8} {'ждали max':>10}")
+    for r in results:
+        print(f"{r['mode']:>7} {r['sent']:>8} {r['done']:>10} {r['rejected']:>7} {r['unfinished']:>11} "
+              f"{r['p50_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8} {r['max_waiting']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Пропускная способность сохранения сообщений: нумерация через
+SELECT max() на каждое сообщение против счетчика в памяти.
+
+Нужна PostgreSQL из DATABASE_URL (например, из docker compose).
+
+Запуск:
+    python -m benchmarks.bench_numbering --messages 5000 --senders 20
+"""
+import argparse
+import asyncio
+import time
+
+from app.connection_manager import ConnectionManager
+from app.database import AsyncSessionLocal, init_db, engine
+from app.models import generate_connection_id
+
+
+class FakeWebSocket:
+    scope = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+async def sender(manager: ConnectionManager, connection_id, count: int, use_db: bool):
+    async with AsyncSessionLocal() as db:
+        for i in range(count):
+            if use_db:
+                number = await manager._get_next_message_number_from_db(db, connection_id)
+            else:
+                number = await manager.get_next_message_number(db, connection_id)
+            await manager.save_message(db, f"bench message {i}", connection_id, number)
+
+
+async def run(messages: int, senders: int, use_db: bool) -> float:
+    manager = ConnectionManager()
+    connection_ids = [await manager.connect(FakeWebSocket()) for _ in range(senders)]
+    if use_db:
+        # Старый путь не зависит от реестра соединений
+        connection_ids = [generate_connection_id() for _ in range(senders)]
+
+    per_sender = messages // senders
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(manager, cid, per_sender, use_db) for cid in connection_ids))
+    elapsed = time.perf_counter() - started
+    return per_sender * senders / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--senders", type=int, default=20, help="параллельных соединений (<= pool_size)")
+    args = parser.parse_args()
+
+    if not await init_db():
+        raise SystemExit("База данных недоступна")
+
+    before = await run(args.messages, args.senders, use_db=True)
+    after = await run(args.messages, args.senders, use_db=False)
+    print(f"SELECT max() + INSERT: {before:10.1f} msg/s")
+    print(f"счетчик в памяти:     {after:10.1f} msg/s  (x{after / before:.2f})")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Устойчивая скорость записи сообщений: commit на каждое сообщение
+против пакетной write-behind записи.
+
+Нужна PostgreSQL из DATABASE_URL (например, из docker compose).
+
+Запуск:
+    python -m benchmarks.bench_persistence --messages 20000 --senders 20
+"""
+import argparse
+import asyncio
+import time
+
+from app.connection_manager import ConnectionManager
+from app.database import AsyncSessionLocal, init_db, engine
+from app.models import generate_connection_id
+from app.persistence import MessageWriter
+
+
+async def sender(manager: ConnectionManager, count: int):
+    connection_id = generate_connection_id()
+    async with AsyncSessionLocal() as db:
+        for i in range(1, count + 1):
+            await manager.save_message(db, f"bench message {i}", connection_id, i)
+
+
+async def run(messages: int, senders: int, writer: MessageWriter = None) -> float:
+    manager = ConnectionManager(message_writer=writer)
+    if writer is not None:
+        await writer.start()
+
+    per_sender = messages // senders
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(manager, per_sender) for _ in range(senders)))
+    if writer is not None:
+        # Учитываем время, пока все сообщения реально не окажутся в БД
+        await writer.stop()
+    elapsed = time.perf_counter() - started
+    return per_sender * senders / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--senders", type=int, default=20, help="параллельных отправителей (<= pool_size)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-ms", type=int, default=50)
+    args = parser.parse_args()
+
+    if not await init_db():
+        raise SystemExit("База данных недоступна")
+
+    sync = await run(args.messages, args.senders)
+    writer = MessageWriter(AsyncSessionLocal, batch_size=args.batch_size, flush_interval_ms=args.flush_ms)
+    batched = await run(args.messages, args.senders, writer)
+
+    print(f"commit на сообщение: {sync:10.1f} msg/s")
+    print(f"write-behind:        {batched:10.1f} msg/s  (x{batched / sync:.2f}), "
+          f"пакетов: {writer.flushed_batches}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Рассылка по комнатам: стоимость одного сообщения при 10k сокетов в 1k комнат.
+
+Сравниваются три варианта:
+    index  - индекс комната -> подписчики (как в ConnectionManager)
+    scan   - перебор всех соединений с проверкой подписки
+    global - рассылка всем соединениям, как было до появления комнат
+
+Измеряется только постановка кадров в очереди (fan-out), отправку
+в сокеты выполняют писатели соединений.
+
+Запуск:
+    python -m benchmarks.bench_rooms --sockets 10000 --rooms 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from app.connection_manager import ConnectionManager
+from app.models import Message
+
+
+class FakeWebSocket:
+    scope = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data: str):
+        pass
+
+
+def make_message(i: int, room: str) -> Message:
+    return Message(
+        id=i,
+        text=f"Сообщение {i}",
+        room=room,
+        connection_id=uuid.uuid4(),
+        user_message_number=i,
+        created_at=datetime.now(timezone.utc),
+    )
+
+
+async def drain(manager: ConnectionManager) -> None:
+    while any(not c.queue.empty() for c in manager.active_connections.values()):
+        await asyncio.sleep(0.001)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=10000)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rooms = [f"room-{i}" for i in range(args.rooms)]
+    manager = ConnectionManager(queue_size=args.messages + 1)
+
+    # Буферы истории заранее пустые, чтобы подписка не ходила в БД
+    for room in rooms:
+        manager.history[room] = deque(maxlen=manager.history_limit)
+
+    for _ in range(args.sockets):
+        connection_id = await manager.connect(FakeWebSocket())
+        await manager.subscribe(None, connection_id, rng.choice(rooms))
+
+    sizes = [len(manager.rooms.get(room, ())) for room in rooms]
+    print(f"{args.sockets} сокетов, {args.rooms} комнат, "
+          f"подписчиков в комнате: среднее {sum(sizes) / len(sizes):.1f}, максимум {max(sizes)}")
+
+    messages = [make_message(i, rng.choice(rooms)) for i in range(args.messages)]
+
+    started = time.perf_counter()
+    for message in messages:
+        await manager.broadcast_message(message)
+    index_elapsed = time.perf_counter() - started
+    await drain(manager)
+
+    started = time.perf_counter()
+    for message in messages:
+        frame = f'{{"room":"{message.room}"}}'
+        for connection in list(manager.active_connections.values()):
+            if message.room in connection.rooms:
+                manager._enqueue(connection, frame)
+    scan_elapsed = time.perf_counter() - started
+    await drain(manager)
+
+    started = time.perf_counter()
+    for message in messages:
+        await manager.broadcast({"type": "message", "id": message.id})
+    global_elapsed = time.perf_counter() - started
+    await drain(manager)
+
+    print(f"{'mode':>8} {'мкс/сообщение':>15} {'сообщений/с':>12}")
+    for mode, elapsed in (("index", index_elapsed), ("scan", scan_elapsed), ("global", global_elapsed)):
+        print(f"{mode:>8} {elapsed / args.messages * 1e6:>15.1f} {args.messages / elapsed:>12.0f}")
+
+    for connection_id in list(manager.active_connections):
+        manager._remove(connection_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Масштабирование по ядрам: сообщений в секунду и задержка рассылки при
+1..N воркерах prod-режима start_server.py (SO_REUSEPORT, BACKPLANE=postgres).
+
+Для каждого числа воркеров сервер запускается заново, и на него подается
+одна и та же нагрузка benchmarks.loadtest: --clients клиентов в общей
+комнате, --senders из них отправляют по --rate сообщений/с. Лимиты
+частоты и heartbeat выключены, чтобы упираться в CPU, а не в них.
+
+Пропускная способность считается по доставкам: каждое принятое
+сообщение получают все клиенты, поэтому сообщений/с = доставок/с /
+клиентов. Чтобы увидеть предел, суммарная нагрузка (senders * rate)
+должна превышать возможности одного воркера. Также выводится, как
+SO_REUSEPORT распределил соединения по воркерам (по /ws-info).
+
+Нужна PostgreSQL из DATABASE_URL. Нагрузку генерирует этот же процесс
+на одном ядре: воркеров имеет смысл запускать не больше, чем ядер
+остается серверу, иначе пределом станет сам генератор.
+
+Запуск:
+    python -m benchmarks.bench_scaling --workers 1 2 4 8 --clients 2000 --senders 200 --rate 20
+    python -m benchmarks.bench_scaling --persistence write_behind
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import List
+
+from benchmarks.loadtest import raise_fd_limit, run as run_load
+
+
+def default_workers() -> List[int]:
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+def ws_info(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/ws-info", timeout=5) as response:
+        return json.loads(response.read())
+
+
+def spawn(port: int, workers: int, persistence: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        SERVER_MODE="prod",
+        WORKERS=str(workers),
+        BACKPLANE="postgres",
+        PERSISTENCE_MODE=persistence,
+        # Возобновление при write-behind на нескольких воркерах
+        WRITE_BEHIND_ID_BLOCK="1",
+        DRAIN_ON_SHUTDOWN="false",
+        RATE_LIMIT_PER_CONNECTION="0",
+        RATE_LIMIT_GLOBAL="0",
+        HEARTBEAT_INTERVAL="0",
+        SHARD_STATS_INTERVAL="1",
+    )
+    log = open(os.path.join(tempfile.gettempdir(), f"bench_scaling_{workers}.log"), "w")
+    proc = subprocess.Popen([sys.executable, "start_server.py"], env=env, stdout=log, stderr=log)
+
+    # Ждем, пока все воркеры поднимутся и опубликуют статистику
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            if ws_info(port)["cluster"]["workers"] >= workers:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit(f"{workers} воркеров не запустились за 60 с, см. {log.name}")
+
+
+def stop(proc: subprocess.Popen) -> None:
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def measure(args, workers: int) -> dict:
+    proc = spawn(args.port, workers, args.persistence)
+    try:
+        load_args = argparse.Namespace(
+            url=f"ws://127.0.0.1:{args.port}/ws",
+            clients=args.clients,
+            senders=args.senders,
+            rate=args.rate,
+            duration=args.duration,
+            warmup=args.warmup,
+            connect_concurrency=args.connect_concurrency,
+        )
+        # Распределение соединений снимается посреди замера, пока клиенты подключены
+        snapshot = {}
+        timer = threading.Timer(
+            args.warmup + args.duration / 2,
+            lambda: snapshot.update(ws_info(args.port)["cluster"]),
+        )
+        timer.start()
+        result = asyncio.run(run_load(load_args, None))
+        timer.cancel()
+    finally:
+        stop(proc)
+
+    clients = max(result["clients"], 1)
+    return {
+        "workers": workers,
+        "offered_per_sec": result["messages_per_sec"],
+        "messages_per_sec": round(result["deliveries_per_sec"] / clients, 1),
+        "deliveries_per_sec": result["deliveries_per_sec"],
+        "latency_p50_ms": result["latency_p50_ms"],
+        "latency_p99_ms": result["latency_p99_ms"],
+        "connections_per_worker": [shard["active_connections"] for shard in snapshot.get("shards", [])],
+        "errors": result["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6098)
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers())
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20.0, help="сообщений/с на отправителя")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--persistence", choices=("sync", "write_behind"), default="sync")
+    args = parser.parse_args()
+
+    raise_fd_limit(args.clients)
+    results = []
+    for workers in args.workers:
+        result = measure(args, workers)
+        print(json.dumps(result))
+        results.append(result)
+
+    base = results[0]["messages_per_sec"] or 1
+    print(f"{'воркеров':>9} {'сообщ./с':>9} {'ускорение':>10} {'p50 мс':>8} {'p99 мс':>8}  соединений по воркерам")
+    for r in results:
+        print(f"{r['workers']:>9} {r['messages_per_sec']:>9} {r['messages_per_sec'] / base:>10.2f} "
+              f"{r['latency_p50_ms']:>8} {r['latency_p99_ms']:>8}  {r['connections_per_worker']}")
+
+
+if __name__ == "__main__":
+    main()
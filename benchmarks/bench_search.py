@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Латентность полнотекстового поиска (GIN по search_vector) на таблице
+с миллионами сообщений: редкие, частые и составные запросы, вторая
+страница по курсору и для сравнения ILIKE без индекса.
+
+При необходимости дозаполняет таблицу messages синтетическими
+сообщениями из слов w0..w49999 с частотой по степенному закону: w0
+встречается в большинстве сообщений, старшие слова - в единицах.
+Нужна PostgreSQL из DATABASE_URL с примененной миграцией 0004.
+
+Запуск:
+    python -m benchmarks.bench_search --rows 3000000
+    python -m benchmarks.bench_search --rows 3000000 --explain
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.connection_manager import ConnectionManager
+from app.database import AsyncSessionLocal, engine, init_db
+
+VOCABULARY = 50_000
+ROOMS = 100
+CHUNK = 500_000
+
+QUERIES = (
+    ("редкое слово", "w49000", None),
+    ("среднее слово", "w3000", None),
+    ("частое слово", "w0", None),
+    ("два слова", "w10 w200", None),
+    ("фраза", '"w1 w2"', None),
+    ("or", "w40000 or w45000", None),
+    ("исключение", "w5 -w0", None),
+    ("частое в комнате", "w0", "search-7"),
+)
+
+
+async def seed(rows: int) -> int:
+    async with AsyncSessionLocal() as db:
+        count = (await db.execute(text("SELECT count(*) FROM messages WHERE room LIKE 'search-%'"))).scalar()
+        while count < rows:
+            chunk = min(CHUNK, rows - count)
+            print(f"Заполнение таблицы: {count} -> {count + chunk} сообщений для поиска...")
+            # Подзапрос зависит от g, поэтому выполняется для каждой строки
+            await db.execute(
+                text(
+                    "INSERT INTO messages (text, room, connection_id, user_message_number, created_at) "
+                    "SELECT (SELECT string_agg('w' || floor(pow(random(), 4) * :vocabulary)::int, ' ') "
+                    "        FROM generate_series(1, 6 + g % 10)), "
+                    "'search-' || g % :rooms, gen_random_uuid(), g, "
+                    "now() - make_interval(secs => :rows - g) "
+                    "FROM generate_series(:first, :last) AS g"
+                ),
+                {
+                    "vocabulary": VOCABULARY,
+                    "rooms": ROOMS,
+                    "rows": rows,
+                    "first": count + 1,
+                    "last": count + chunk,
+                },
+            )
+            await db.commit()
+            count += chunk
+        await db.execute(text("ANALYZE messages"))
+        return count
+
+
+async def timed(coro_factory, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await coro_factory()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return statistics.median(samples) * 1000, p95 * 1000, result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--explain", action="store_true", help="показать план запроса для частого слова")
+    args = parser.parse_args()
+
+    if not await init_db():
+        raise SystemExit("База данных недоступна")
+    total = await seed(args.rows)
+    manager = ConnectionManager()
+    print(f"Сообщений для поиска: {total}, кандидатов на запрос: {manager.search_max_candidates}")
+
+    async with AsyncSessionLocal() as db:
+        print(f"{'запрос':>18} {'найдено':>8} {'p50 мс':>8} {'p95 мс':>8}")
+        for title, q, room in QUERIES:
+            p50, p95, rows = await timed(
+                lambda: manager.search_messages(db, q, room=room, limit=args.limit), args.repeat
+            )
+            print(f"{title:>18} {len(rows):>8} {p50:>8.2f} {p95:>8.2f}")
+
+            if title == "частое слово" and len(rows) == args.limit:
+                after = (rows[-1]["rank"], rows[-1]["id"])
+                p50, p95, rows = await timed(
+                    lambda: manager.search_messages(db, q, limit=args.limit, after=after), args.repeat
+                )
+                print(f"{'2-я страница':>18} {len(rows):>8} {p50:>8.2f} {p95:>8.2f}")
+
+        p50, p95, result = await timed(
+            lambda: db.execute(
+                text("SELECT id FROM messages WHERE text ILIKE '%w49000%' ORDER BY id DESC LIMIT :limit"),
+                {"limit": args.limit},
+            ),
+            max(1, args.repeat // 10),
+        )
+        print(f"{'ILIKE, без индекса':>18} {len(result.all()):>8} {p50:>8.2f} {p95:>8.2f}")
+
+        if args.explain:
+            # Выбор кандидатов из search_messages: GIN или обратный проход по id
+            plan = await db.execute(
+                text(
+                    "EXPLAIN (ANALYZE, BUFFERS) "
+                    "SELECT id, ts_rank(search_vector, websearch_to_tsquery('russian', 'w0')) AS rank "
+                    "FROM messages WHERE search_vector @@ websearch_to_tsquery('russian', 'w0') "
+                    "ORDER BY id DESC LIMIT :candidates"
+                ),
+                {"candidates": manager.search_max_candidates},
+            )
+            print()
+            print("\n".join(row[0] for row in plan))
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк сериализации: стоимость кодирования одного сообщения
+и init-кадра с 50 сообщениями истории.
+
+Сравнивает прежний путь (MessageResponse -> model_dump -> json.dumps
+с encoder'ом для datetime) с app.serialization.
+
+Запуск:
+    python -m benchmarks.bench_serialization
+    JSON_BACKEND=pydantic python -m benchmarks.bench_serialization
+"""
+import argparse
+import json
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from app.models import Message
+from app.schemas import InitResponse, MessageResponse
+from app.serialization import JSON_BACKEND, encode_message
+
+
+class DateTimeEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat()
+        return super().default(obj)
+
+
+def make_messages(count: int):
+    connection_id = uuid.uuid4()
+    return [
+        Message(
+            id=i,
+            text=f"Сообщение номер {i} " * 3,
+            room="general",
+            connection_id=connection_id,
+            user_message_number=i,
+            created_at=datetime.now(timezone.utc),
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def to_response(msg: Message) -> MessageResponse:
+    return MessageResponse(
+        id=msg.id,
+        text=msg.text,
+        connection_id=str(msg.connection_id),
+        user_message_number=msg.user_message_number,
+        created_at=msg.created_at,
+    )
+
+
+def old_message(msg):
+    return json.dumps(to_response(msg).model_dump(), cls=DateTimeEncoder)
+
+
+def old_init(messages, connection_id):
+    init = InitResponse(connection_id=connection_id, history=[to_response(m) for m in messages])
+    return json.dumps(init.model_dump(), cls=DateTimeEncoder)
+
+
+def new_init(history, connection_id):
+    return '{"type":"init","connection_id":"%s","history":[%s]}' % (connection_id, ",".join(history))
+
+
+def report(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {name:<45} {seconds * 1e6:9.2f} мкс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    messages = make_messages(50)
+    history = [encode_message(m) for m in messages]
+    connection_id = str(uuid.uuid4())
+    msg = messages[0]
+
+    print(f"JSON backend: {JSON_BACKEND}")
+    print("Одно сообщение:")
+    report("MessageResponse + json.dumps (было)", lambda: old_message(msg), args.number)
+    report("MessageResponse.model_dump_json", lambda: to_response(msg).model_dump_json(), args.number)
+    report("encode_message (стало)", lambda: encode_message(msg), args.number)
+
+    print("Init-кадр, 50 сообщений истории:")
+    report("InitResponse + json.dumps (было)", lambda: old_init(messages, connection_id), args.number // 10)
+    report("encode_message x50 + склейка", lambda: new_init([encode_message(m) for m in messages], connection_id),
+           args.number // 10)
+    report("склейка готовых строк из буфера (стало)", lambda: new_init(history, connection_id), args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Размер кадров на проводе и стоимость кодирования для режимов протокола:
+
+    json            - текстовые JSON-кадры (по умолчанию)
+    json+deflate    - JSON с permessage-deflate
+    msgpack         - подпротокол chat.msgpack
+    msgpack+deflate - MessagePack с permessage-deflate
+
+Первая часть считает размеры и CPU на сервере без сети: deflate
+моделируется так же, как в permessage-deflate (raw deflate с общим
+контекстом на соединение, Z_SYNC_FLUSH на каждый кадр). Сжатие
+выполняется отдельно для каждого получателя, поэтому его стоимость
+умножается на число клиентов, а перекодирование в MessagePack -
+один раз на рассылку.
+
+Вторая часть (--e2e) поднимает uvicorn с ConnectionManager без БД,
+подключается клиентом websockets через прокси, считающий байты,
+проверяет согласованные расширение и подпротокол и то, что все режимы
+доставляют одинаковые кадры.
+
+Запуск:
+    python -m benchmarks.bench_wire
+    python -m benchmarks.bench_wire --e2e --messages 200
+"""
+import argparse
+import asyncio
+import json
+import timeit
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+from app.models import Message
+from app.serialization import MSGPACK_SUBPROTOCOL, decode_frame, encode_message, msgpack, pack_frame
+
+MODES = ("json", "json+deflate", "msgpack", "msgpack+deflate")
+
+
+def make_messages(count: int):
+    return [
+        Message(
+            id=i,
+            text=f"Сообщение номер {i}: обычная реплика в чате средней длины",
+            room="general",
+            connection_id=uuid.uuid4(),
+            user_message_number=i,
+            created_at=datetime.now(timezone.utc),
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def init_frame(history, connection_id) -> str:
+    return '{"type":"init","connection_id":"%s","history":[%s]}' % (connection_id, ",".join(history))
+
+
+class Deflater:
+    """Сжатие как в permessage-deflate с context takeover."""
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+    def compress(self, data: bytes) -> bytes:
+        compressed = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        # Концевые 00 00 ff ff не передаются (RFC 7692)
+        return compressed[:-4]
+
+
+def offline(args):
+    messages = make_messages(args.messages)
+    frames = [encode_message(m) for m in messages]
+    init = init_frame(frames[:50], uuid.uuid4())
+
+    print(f"{'mode':>16} {'init, байт':>11} {'сообщ., байт':>13} {'кодир., мкс':>12} {'сжатие, мкс':>12}")
+    for mode in MODES:
+        if mode.startswith("msgpack") and msgpack is None:
+            print(f"{mode:>16}  пакет msgpack не установлен")
+            continue
+
+        binary = mode.startswith("msgpack")
+        encode = pack_frame if binary else str.encode
+        payloads = [encode(frame) for frame in frames]
+        init_payload = encode(init)
+        number = max(1, args.number // len(frames))
+        encode_seconds = min(timeit.repeat(lambda: [encode(f) for f in frames], number=number, repeat=3))
+        encode_us = encode_seconds / (number * len(frames)) * 1e6
+
+        if mode.endswith("deflate"):
+            init_size = len(Deflater().compress(init_payload))
+            deflater = Deflater()
+            sizes = [len(deflater.compress(p)) for p in payloads]
+
+            def run():
+                d = Deflater()
+                for p in payloads:
+                    d.compress(p)
+
+            deflate_seconds = min(timeit.repeat(run, number=number, repeat=3))
+            deflate_us = f"{deflate_seconds / (number * len(payloads)) * 1e6:12.2f}"
+        else:
+            init_size = len(init_payload)
+            sizes = [len(p) for p in payloads]
+            deflate_us = f"{'-':>12}"
+
+        print(f"{mode:>16} {init_size:>11} {sum(sizes) / len(sizes):>13.1f} {encode_us:>12.2f} {deflate_us}")
+
+
+class CountingProxy:
+    """TCP-прокси, считающий байты от сервера к клиенту."""
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.downstream = 0
+
+    async def handle(self, reader, writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+
+        async def pipe(src, dst, count):
+            try:
+                while data := await src.read(65536):
+                    if count:
+                        self.downstream += len(data)
+                    dst.write(data)
+                    await dst.drain()
+            finally:
+                dst.close()
+
+        await asyncio.gather(
+            pipe(reader, upstream_writer, False),
+            pipe(upstream_reader, writer, True),
+            return_exceptions=True,
+        )
+
+
+def build_app(history, broadcast_messages):
+    from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+
+    from app.connection_manager import ConnectionManager
+
+    app = FastAPI()
+    manager = ConnectionManager(queue_size=len(broadcast_messages) + 2)
+
+    @app.websocket("/ws")
+    async def endpoint(websocket: WebSocket):
+        connection_id = await manager.connect(websocket)
+        manager.send_frame(init_frame(history, connection_id), connection_id)
+        try:
+            await websocket.receive_text()
+            for message in broadcast_messages:
+                await manager.broadcast_message(message)
+            await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        manager.disconnect(websocket)
+
+    return app
+
+
+async def e2e(args):
+    import uvicorn
+    from websockets.asyncio.client import connect
+
+    messages = make_messages(50 + args.messages)
+    history = [encode_message(m) for m in messages[:50]]
+    app = build_app(history, messages[50:])
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    proxy = CountingProxy(args.port)
+    proxy_server = await asyncio.start_server(proxy.handle, "127.0.0.1", args.port + 1)
+
+    received = {}
+    print(f"{'mode':>16} {'extension':>28} {'subprotocol':>13} {'байт всего':>11} {'байт/сообщ.':>12}")
+    try:
+        for mode in MODES:
+            binary = mode.startswith("msgpack")
+            if binary and msgpack is None:
+                print(f"{mode:>16}  пакет msgpack не установлен")
+                continue
+
+            proxy.downstream = 0
+            async with connect(
+                f"ws://127.0.0.1:{args.port + 1}/ws",
+                compression="deflate" if mode.endswith("deflate") else None,
+                subprotocols=[MSGPACK_SUBPROTOCOL] if binary else None,
+                max_size=None,
+            ) as ws:
+                extension = ws.response.headers.get("Sec-WebSocket-Extensions", "-")
+                frames = [decode_frame(await ws.recv())]
+                await ws.send("go")
+                for _ in range(args.messages):
+                    frames.append(decode_frame(await ws.recv()))
+                await ws.send("done")
+                subprotocol = ws.subprotocol or "-"
+
+            assert (ws.subprotocol == MSGPACK_SUBPROTOCOL) == binary, "подпротокол не согласован"
+            assert ("permessage-deflate" in extension) == mode.endswith("deflate"), "deflate не согласован"
+            # Без connection_id: он свой у каждого подключения
+            frames[0].pop("connection_id")
+            received[mode] = frames
+            print(f"{mode:>16} {extension[:28]:>28} {subprotocol:>13} {proxy.downstream:>11} "
+                  f"{proxy.downstream / (args.messages + 1):>12.1f}")
+    finally:
+        proxy_server.close()
+        server.should_exit = True
+        await server_task
+
+    reference = received["json"]
+    for mode, frames in received.items():
+        assert frames == reference, f"{mode}: кадры отличаются от json"
+    print("Все режимы доставили одинаковые кадры")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--number", type=int, default=20000, help="кадров на замер CPU")
+    parser.add_argument("--e2e", action="store_true", help="проверка через uvicorn и клиент websockets")
+    parser.add_argument("--port", type=int, default=6095)
+    args = parser.parse_args()
+
+    offline(args)
+    if args.e2e:
+        print()
+        asyncio.run(e2e(args))
+
+
+if __name__ == "__main__":
+    main()
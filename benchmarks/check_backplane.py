@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Проверка межпроцессной рассылки через PostgreSQL backplane.
+
+Запускает два экземпляра приложения (BACKPLANE=postgres) на разных портах,
+подключает клиентов к каждому, параллельно отправляет сообщения и
+проверяет, что все клиенты получили все сообщения в одинаковом порядке.
+
+Нужна PostgreSQL из DATABASE_URL (например, из docker compose).
+
+Запуск:
+    python -m benchmarks.check_backplane --messages 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from websockets.asyncio.client import connect
+
+
+def start_instance(port: int) -> subprocess.Popen:
+    # Лимиты частоты выключены: клиенты шлют сообщения залпом
+    env = dict(os.environ, BACKPLANE="postgres", RATE_LIMIT_PER_CONNECTION="0", RATE_LIMIT_GLOBAL="0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def open_client(port: int, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            ws = await connect(f"ws://127.0.0.1:{port}/ws")
+            init = json.loads(await ws.recv())
+            assert init["type"] == "init", init
+            return ws, init["connection_id"]
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def collect(ws, expected: int, timeout: float):
+    received = []
+    async with asyncio.timeout(timeout):
+        while len(received) < expected:
+            frame = json.loads(await ws.recv())
+            if frame["type"] == "message":
+                received.append((frame["connection_id"], frame["user_message_number"], frame["text"]))
+    return received
+
+
+async def send(ws, tag: str, count: int):
+    for i in range(count):
+        await ws.send(json.dumps({"type": "message", "text": f"{tag}-{i}"}))
+
+
+async def run(ports, messages: int, timeout: float) -> bool:
+    clients = [await open_client(port) for port in ports]
+    # Дать подписке LISTEN и всем клиентам установиться
+    await asyncio.sleep(0.5)
+
+    expected = messages * len(clients)
+    collectors = [asyncio.create_task(collect(ws, expected, timeout)) for ws, _ in clients]
+    await asyncio.gather(*(send(ws, f"port{port}", messages) for (ws, _), port in zip(clients, ports)))
+    results = await asyncio.gather(*collectors)
+
+    ok = True
+    for port, received in zip(ports, results):
+        print(f"клиент на :{port} получил {len(received)} из {expected}")
+    if any(r != results[0] for r in results[1:]):
+        print("ОШИБКА: порядок доставки у клиентов различается")
+        ok = False
+    for _, connection_id in clients:
+        numbers = [n for cid, n, _ in results[0] if cid == connection_id]
+        if numbers != list(range(1, messages + 1)):
+            print(f"ОШИБКА: нарушена нумерация {connection_id}")
+            ok = False
+
+    for ws, _ in clients:
+        await ws.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ports", type=int, nargs="+", default=[6101, 6102])
+    parser.add_argument("--messages", type=int, default=200, help="сообщений от каждого клиента")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    instances = [start_instance(port) for port in args.ports]
+    try:
+        ok = asyncio.run(run(args.ports, args.messages, args.timeout))
+    finally:
+        for proc in instances:
+            proc.terminate()
+        for proc in instances:
+            proc.wait(timeout=10)
+
+    print("OK: межпроцессная доставка и порядок совпадают" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
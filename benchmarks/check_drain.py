@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Перезапуск под нагрузкой: пиковая частота переподключений и всплеск
+запросов к БД с drain и без него.
+
+Поднимаются два экземпляра сервера через start_server.py с шиной
+postgres: A, к которому подключены клиенты, и B, к которому они
+переподключаются, как при rolling restart за балансировщиком. Часть
+клиентов все время отправляет сообщения. Затем A получает SIGTERM:
+
+    drain - клиенты получают кадр reconnect и возвращаются через
+            назначенную сервером задержку (DRAIN_ON_SHUTDOWN=true)
+    cut   - uvicorn сразу закрывает сокеты, клиенты переподключаются
+            через фиксированные 2 с, как прежний веб-клиент
+
+Для каждого режима выводятся пиковая частота переподключений (по окнам
+--bucket секунд), за сколько вернулись все клиенты, сколько из них
+получили resume, и пиковая частота запросов к БД на B по /metrics:
+всех и только запросов истории при подключении.
+
+Нужна PostgreSQL из DATABASE_URL (например, из docker compose).
+
+Запуск:
+    python -m benchmarks.check_drain --clients 2000 --senders 50 --window 10
+    python -m benchmarks.check_drain --modes drain
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+from benchmarks.loadtest import raise_fd_limit
+
+# Задержка переподключения прежнего веб-клиента (reconnectDelay * 1)
+CUT_RECONNECT_DELAY = 2.0
+
+HISTORY_QUERIES = ("get_message_history",)
+
+
+def spawn(port: int, drain: bool, window: float) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        RELOAD="false",
+        BACKPLANE="postgres",
+        DRAIN_ON_SHUTDOWN="true" if drain else "false",
+        DRAIN_RECONNECT_WINDOW=str(window),
+        # Лимит частоты и heartbeat не должны мешать замеру
+        RATE_LIMIT_GLOBAL="0",
+        HEARTBEAT_INTERVAL="0",
+    )
+    log = open(os.path.join(tempfile.gettempdir(), f"check_drain_{port}.log"), "w")
+    proc = subprocess.Popen([sys.executable, "start_server.py"], env=env, stdout=log, stderr=log)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"Сервер на порту {port} не запустился за 30 с, см. {log.name}")
+
+
+def db_queries(port: int) -> Tuple[float, float]:
+    """Число запросов к БД по /metrics: всего и запросов истории."""
+    total = history = 0.0
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            if not line.startswith("chat_db_query_seconds_count"):
+                continue
+            value = float(line.rsplit(" ", 1)[1])
+            total += value
+            if any(f'query="{name}"' in line for name in HISTORY_QUERIES):
+                history += value
+    return total, history
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_errors = 0
+        self.reconnects: List[float] = []
+        self.kinds: Counter = Counter()
+        self.close_codes: Counter = Counter()
+        self.errors = 0
+
+
+async def send_messages(ws, rate: float) -> None:
+    interval = 1.0 / rate
+    i = 0
+    try:
+        while True:
+            await ws.send(json.dumps({"type": "message", "text": f"drain check {i}"}))
+            i += 1
+            await asyncio.sleep(interval)
+    except ConnectionClosed:
+        pass
+
+
+async def client(
+    url_a: str,
+    url_b: str,
+    stats: Stats,
+    semaphore: asyncio.Semaphore,
+    rate: Optional[float],
+    stop: asyncio.Event,
+) -> None:
+    async with semaphore:
+        try:
+            ws = await connect(url_a, open_timeout=30, max_queue=None)
+        except Exception:
+            stats.connect_errors += 1
+            return
+    stats.connected += 1
+
+    last_id, after = None, None
+    sender = asyncio.create_task(send_messages(ws, rate)) if rate else None
+    try:
+        async for raw in ws:
+            frame = json.loads(raw)
+            if frame["type"] == "init" and frame["history"]:
+                last_id = frame["history"][-1]["id"]
+            elif frame["type"] == "message":
+                last_id = max(last_id or 0, frame["id"])
+            elif frame["type"] == "reconnect":
+                after = frame["after"]
+    except ConnectionClosed:
+        pass
+    finally:
+        if sender is not None:
+            sender.cancel()
+    stats.close_codes[ws.close_code] += 1
+
+    await asyncio.sleep(after if after is not None else CUT_RECONNECT_DELAY)
+    url = url_b if last_id is None else f"{url_b}?last_id={last_id}"
+    try:
+        async with connect(url, open_timeout=30, max_queue=None) as ws:
+            first = json.loads(await ws.recv())
+            stats.reconnects.append(time.perf_counter())
+            stats.kinds[first["type"]] += 1
+            sender = asyncio.create_task(send_messages(ws, rate)) if rate else None
+            await stop.wait()
+            if sender is not None:
+                sender.cancel()
+    except Exception:
+        stats.errors += 1
+
+
+async def sample_db(port: int, interval: float, samples: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        samples.append((time.perf_counter(), *await asyncio.to_thread(db_queries, port)))
+        await asyncio.sleep(interval)
+
+
+def peak_rate(timestamps: List[float], bucket: float) -> float:
+    if not timestamps:
+        return 0.0
+    buckets = Counter(int(t / bucket) for t in timestamps)
+    return max(buckets.values()) / bucket
+
+
+def peak_delta_rate(samples: list, column: int) -> float:
+    rates = [
+        (b[column] - a[column]) / (b[0] - a[0])
+        for a, b in zip(samples, samples[1:])
+        if b[0] > a[0]
+    ]
+    return max(rates, default=0.0)
+
+
+async def run_mode(mode: str, args) -> dict:
+    drain = mode == "drain"
+    port_a, port_b = args.port, args.port + 1
+    proc_a = spawn(port_a, drain, args.window)
+    proc_b = spawn(port_b, drain, args.window)
+
+    stats = Stats()
+    stop = asyncio.Event()
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    tasks = [
+        asyncio.create_task(client(
+            f"ws://127.0.0.1:{port_a}/ws",
+            f"ws://127.0.0.1:{port_b}/ws",
+            stats,
+            semaphore,
+            args.rate if i < args.senders else None,
+            stop,
+        ))
+        for i in range(args.clients)
+    ]
+    try:
+        while stats.connected + stats.connect_errors < args.clients:
+            await asyncio.sleep(0.1)
+        print(f"{mode}: подключено {stats.connected}/{args.clients} клиентов")
+        await asyncio.sleep(args.warmup)
+
+        samples: list = []
+        sampling_stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_db(port_b, args.bucket, samples, sampling_stop))
+
+        started = time.perf_counter()
+        proc_a.send_signal(signal.SIGTERM)
+        exited = asyncio.create_task(asyncio.to_thread(proc_a.wait))
+
+        deadline = started + args.window + args.timeout
+        while len(stats.reconnects) + stats.errors < stats.connected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        await exited
+        exit_seconds = time.perf_counter() - started
+        await asyncio.sleep(args.bucket * 2)
+        sampling_stop.set()
+        await sampler
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for proc in (proc_a, proc_b):
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    return {
+        "mode": mode,
+        "reconnected": len(stats.reconnects),
+        "errors": stats.errors,
+        "peak_reconnects_per_sec": round(peak_rate(stats.reconnects, args.bucket), 1),
+        "all_back_sec": round(max(stats.reconnects, default=started) - started, 2),
+        "old_instance_exit_sec": round(exit_seconds, 2),
+        "resumed": stats.kinds.get("resume", 0),
+        "peak_db_queries_per_sec": round(peak_delta_rate(samples, 1), 1),
+        "peak_history_queries_per_sec": round(peak_delta_rate(samples, 2), 1),
+        "history_queries": int(samples[-1][2] - samples[0][2]) if samples else 0,
+        "close_codes": dict(stats.close_codes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6096)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--senders", type=int, default=20, help="сколько клиентов отправляют сообщения")
+    parser.add_argument("--rate", type=float, default=2.0, help="сообщений/с на отправителя")
+    parser.add_argument("--window", type=float, default=10.0, help="DRAIN_RECONNECT_WINDOW, с")
+    parser.add_argument("--bucket", type=float, default=0.25, help="окно подсчета пиковой частоты, с")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="ожидание переподключений сверх окна, с")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--modes", nargs="+", choices=("cut", "drain"), default=["cut", "drain"])
+    args = parser.parse_args()
+
+    raise_fd_limit(args.clients * 2)
+    results = [asyncio.run(run_mode(mode, args)) for mode in args.modes]
+    for result in results:
+        print(json.dumps(result, indent=2))
+
+    print(f"{'mode':>6} {'пик перепод./с':>15} {'все за, с':>10} {'пик запросов БД/с':>18} {'пик истории/с':>14}")
+    for r in results:
+        print(f"{r['mode']:>6} {r['peak_reconnects_per_sec']:>15} {r['all_back_sec']:>10} "
+              f"{r['peak_db_queries_per_sec']:>18} {r['peak_history_queries_per_sec']:>14}")
+
+    failed = [r for r in results if r["errors"] or r["reconnected"] < args.clients]
+    if failed:
+        print("FAILED: вернулись не все клиенты")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Проверка: тысячи простаивающих сокетов при маленьком пуле БД.
+
+Запускает сервер с DB_POOL_SIZE=5 и без overflow, открывает тысячи
+простаивающих клиентов, затем несколько активных клиентов отправляют
+сообщения и запрашивают историю. Все запросы должны выполниться, а
+пока клиенты простаивают, ни одно соединение пула не должно быть занято.
+
+Нужна PostgreSQL из DATABASE_URL (например, из docker compose).
+
+Запуск:
+    python -m benchmarks.check_idle_pool --idle 3000 --active 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+
+from websockets.asyncio.client import connect
+
+from benchmarks.loadtest import raise_fd_limit, spawn_server
+
+
+def ws_info(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/ws-info", timeout=10) as response:
+        return json.load(response)
+
+
+async def open_idle(url: str, count: int):
+    semaphore = asyncio.Semaphore(200)
+
+    async def one():
+        async with semaphore:
+            ws = await connect(url, open_timeout=30)
+            await ws.recv()  # init
+            return ws
+
+    return await asyncio.gather(*(one() for _ in range(count)))
+
+
+async def active_client(url: str, messages: int, timeout: float) -> bool:
+    async with connect(url) as ws:
+        init = json.loads(await ws.recv())
+        connection_id = init["connection_id"]
+        for i in range(messages):
+            await ws.send(json.dumps({"type": "message", "text": f"pool check {i}"}))
+        await ws.send(json.dumps({"type": "history", "limit": 10}))
+
+        own, history = 0, False
+        async with asyncio.timeout(timeout):
+            while own < messages or not history:
+                frame = json.loads(await ws.recv())
+                if frame["type"] == "message" and frame["connection_id"] == connection_id:
+                    own += 1
+                elif frame["type"] == "history":
+                    history = True
+                elif frame["type"] in ("error", "throttle"):
+                    print(f"ОШИБКА от сервера: {frame}")
+                    return False
+        return True
+
+
+async def run(args) -> bool:
+    url = f"ws://127.0.0.1:{args.port}/ws"
+    started = time.perf_counter()
+    idle = await open_idle(url, args.idle)
+    print(f"Открыто {len(idle)} простаивающих сокетов за {time.perf_counter() - started:.1f} с")
+
+    pool = ws_info(args.port)["db_pool"]
+    print(f"Пул при простое: {pool}")
+    ok = pool["checked_out"] == 0
+
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(active_client(url, args.messages, args.timeout) for _ in range(args.active)),
+        return_exceptions=True,
+    )
+    failed = [r for r in results if r is not True]
+    print(f"Активных клиентов: {args.active}, неудачных: {len(failed)}, "
+          f"за {time.perf_counter() - started:.1f} с")
+    ok = ok and not failed
+
+    await asyncio.gather(*(ws.close() for ws in idle), return_exceptions=True)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6091)
+    parser.add_argument("--idle", type=int, default=3000)
+    parser.add_argument("--active", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="сообщений от каждого активного клиента")
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    raise_fd_limit(args.idle + args.active)
+    os.environ.update(
+        DB_POOL_SIZE=str(args.pool_size),
+        DB_MAX_OVERFLOW="0",
+        DB_POOL_TIMEOUT="5",
+        # Лимит частоты не должен мешать проверке пула
+        RATE_LIMIT_GLOBAL="0",
+    )
+    proc = spawn_server(args.port)
+    try:
+        ok = asyncio.run(run(args))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    print("OK: пул не исчерпан" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
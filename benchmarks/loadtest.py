@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест WebSocket чата.
+
+Открывает тысячи клиентов, часть из них отправляет сообщения с заданной
+частотой, и измеряет:
+- время установки соединения (TCP + WebSocket handshake)
+- время до получения init-кадра
+- сквозную задержку сообщения (отправка -> получение рассылки) p50/p95/p99
+- пропускную способность (сообщений/с, принятых сервером и разосланных)
+- RSS процесса сервера
+
+Сервер можно запустить самим скриптом (--spawn) или указать уже
+работающий (--url и --server-pid для RSS). Серверу нужна PostgreSQL
+из DATABASE_URL (например, из docker compose).
+
+Результат можно сохранить как baseline и сравнивать с ним последующие
+запуски: при ухудшении больше чем на --tolerance скрипт завершается с
+кодом 1, что удобно для регулярных прогонов. Baseline имеет смысл только
+для машины, на которой он снят, поэтому в репозиторий он не входит
+(benchmarks/baselines/ в .gitignore): его нужно сохранить первым прогоном
+с --save-baseline на машине, где будут идти сравнения.
+
+Примеры:
+    python -m benchmarks.loadtest --spawn --clients 2000 --senders 50 --rate 2 --duration 30
+    python -m benchmarks.loadtest --spawn --clients 2000 --save-baseline benchmarks/baselines/2k.json
+    python -m benchmarks.loadtest --spawn --clients 2000 --baseline benchmarks/baselines/2k.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from websockets.asyncio.client import connect
+
+# Метрики, для которых меньше - лучше; для остальных больше - лучше
+LOWER_IS_BETTER = (
+    "connect_p50_ms", "connect_p99_ms",
+    "init_p50_ms", "init_p99_ms",
+    "latency_p50_ms", "latency_p95_ms", "latency_p99_ms",
+    "server_rss_mb",
+)
+HIGHER_IS_BETTER = ("messages_per_sec", "deliveries_per_sec")
+
+MARKER = "lt:"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def server_rss_mb(pid: Optional[int]) -> float:
+    if pid is None:
+        return 0.0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def raise_fd_limit(clients: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, clients * 2 + 256))
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+class Stats:
+    def __init__(self):
+        self.connect: List[float] = []
+        self.init: List[float] = []
+        self.latency: List[float] = []
+        self.sent = 0
+        self.delivered = 0
+        self.errors = 0
+
+
+async def open_client(url: str, stats: Stats, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            ws = await connect(url, open_timeout=30, max_queue=None)
+        except Exception:
+            stats.errors += 1
+            return None
+        connected = time.perf_counter()
+        init = json.loads(await ws.recv())
+        stats.connect.append(connected - started)
+        if init.get("type") == "init":
+            stats.init.append(time.perf_counter() - started)
+        return ws
+
+
+async def reader(ws, stats: Stats, stop: asyncio.Event):
+    try:
+        while not stop.is_set():
+            frame = json.loads(await ws.recv())
+            if frame.get("type") == "ping":
+                # Иначе сервер посчитает молчащего клиента мертвым и отключит
+                await ws.send(json.dumps({"type": "pong"}))
+                continue
+            if frame.get("type") != "message" or not frame["text"].startswith(MARKER):
+                continue
+            sent_at = int(frame["text"].split(":", 2)[1])
+            stats.latency.append((time.perf_counter_ns() - sent_at) / 1e9)
+            stats.delivered += 1
+    except Exception:
+        pass
+
+
+async def sender(ws, stats: Stats, rate: float, stop: asyncio.Event):
+    interval = 1.0 / rate
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        text = f"{MARKER}{time.perf_counter_ns()}:load"
+        try:
+            await ws.send(json.dumps({"type": "message", "text": text}))
+        except Exception:
+            stats.errors += 1
+            return
+        stats.sent += 1
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+
+async def run(args, server_pid: Optional[int]) -> Dict[str, float]:
+    stats = Stats()
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    connect_started = time.perf_counter()
+    clients = await asyncio.gather(*(open_client(args.url, stats, semaphore) for _ in range(args.clients)))
+    clients = [ws for ws in clients if ws is not None]
+    connect_elapsed = time.perf_counter() - connect_started
+    print(f"Подключено {len(clients)}/{args.clients} клиентов за {connect_elapsed:.1f} с")
+
+    stop = asyncio.Event()
+    readers = [asyncio.create_task(reader(ws, stats, stop)) for ws in clients]
+    senders = [
+        asyncio.create_task(sender(ws, stats, args.rate, stop))
+        for ws in clients[:args.senders]
+    ]
+
+    # Прогрев не учитываем
+    await asyncio.sleep(args.warmup)
+    stats.latency.clear()
+    sent_before, delivered_before = stats.sent, stats.delivered
+
+    await asyncio.sleep(args.duration)
+    sent = stats.sent - sent_before
+    delivered = stats.delivered - delivered_before
+    rss = server_rss_mb(server_pid)
+
+    stop.set()
+    for task in senders + readers:
+        task.cancel()
+    await asyncio.gather(*(ws.close() for ws in clients), return_exceptions=True)
+
+    return {
+        "clients": len(clients),
+        "connect_rate_per_sec": round(len(clients) / connect_elapsed, 1),
+        "connect_p50_ms": round(percentile(stats.connect, 50) * 1000, 2),
+        "connect_p99_ms": round(percentile(stats.connect, 99) * 1000, 2),
+        "init_p50_ms": round(percentile(stats.init, 50) * 1000, 2),
+        "init_p99_ms": round(percentile(stats.init, 99) * 1000, 2),
+        "latency_p50_ms": round(percentile(stats.latency, 50) * 1000, 2),
+        "latency_p95_ms": round(percentile(stats.latency, 95) * 1000, 2),
+        "latency_p99_ms": round(percentile(stats.latency, 99) * 1000, 2),
+        "messages_per_sec": round(sent / args.duration, 1),
+        "deliveries_per_sec": round(delivered / args.duration, 1),
+        "server_rss_mb": round(rss, 1),
+        "errors": stats.errors,
+    }
+
+
+def compare(result: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    for key in LOWER_IS_BETTER:
+        if baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {result[key]} > {baseline[key]} (+{tolerance:.0%})")
+    for key in HIGHER_IS_BETTER:
+        if baseline.get(key) and result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {result[key]} < {baseline[key]} (-{tolerance:.0%})")
+    return regressions
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        # Лимиты частоты выключены, чтобы мерить сервер, а не их
+        env=dict(os.environ, RATE_LIMIT_PER_CONNECTION="0", RATE_LIMIT_GLOBAL="0"),
+    )
+    # Ждем, пока сервер начнет принимать соединения
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("Сервер не запустился за 30 с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=None, help="адрес WebSocket (по умолчанию ws://127.0.0.1:<port>/ws)")
+    parser.add_argument("--port", type=int, default=6090)
+    parser.add_argument("--spawn", action="store_true", help="запустить сервер uvicorn самостоятельно")
+    parser.add_argument("--server-pid", type=int, default=None, help="pid работающего сервера для RSS")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--senders", type=int, default=20, help="сколько клиентов отправляют сообщения")
+    parser.add_argument("--rate", type=float, default=2.0, help="сообщений/с на отправителя")
+    parser.add_argument("--duration", type=float, default=20.0, help="длительность замера, с")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--baseline", help="JSON с baseline для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить результат как baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    args.url = args.url or f"ws://127.0.0.1:{args.port}/ws"
+    raise_fd_limit(args.clients)
+
+    proc = spawn_server(args.port) if args.spawn else None
+    server_pid = proc.pid if proc is not None else args.server_pid
+    try:
+        result = asyncio.run(run(args, server_pid))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    print(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline сохранен в {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("РЕГРЕССИЯ:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Регрессий относительно baseline нет")
+
+
+if __name__ == "__main__":
+    main()
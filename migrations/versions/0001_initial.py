@@ -0,0 +1,45 @@
+"""Initial messages table
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблица могла быть создана init_db() до появления миграций
+    if not context.is_offline_mode() and sa.inspect(op.get_bind()).has_table("messages"):
+        op.create_index("ix_messages_created_at", "messages", ["created_at"], if_not_exists=True)
+        return
+
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("connection_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("user_message_number", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_messages_id", "messages", ["id"])
+    op.create_index("ix_messages_connection_id", "messages", ["connection_id"])
+    op.create_index("ix_messages_created_at", "messages", ["created_at"])
+    op.create_index("idx_connection_number", "messages", ["connection_id", "user_message_number"], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("messages")
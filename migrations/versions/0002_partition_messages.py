@@ -0,0 +1,123 @@
+"""Partition messages by created_at
+
+Переводит messages в секционированную по месяцам таблицу
+(PARTITION BY RANGE (created_at)). Существующие строки переносятся
+в месячные секции, плюс создается секция DEFAULT на случай строк вне
+созданных диапазонов. Дальнейшие секции создает и удаляет
+app/partitions.py.
+
+Ограничения секционирования PostgreSQL: первичный ключ и уникальные
+индексы должны включать ключ секционирования, поэтому первичный ключ
+становится (id, created_at), а idx_connection_number -
+(connection_id, user_message_number, created_at).
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def has_room_column() -> bool:
+    """Колонку room уже создала init_db() по актуальной модели."""
+    if context.is_offline_mode():
+        return False
+    columns = sa.inspect(op.get_bind()).get_columns("messages")
+    return any(column["name"] == "room" for column in columns)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблица, созданная init_db(), уже содержит комнаты: их нужно перенести,
+    # иначе 0003 отправит все сообщения в general. search_vector
+    # генерируемая, ее добавит 0004
+    columns = "id, text, connection_id, user_message_number, created_at"
+    room_column = ""
+    if has_room_column():
+        columns += ", room"
+        room_column = "room varchar(64) NOT NULL DEFAULT 'general',"
+
+    op.execute("ALTER TABLE messages RENAME TO messages_legacy")
+    for index in ("ix_messages_id", "ix_messages_connection_id", "ix_messages_created_at", "idx_connection_number"):
+        op.execute(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy")
+    op.execute("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            text text NOT NULL,
+            connection_id uuid NOT NULL,
+            user_message_number integer NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            {room_column}
+            CONSTRAINT messages_pkey PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """.format(room_column=room_column))
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("CREATE INDEX ix_messages_connection_id ON messages (connection_id)")
+    op.execute("CREATE INDEX ix_messages_created_at ON messages (created_at)")
+    op.execute(
+        "CREATE UNIQUE INDEX idx_connection_number "
+        "ON messages (connection_id, user_message_number, created_at)"
+    )
+
+    # Месячные секции (границы в UTC) от самого старого сообщения до следующего месяца
+    op.execute("""
+        DO $$
+        DECLARE
+            period timestamp := date_trunc('month', coalesce(
+                (SELECT min(created_at) FROM messages_legacy), now()) AT TIME ZONE 'UTC');
+            last_period timestamp := date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month';
+        BEGIN
+            WHILE period <= last_period LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                    'messages_p' || to_char(period, 'YYYYMMDD'),
+                    period AT TIME ZONE 'UTC',
+                    (period + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                period := period + interval '1 month';
+            END LOOP;
+        END $$
+    """)
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    op.execute(f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_legacy")
+    op.execute("DROP TABLE messages_legacy")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER INDEX ix_messages_connection_id RENAME TO ix_messages_connection_id_partitioned")
+    op.execute("ALTER INDEX ix_messages_created_at RENAME TO ix_messages_created_at_partitioned")
+    op.execute("ALTER INDEX idx_connection_number RENAME TO idx_connection_number_partitioned")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            text text NOT NULL,
+            connection_id uuid NOT NULL,
+            user_message_number integer NOT NULL,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            CONSTRAINT messages_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("INSERT INTO messages SELECT * FROM messages_partitioned")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("DROP TABLE messages_partitioned")
+    op.execute("CREATE INDEX ix_messages_id ON messages (id)")
+    op.execute("CREATE INDEX ix_messages_connection_id ON messages (connection_id)")
+    op.execute("CREATE INDEX ix_messages_created_at ON messages (created_at)")
+    op.execute("CREATE UNIQUE INDEX idx_connection_number ON messages (connection_id, user_message_number)")
@@ -0,0 +1,35 @@
+"""Add rooms to messages
+
+Сообщения принадлежат комнате (каналу). Существующие сообщения
+попадают в комнату general. Индекс (room, id) обслуживает историю
+комнаты с keyset-пагинацией; на секционированной таблице он создается
+на каждой секции автоматически.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # IF NOT EXISTS: если таблицу создала init_db() по актуальной модели,
+    # колонка room с комнатами уже перенесена миграцией 0002
+    op.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS room varchar(64) NOT NULL DEFAULT 'general'")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_room_id ON messages (room, id)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS idx_room_id")
+    op.execute("ALTER TABLE messages DROP COLUMN IF EXISTS room")
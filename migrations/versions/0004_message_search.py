@@ -0,0 +1,41 @@
+"""Full-text search over messages
+
+Генерируемая колонка search_vector = to_tsvector('russian', text) и GIN
+индекс по ней. Колонка вычисляется PostgreSQL при вставке, поэтому код
+записи не меняется. На секционированной таблице колонка и индекс
+наследуются всеми секциями, включая создаваемые позже.
+
+Добавление STORED-колонки переписывает таблицу, а построение индекса
+читает ее целиком: на больших таблицах миграцию стоит выполнять в окно
+обслуживания.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # IF NOT EXISTS: колонку и индекс могла создать init_db() по актуальной модели
+    op.execute(
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('russian', text)) STORED"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING gin (search_vector)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS idx_messages_search")
+    op.execute("ALTER TABLE messages DROP COLUMN IF EXISTS search_vector")
@@ -1,17 +1,121 @@
 #!/usr/bin/env python3
 """
 Запуск сервера
+
+dev  - один процесс, перезапуск при изменении кода (RELOAD)
+prod - WORKERS процессов без перезапуска, по одному event loop на ядро.
+       Каждый воркер слушает порт своим сокетом с SO_REUSEPORT, и ядро
+       распределяет между ними новые соединения. Воркеры - отдельные
+       шарды: клиенты разных воркеров связаны через BACKPLANE=postgres
 """
 import os
+import socket
+import logging
+from functools import partial
+from importlib.util import find_spec
+
 import uvicorn
+from uvicorn.supervisors import ChangeReload, Multiprocess
+
+logger = logging.getLogger("uvicorn.error")
+
+# Drain перед остановкой, false - закрыть сокеты сразу, как штатный uvicorn
+DRAIN_ON_SHUTDOWN = os.getenv("DRAIN_ON_SHUTDOWN", "true").lower() == "true"
+
+SERVER_MODE = os.getenv("SERVER_MODE", "dev").lower()
+SERVER_MODES = ("dev", "prod")
+
+# Каждый воркер привязывает свой сокет (SO_REUSEPORT), а не принимает
+# соединения из общего сокета родителя: ядро распределяет их равномернее
+REUSE_PORT = os.getenv("REUSE_PORT", "true").lower() == "true" and hasattr(socket, "SO_REUSEPORT")
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn.Server с режимом drain.
+
+    Штатный uvicorn при остановке сразу закрывает WebSocket кодом 1012,
+    и все клиенты переподключаются одновременно. Здесь перед этим
+    перестает слушаться порт и приложение выполняет drain: клиенты
+    получают кадр reconnect с разной задержкой, очереди дописываются.
+    """
+
+    async def shutdown(self, sockets=None):
+        if DRAIN_ON_SHUTDOWN:
+            for server in self.servers:
+                server.close()
+            # Приложение уже загружено этим процессом
+            from app.main import drain
+            await drain()
+        await super().shutdown(sockets)
+
+
+def bind_reuse_port(config: uvicorn.Config) -> socket.socket:
+    """Сокет воркера на общем порту с SO_REUSEPORT."""
+    family = socket.AF_INET6 if ":" in config.host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((config.host, config.port))
+    return sock
+
+
+def run_worker(config: uvicorn.Config, sockets=None) -> None:
+    """Воркер prod-режима: вызывается в дочернем процессе Multiprocess."""
+    if REUSE_PORT:
+        sockets = [bind_reuse_port(config)]
+    DrainingServer(config).run(sockets=sockets)
+
 
 if __name__ == "__main__":
+    if SERVER_MODE not in SERVER_MODES:
+        raise SystemExit(f"Неизвестный SERVER_MODE: {SERVER_MODE}")
+    production = SERVER_MODE == "prod"
+
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "6088"))
-    
-    uvicorn.run(
+    # Сжатие WebSocket-кадров (permessage-deflate), если его предлагает клиент
+    ws_per_message_deflate = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+    reload = not production and os.getenv("RELOAD", "true").lower() == "true"
+    workers = 1
+    if production:
+        # По умолчанию воркер на каждое ядро
+        workers = int(os.getenv("WORKERS", "0")) or os.cpu_count() or 1
+
+    if workers > 1 and os.getenv("BACKPLANE", "memory").lower() == "memory":
+        raise SystemExit(
+            f"WORKERS={workers} требует BACKPLANE=postgres: "
+            "с BACKPLANE=memory клиенты разных воркеров не видят сообщений друг друга"
+        )
+    if (
+        workers > 1
+        and os.getenv("PERSISTENCE_MODE", "sync").lower() == "write_behind"
+        and int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000")) != 1
+    ):
+        raise SystemExit(
+            f"WORKERS={workers} с PERSISTENCE_MODE=write_behind требует WRITE_BEHIND_ID_BLOCK=1: "
+            "блоки id разных воркеров перемежаются, и id перестают расти в порядке рассылки"
+        )
+
+    config = uvicorn.Config(
         "app.main:app",
         host=host,
         port=port,
-        reload=True
-    )
\ No newline at end of file
+        reload=reload,
+        workers=workers,
+        # uvloop и httptools, если установлены, иначе asyncio и h11
+        loop="uvloop" if find_spec("uvloop") else "asyncio",
+        http="httptools" if find_spec("httptools") else "h11",
+        ws_per_message_deflate=ws_per_message_deflate,
+    )
+
+    # То же, что uvicorn.run, но с DrainingServer
+    if config.should_reload:
+        sock = config.bind_socket()
+        ChangeReload(config, target=DrainingServer(config).run, sockets=[sock]).run()
+    elif workers > 1:
+        logger.info(f"Запуск {workers} воркеров: loop={config.loop}, http={config.http}, SO_REUSEPORT={REUSE_PORT}")
+        sockets = [] if REUSE_PORT else [config.bind_socket()]
+        Multiprocess(config, target=partial(run_worker, config), sockets=sockets).run()
+    else:
+        DrainingServer(config).run()
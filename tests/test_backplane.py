@@ -0,0 +1,101 @@
+"""
+Формат payload шины PostgreSQL: публикация и разбор без сервера
+
+_notify подменен: payload сразу передается в _on_notify, как если бы
+его вернул LISTEN.
+"""
+import asyncio
+import json
+
+from app.backplane import KIND_BATCH, KIND_FRAME, KIND_MESSAGE, KIND_STATS, NOTIFY_PAYLOAD_LIMIT, PostgresBackplane
+
+
+class LoopbackBackplane(PostgresBackplane):
+    def __init__(self):
+        super().__init__(dsn="postgresql://unused")
+        self.payloads = []
+        self.delivered = []
+        self.batches = []
+        self.stats = []
+        self.subscribe(
+            lambda frame, message_id, room: self.delivered.append((frame, message_id, room)),
+            lambda room, entries: self.batches.append((room, entries)),
+            lambda shard, stats: self.stats.append((shard, stats)),
+        )
+
+    async def _notify(self, payload):
+        self.payloads.append(payload)
+        self._on_notify(None, 0, self.channel, payload)
+
+
+def frame(message_id, text):
+    return json.dumps({"type": "message", "id": message_id, "text": text}, ensure_ascii=False)
+
+
+def test_message_frame_and_stats_round_trip():
+    async def run():
+        backplane = LoopbackBackplane()
+        message = frame(7, "привет 👋 world")
+        await backplane.publish(message, 7, "general")
+        await backplane.publish('{"type":"online","count":3}')
+        await backplane.publish_stats("host:42", '{"connections":5}')
+        return backplane
+
+    backplane = asyncio.run(run())
+    assert [payload[0] for payload in backplane.payloads] == [KIND_MESSAGE, KIND_FRAME, KIND_STATS]
+    assert backplane.delivered == [
+        (frame(7, "привет 👋 world"), 7, "general"),
+        ('{"type":"online","count":3}', None, None),
+    ]
+    assert backplane.stats == [("host:42", '{"connections":5}')]
+
+
+def test_batch_with_multibyte_text_round_trips():
+    entries = [
+        (10, frame(10, "ёжик")),
+        (11, frame(11, "日本語のテキスト")),
+        (12, frame(12, "emoji 🙂🙃 и пробелы {} : ,")),
+    ]
+
+    async def run():
+        backplane = LoopbackBackplane()
+        await backplane.publish_batch("room-1", entries)
+        return backplane
+
+    backplane = asyncio.run(run())
+    assert len(backplane.payloads) == 1
+    assert backplane.payloads[0].startswith(KIND_BATCH + "room-1 10:")
+    assert backplane.batches == [("room-1", entries)]
+
+
+def test_batch_is_split_into_chunks_that_fit_notify():
+    # Многобайтный текст: длина в символах заметно меньше длины в байтах
+    entries = [(i, frame(i, "щ" * 900)) for i in range(1, 21)]
+
+    async def run():
+        backplane = LoopbackBackplane()
+        await backplane.publish_batch("general", entries)
+        return backplane
+
+    backplane = asyncio.run(run())
+    assert len(backplane.payloads) > 1
+    assert all(len(payload.encode()) <= NOTIFY_PAYLOAD_LIMIT for payload in backplane.payloads)
+    # Каждый кусок ушел через NOTIFY, а не только локально
+    assert all(payload[0] == KIND_BATCH for payload in backplane.payloads)
+    assert [room for room, _ in backplane.batches] == ["general"] * len(backplane.payloads)
+    assert [entry for _, chunk in backplane.batches for entry in chunk] == entries
+
+
+def test_oversized_frames_are_delivered_locally():
+    huge = frame(1, "я" * NOTIFY_PAYLOAD_LIMIT)
+
+    async def run():
+        backplane = LoopbackBackplane()
+        await backplane.publish(huge, 1, "general")
+        await backplane.publish_batch("general", [(2, frame(2, "ok")), (3, huge)])
+        return backplane
+
+    backplane = asyncio.run(run())
+    assert len(backplane.payloads) == 1
+    assert backplane.delivered == [(huge, 1, "general")]
+    assert backplane.batches == [("general", [(2, frame(2, "ok"))]), ("general", [(3, huge)])]
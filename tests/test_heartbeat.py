@@ -0,0 +1,168 @@
+"""
+Проверка heartbeat: ping, pong, отключение по таймауту и простою
+
+check_heartbeats принимает текущее время явно, поэтому тесты сдвигают
+часы без ожидания.
+"""
+import asyncio
+import json
+
+from app.connection_manager import HEARTBEAT_CLOSE_CODE, ConnectionManager
+
+INTERVAL = 10
+TIMEOUT = 5
+IDLE = 60
+
+
+class FakeWebSocket:
+    scope = {}
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def accept(self, *args, **kwargs):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        self.closed = code
+
+
+def pings(ws):
+    return [frame for frame in ws.sent if frame["type"] == "ping"]
+
+
+async def settle():
+    """Дает писателям соединений отправить кадры, а закрытиям - выполниться."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def connect(manager):
+    ws = FakeWebSocket()
+    connection_id = await manager.connect(ws, subscribe=False)
+    return ws, manager.active_connections[connection_id]
+
+
+def run_with_manager(scenario, idle_timeout=IDLE):
+    async def run():
+        manager = ConnectionManager(
+            heartbeat_interval=INTERVAL, heartbeat_timeout=TIMEOUT, idle_timeout=idle_timeout,
+        )
+        try:
+            return await scenario(manager)
+        finally:
+            await manager.stop()
+
+    return asyncio.run(run())
+
+
+def test_silent_connection_gets_ping_after_interval():
+    async def scenario(manager):
+        ws, connection = await connect(manager)
+        start = connection.connected_at
+        before = manager.check_heartbeats(start + INTERVAL - 1)
+        await settle()
+        sent_before = len(pings(ws))
+        evicted = manager.check_heartbeats(start + INTERVAL)
+        await settle()
+        return before, sent_before, evicted, ws, connection
+
+    before, sent_before, evicted, ws, connection = run_with_manager(scenario)
+    assert (before, sent_before, evicted) == (0, 0, 0)
+    assert pings(ws) == [{"type": "ping", "interval": INTERVAL}]
+    assert connection.ping_sent == connection.connected_at + INTERVAL
+
+
+def test_pong_clears_ping_and_keeps_connection():
+    async def scenario(manager):
+        ws, connection = await connect(manager)
+        start = connection.connected_at
+        manager.check_heartbeats(start + INTERVAL)
+        # pong пришел до истечения таймаута
+        connection.last_seen = start + INTERVAL + 1
+        evicted = manager.check_heartbeats(start + INTERVAL + TIMEOUT)
+        await settle()
+        return evicted, ws, connection, manager
+
+    evicted, ws, connection, manager = run_with_manager(scenario)
+    assert evicted == 0
+    assert connection.ping_sent is None
+    assert connection.connection_id in manager.active_connections
+    assert ws.closed is None
+    assert manager.heartbeat_timeouts == 0
+
+
+def test_unanswered_ping_evicts_after_timeout():
+    async def scenario(manager):
+        ws, connection = await connect(manager)
+        start = connection.connected_at
+        manager.check_heartbeats(start + INTERVAL)
+        early = manager.check_heartbeats(start + INTERVAL + TIMEOUT - 1)
+        evicted = manager.check_heartbeats(start + INTERVAL + TIMEOUT)
+        await settle()
+        return early, evicted, ws, connection, manager
+
+    early, evicted, ws, connection, manager = run_with_manager(scenario)
+    assert (early, evicted) == (0, 1)
+    assert connection.connection_id not in manager.active_connections
+    assert ws.closed == HEARTBEAT_CLOSE_CODE
+    assert manager.heartbeat_timeouts == 1
+    assert manager.idle_disconnects == 0
+
+
+def test_pong_does_not_extend_idle_timeout():
+    async def scenario(manager):
+        ws, connection = await connect(manager)
+        start = connection.connected_at
+        # Клиент исправно отвечает на ping, но ничего не пишет
+        now = start
+        while now + INTERVAL < start + IDLE:
+            now += INTERVAL
+            assert manager.check_heartbeats(now) == 0
+            connection.last_seen = now
+        evicted = manager.check_heartbeats(start + IDLE)
+        await settle()
+        return evicted, ws, manager
+
+    evicted, ws, manager = run_with_manager(scenario)
+    assert evicted == 1
+    assert ws.closed == HEARTBEAT_CLOSE_CODE
+    assert manager.idle_disconnects == 1
+    assert manager.heartbeat_timeouts == 0
+
+
+def test_activity_postpones_idle_eviction():
+    async def scenario(manager):
+        ws, connection = await connect(manager)
+        start = connection.connected_at
+        connection.last_seen = connection.last_active = start + IDLE - 1
+        evicted = manager.check_heartbeats(start + IDLE)
+        return evicted, manager
+
+    evicted, manager = run_with_manager(scenario)
+    assert evicted == 0
+    assert manager.idle_disconnects == 0
+
+
+def test_stale_heap_entries_are_skipped():
+    async def scenario(manager):
+        ws, connection = await connect(manager)
+        gone_ws, gone = await connect(manager)
+        # Запись закрытого соединения остается в куче до своего срока
+        manager.disconnect(gone_ws)
+        evicted = manager.check_heartbeats(gone.connected_at + INTERVAL)
+        await settle()
+        return evicted, ws, gone_ws, connection, manager
+
+    evicted, ws, gone_ws, connection, manager = run_with_manager(scenario, idle_timeout=0)
+    assert evicted == 0
+    assert len(pings(ws)) == 1
+    # Закрытое соединение не получает ping и не закрывается повторно
+    assert pings(gone_ws) == []
+    assert gone_ws.closed is None
+    # Запись закрытого соединения выброшена, живое перепланировано
+    assert [entry[2] for entry in manager._deadlines] == [connection]
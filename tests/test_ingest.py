@@ -0,0 +1,208 @@
+"""
+Стадия ingest: общий пул, порядок запросов соединения, лимиты
+"""
+import asyncio
+import uuid
+
+from app.ingest import IngestPool
+
+
+def test_slow_request_does_not_block_other_connections():
+    async def run():
+        pool = IngestPool(lambda *args: None, workers=2)
+        await pool.start()
+        done = []
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            done.append("slow")
+
+        async def fast(name):
+            done.append(name)
+
+        slow_connection = uuid.uuid4()
+        pool.submit(slow_connection, slow)
+        # Сколько бы соединений ни было, пока один воркер занят, работает второй
+        for i in range(20):
+            pool.submit(uuid.uuid4(), lambda i=i: fast(i))
+        await asyncio.sleep(0.01)
+        finished_before_release = len(done)
+        release.set()
+        await pool.stop(timeout=1)
+        return finished_before_release, done
+
+    finished_before_release, done = asyncio.run(run())
+    assert finished_before_release == 20
+    assert done[-1] == "slow"
+
+
+def test_requests_of_one_connection_run_in_order_one_at_a_time():
+    async def run():
+        pool = IngestPool(lambda *args: None, workers=4)
+        await pool.start()
+        connection_id = uuid.uuid4()
+        running = 0
+        overlap = False
+        order = []
+
+        async def job(i):
+            nonlocal running, overlap
+            running += 1
+            overlap = overlap or running > 1
+            await asyncio.sleep(0.001 * (5 - i))
+            order.append(i)
+            running -= 1
+
+        for i in range(5):
+            pool.submit(connection_id, lambda i=i: job(i))
+        await pool.stop(timeout=1)
+        return order, overlap
+
+    order, overlap = asyncio.run(run())
+    assert order == [0, 1, 2, 3, 4]
+    assert not overlap
+
+
+class Overloads(list):
+    """Кадры overload: (connection_id, причина, retry_after)."""
+
+    def __call__(self, connection_id, reason, retry_after):
+        self.append((connection_id, reason, retry_after))
+
+
+def test_in_flight_limit_rejects_with_queue_full():
+    async def run():
+        overloads = Overloads()
+        pool = IngestPool(overloads, workers=1, max_in_flight=2)
+        await pool.start()
+        release = asyncio.Event()
+
+        async def job():
+            await release.wait()
+
+        connection_id = uuid.uuid4()
+        accepted = [pool.submit(connection_id, job) for _ in range(3)]
+        release.set()
+        await pool.stop(timeout=1)
+        return accepted, overloads, pool
+
+    accepted, overloads, pool = asyncio.run(run())
+    assert accepted == [True, True, False]
+    assert [reason for _, reason, _ in overloads] == ["queue_full"]
+    assert pool.rejected_full == 1
+    assert pool.in_flight == 0
+
+
+def test_request_past_deadline_is_not_executed():
+    async def run():
+        overloads = Overloads()
+        pool = IngestPool(overloads, workers=1, queue_deadline_ms=20)
+        await pool.start()
+        executed = []
+
+        async def blocker():
+            await asyncio.sleep(0.05)
+
+        async def late():
+            executed.append("late")
+
+        pool.submit(uuid.uuid4(), blocker)
+        pool.submit(uuid.uuid4(), late)
+        await pool.stop(timeout=1)
+        return executed, overloads, pool
+
+    executed, overloads, pool = asyncio.run(run())
+    assert executed == []
+    assert [reason for _, reason, _ in overloads] == ["deadline"]
+    assert pool.rejected_deadline == 1
+    assert 0 < overloads[0][2] <= 0.02
+
+
+def test_deferred_job_runs_after_accepted_requests_and_past_the_deadline():
+    async def run():
+        pool = IngestPool(Overloads(), workers=2, max_in_flight=2, queue_deadline_ms=10)
+        await pool.start()
+        connection_id = uuid.uuid4()
+        order = []
+
+        async def job(name):
+            await asyncio.sleep(0.02)
+            order.append(name)
+
+        pool.submit(connection_id, lambda: job("first"))
+        pool.submit(connection_id, lambda: job("second"))
+        # defer не упирается в лимит и срок ожидания
+        deferred = pool.defer(connection_id, lambda: job("disconnect"))
+        await pool.stop(timeout=1)
+        return deferred, order
+
+    deferred, order = asyncio.run(run())
+    assert deferred
+    # second прождал дольше срока и отклонен, disconnect выполнен всегда
+    assert order == ["first", "disconnect"]
+
+
+def test_stop_drains_accepted_requests_and_refuses_new_ones():
+    async def run():
+        overloads = Overloads()
+        pool = IngestPool(overloads, workers=2)
+        await pool.start()
+        done = []
+
+        async def job(i):
+            await asyncio.sleep(0.01)
+            done.append(i)
+
+        for i in range(10):
+            pool.submit(uuid.uuid4(), lambda i=i: job(i))
+        await pool.stop(timeout=1)
+        accepted_after_stop = pool.submit(uuid.uuid4(), lambda: job(99))
+        deferred_after_stop = pool.defer(uuid.uuid4(), lambda: job(99))
+        return sorted(done), accepted_after_stop, deferred_after_stop, overloads
+
+    done, accepted_after_stop, deferred_after_stop, overloads = asyncio.run(run())
+    assert done == list(range(10))
+    assert not accepted_after_stop
+    assert not deferred_after_stop
+    assert [reason for _, reason, _ in overloads] == ["queue_full"]
+
+
+def test_stop_gives_up_after_timeout():
+    async def run():
+        pool = IngestPool(Overloads(), workers=1)
+        await pool.start()
+
+        async def hang():
+            await asyncio.sleep(3600)
+
+        pool.submit(uuid.uuid4(), hang)
+        await pool.stop(timeout=0.05)
+        return pool
+
+    pool = asyncio.run(run())
+    assert pool.in_flight == 0
+    assert pool.get_stats()["busy_connections"] == 0
+
+
+def test_failed_job_is_counted_and_chain_continues():
+    async def run():
+        pool = IngestPool(Overloads(), workers=1)
+        await pool.start()
+        connection_id = uuid.uuid4()
+        done = []
+
+        async def broken():
+            raise RuntimeError("db error")
+
+        async def ok():
+            done.append("ok")
+
+        pool.submit(connection_id, broken)
+        pool.submit(connection_id, ok)
+        await pool.stop(timeout=1)
+        return pool, done
+
+    pool, done = asyncio.run(run())
+    assert pool.failed == 1
+    assert done == ["ok"]
@@ -0,0 +1,27 @@
+"""
+Текстовый формат /metrics
+"""
+from app.metrics import CallbackMetric, Counter, Histogram, Registry
+
+
+def test_const_labels_mark_every_sample():
+    registry = Registry()
+    registry.const_labels["shard"] = "host:1"
+    registry.register(Counter("c_total", "counter")).inc(2)
+    registry.register(CallbackMetric("g", "gauge", "gauge", lambda: 3))
+    histogram = registry.register(Histogram("h_seconds", "histogram", labelnames=("query",), buckets=(1.0,)))
+    histogram.labels("q").observe(0.5)
+
+    samples = [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+    assert 'c_total{shard="host:1"} 2' in samples
+    assert 'g{shard="host:1"} 3' in samples
+    assert 'h_seconds_bucket{shard="host:1",query="q",le="1.0"} 1' in samples
+    assert 'h_seconds_count{shard="host:1",query="q"} 1' in samples
+
+
+def test_no_labels_without_const_labels():
+    registry = Registry()
+    registry.register(Counter("c_total", "counter")).inc()
+
+    assert "c_total 1" in registry.render().splitlines()
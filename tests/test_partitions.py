@@ -0,0 +1,67 @@
+"""
+Обслуживание секций при нескольких воркерах
+"""
+import asyncio
+
+import app.partitions as partitions
+from app.partitions import PartitionManager
+
+
+class FakeConnection:
+    def __init__(self, locked):
+        self.locked = locked
+        self.queries = []
+        self.closed = False
+
+    async def fetchval(self, query, *args):
+        self.queries.append(query)
+        if "pg_try_advisory_lock" in query:
+            return not self.locked
+        return False  # Таблица не секционирована
+
+    async def execute(self, query, *args):
+        self.queries.append(query)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_skips_pass_when_another_process_holds_the_lock(monkeypatch):
+    conn = FakeConnection(locked=True)
+
+    async def connect(dsn):
+        return conn
+
+    monkeypatch.setattr(partitions.asyncpg, "connect", connect)
+    asyncio.run(PartitionManager(dsn="postgresql://").run_once())
+
+    assert len(conn.queries) == 1
+    assert conn.closed
+
+
+def test_lock_holder_runs_maintenance(monkeypatch):
+    conn = FakeConnection(locked=False)
+
+    async def connect(dsn):
+        return conn
+
+    monkeypatch.setattr(partitions.asyncpg, "connect", connect)
+    asyncio.run(PartitionManager(dsn="postgresql://").run_once())
+
+    assert any("pg_partitioned_table" in query for query in conn.queries)
+
+
+def test_startup_error_does_not_fail_start(monkeypatch):
+    async def connect(dsn):
+        raise ConnectionRefusedError(111, "Connection refused")
+
+    monkeypatch.setattr(partitions.asyncpg, "connect", connect)
+
+    async def run():
+        manager = PartitionManager(dsn="postgresql://")
+        await manager.start()
+        running = manager._task is not None and not manager._task.done()
+        await manager.stop()
+        return running
+
+    assert asyncio.run(run())
@@ -0,0 +1,65 @@
+"""
+Фоновая запись write-behind при недоступной БД
+"""
+import asyncio
+import uuid
+
+from app.persistence import MessageWriter
+
+
+class RefusedSession:
+    """Фабрика сессий, как при остановленной PostgreSQL."""
+
+    async def __aenter__(self):
+        raise ConnectionRefusedError(111, "Connection refused")
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_unreachable_db_drops_batch_after_retries():
+    async def run():
+        writer = MessageWriter(RefusedSession, flush_interval_ms=1, retries=2)
+        # id назначены заранее, резервирование из последовательности не нужно
+        writer._ids.extend(range(1, 4))
+        await writer.start()
+        for number in range(3):
+            await writer.submit(f"m{number}", uuid.uuid4(), number)
+        await writer.flush(timeout=5)
+        alive = not writer._task.done()
+        await writer.stop(timeout=1)
+        return writer, alive
+
+    writer, alive = asyncio.run(run())
+    assert alive
+    assert writer.failed_messages == 3
+    assert writer.flushed_messages == 0
+
+
+def test_crashed_task_is_restarted():
+    async def run():
+        writer = MessageWriter(RefusedSession, flush_interval_ms=1)
+        writer._ids.extend(range(1, 3))
+        flushed = []
+
+        async def flush(batch):
+            if not flushed:
+                flushed.append(None)
+                raise RuntimeError("boom")
+            flushed.extend(row["id"] for row in batch)
+
+        writer._flush = flush
+        await writer.start()
+        first = writer._task
+        await writer.submit("first", uuid.uuid4(), 0)
+        await writer.flush(timeout=1)
+        await asyncio.sleep(0)
+        await writer.submit("second", uuid.uuid4(), 1)
+        await writer.flush(timeout=1)
+        restarted = writer._task is not first and not writer._task.done()
+        await writer.stop(timeout=1)
+        return flushed, restarted
+
+    flushed, restarted = asyncio.run(run())
+    assert restarted
+    assert flushed == [None, 2]
@@ -0,0 +1,119 @@
+"""
+Лимит частоты для пакетов сообщений
+
+Тесты гоняют websocket_endpoint с поддельным сокетом, без PostgreSQL:
+история пустая, а сохранение сообщений подменено.
+"""
+import asyncio
+import datetime
+import itertools
+import json
+
+import app.main as main
+from app.ingest import IngestPool
+from app.models import Message
+from app.rate_limit import RATE_LIMIT_BURST
+from app.schemas import BATCH_MAX_MESSAGES
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeWebSocket:
+    """Отдает заданные кадры, затем отключается, и запоминает ответы."""
+    scope = {}
+    client = None
+    query_params = {}
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+        self.sent = []
+
+    async def accept(self, *args, **kwargs):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+    async def receive(self):
+        await asyncio.sleep(0)
+        if self.frames:
+            return {"type": "websocket.receive", "text": json.dumps(self.frames.pop(0))}
+        return {"type": "websocket.disconnect", "code": 1000}
+
+
+def run_session(monkeypatch, frames):
+    ids = itertools.count(1)
+
+    async def get_message_history(db, limit, **kwargs):
+        return []
+
+    async def save_message(db, text, connection_id, number, room):
+        return Message(
+            id=next(ids), text=text, room=room, connection_id=connection_id,
+            user_message_number=number, created_at=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    async def save_messages(db, texts, connection_id, first_number, room):
+        return [await save_message(db, text, connection_id, first_number + i, room) for i, text in enumerate(texts)]
+
+    monkeypatch.setattr(main, "AsyncSessionLocal", FakeSession)
+    # Очереди пула привязываются к event loop, а каждый тест запускает свой
+    monkeypatch.setattr(main, "ingest", IngestPool(main.send_overload))
+    monkeypatch.setattr(main.manager, "get_message_history", get_message_history)
+    monkeypatch.setattr(main.manager, "save_message", save_message)
+    monkeypatch.setattr(main.manager, "save_messages", save_messages)
+
+    async def session():
+        await main.ingest.start()
+        try:
+            ws = FakeWebSocket(frames)
+            await main.websocket_endpoint(ws)
+        finally:
+            await main.ingest.stop()
+        return ws.sent
+
+    return asyncio.run(session())
+
+
+def batch(size):
+    return {"type": "batch", "messages": [{"text": f"m{i}"} for i in range(size)]}
+
+
+def test_batch_max_messages_fits_burst():
+    assert BATCH_MAX_MESSAGES <= RATE_LIMIT_BURST
+
+
+def test_batch_above_burst_is_rejected(monkeypatch):
+    # Всплеск меньше BATCH_MAX_MESSAGES, чтобы пакет прошел проверку схемы
+    burst = 3
+    monkeypatch.setattr(main.manager, "rate_limit", 5)
+    monkeypatch.setattr(main.manager, "rate_limit_burst", burst)
+
+    sent = run_session(monkeypatch, [batch(burst + 1), batch(burst)])
+
+    kinds = [frame["type"] for frame in sent]
+    assert "throttle" not in kinds
+    errors = [frame for frame in sent if frame["type"] == "error"]
+    assert len(errors) == 1
+    assert "Batch too large" in errors[0]["message"]
+    # Пакет размером со всплеск проходит
+    assert [len(frame["messages"]) for frame in sent if frame["type"] == "batch"] == [burst]
+
+
+def test_init_frame_carries_limits(monkeypatch):
+    monkeypatch.setattr(main.manager, "rate_limit", 5)
+    monkeypatch.setattr(main.manager, "rate_limit_burst", 3)
+
+    init = run_session(monkeypatch, [])[0]
+
+    assert init["type"] == "init"
+    assert init["limits"] == {"batch_max_messages": min(BATCH_MAX_MESSAGES, 3), "rate": 5, "burst": 3}
@@ -0,0 +1,105 @@
+"""
+Кадры init/resume и рассылки, пришедшие пока кадр собирался
+"""
+import asyncio
+import datetime
+import json
+import uuid
+
+from app.connection_manager import ConnectionManager
+from app.models import DEFAULT_ROOM, Message
+
+
+class FakeWebSocket:
+    scope = {}
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, *args, **kwargs):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def message(message_id):
+    return Message(
+        id=message_id, text=f"m{message_id}", room=DEFAULT_ROOM, connection_id=uuid.uuid4(),
+        user_message_number=message_id, created_at=datetime.datetime.now(datetime.timezone.utc),
+    )
+
+
+def received_ids(ws, frame):
+    """id сообщений из кадра init/resume и из всего, что пришло рассылкой."""
+    ids = [m["id"] for m in frame.get("history", frame.get("messages", []))]
+    for sent in ws.sent:
+        if sent["type"] == "message":
+            ids.append(sent["id"])
+    return ids
+
+
+async def connect(manager):
+    ws = FakeWebSocket()
+    connection_id = await manager.connect(ws, subscribe=False)
+    return ws, connection_id
+
+
+def test_init_does_not_repeat_messages_broadcast_while_loading():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0)
+
+        async def get_message_history(db, limit, **kwargs):
+            # Сообщение разослано, пока грузится история
+            await manager.broadcast_message(message(1))
+            return []
+
+        manager.get_message_history = get_message_history
+        ws, connection_id = await connect(manager)
+        frame = json.loads(await manager.get_init_frame(None, connection_id))
+        await manager.broadcast_message(message(2))
+        await asyncio.sleep(0)
+        return received_ids(ws, frame)
+
+    assert asyncio.run(run()) == [1, 2]
+
+
+def test_resume_follows_broadcast_order_not_ids():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0)
+
+        async def get_message_history(db, limit, **kwargs):
+            return [message(i) for i in (3, 4)]
+
+        manager.get_message_history = get_message_history
+        await manager.warm_history(None)
+        # Сообщение 6 закоммичено и разослано раньше 5
+        for message_id in (6, 5, 7):
+            await manager.broadcast_message(message(message_id))
+
+        ws, connection_id = await connect(manager)
+        frame = json.loads(await manager.get_resume_frame(None, connection_id, 6))
+        await manager.broadcast_message(message(8))
+        await asyncio.sleep(0)
+        return received_ids(ws, frame)
+
+    assert asyncio.run(run()) == [5, 7, 8]
+
+
+def test_resume_outside_buffer_falls_back_to_init():
+    async def run():
+        manager = ConnectionManager(heartbeat_interval=0, history_limit=2, resume_max_messages=2)
+
+        async def get_message_history(db, limit, **kwargs):
+            return [message(i) for i in range(1, 11)][-limit:]
+
+        manager.get_message_history = get_message_history
+        ws, connection_id = await connect(manager)
+        resume = await manager.get_resume_frame(None, connection_id, 7)
+        init = json.loads(await manager.get_init_frame(None, connection_id))
+        return resume, [m["id"] for m in init["history"]]
+
+    resume, history = asyncio.run(run())
+    assert resume is None
+    # Буфер вмещает окно возобновления, но init отдает history_limit сообщений
+    assert history == [9, 10]
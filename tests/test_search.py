@@ -0,0 +1,28 @@
+"""
+Экранирование фрагментов поиска
+"""
+from app.connection_manager import SEARCH_MARK_START, SEARCH_MARK_STOP, _escape_snippet
+
+
+def mark(word):
+    return SEARCH_MARK_START + word + SEARCH_MARK_STOP
+
+
+def test_matches_become_mark_tags():
+    snippet = f"найдено {mark('слово')} и {mark('ещё')}"
+    assert _escape_snippet(snippet) == "найдено <mark>слово</mark> и <mark>ещё</mark>"
+
+
+def test_html_in_message_text_stays_text():
+    snippet = f"<script>alert(1)</script> {mark('чат')} & <b>"
+    assert _escape_snippet(snippet) == (
+        "&lt;script&gt;alert(1)&lt;/script&gt; <mark>чат</mark> &amp; &lt;b&gt;"
+    )
+
+
+def test_literal_mark_tags_in_message_text_are_not_unescaped():
+    snippet = f"<mark>фальшивое</mark> &lt;mark&gt;тоже&lt;/mark&gt; {mark('настоящее')}"
+    assert _escape_snippet(snippet) == (
+        "&lt;mark&gt;фальшивое&lt;/mark&gt; &amp;lt;mark&amp;gt;тоже&amp;lt;/mark&amp;gt; "
+        "<mark>настоящее</mark>"
+    )